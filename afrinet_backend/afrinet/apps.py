@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AfrinetConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'afrinet'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,85 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from django.utils import timezone
+from .models import DailyRevenue, DailyUsage, HostspotUser, Session
+
+CACHE_KEY = 'dashboard:snapshot'
+
+
+def build_dashboard_snapshot():
+    """
+    Compute every admin dashboard panel from the daily rollup tables plus two
+    live counts for active clients and sessions, so the cost does not grow
+    with the size of the Payment and Session tables.
+    """
+    now = timezone.now()
+    today = timezone.localdate()
+    week = [today - timedelta(days=i) for i in range(6, -1, -1)]
+    month_start = today.replace(day=1)
+    distribution_start = today - timedelta(days=30)
+
+    # Completed revenue by day since the start of the month or week, whichever is earlier
+    revenue_by_day = {
+        row['date']: row
+        for row in DailyRevenue.objects.filter(date__gte=min(month_start, week[0]))
+        .values('date')
+        .annotate(amount=Sum('sum_amount'), payments=Sum('count'))
+    }
+
+    # Sessions by day and package over the distribution window
+    sessions_by_day = {}
+    sessions_by_package = {}
+    rows = (
+        DailyUsage.objects.filter(date__gte=distribution_start)
+        .values('date', 'package_id', 'package__package_name', 'sessions')
+        .order_by('package_id')
+    )
+    for row in rows:
+        sessions_by_day[row['date']] = sessions_by_day.get(row['date'], 0) + row['sessions']
+        if row['package_id'] is not None:
+            name = row['package__package_name']
+            sessions_by_package[name] = sessions_by_package.get(name, 0) + row['sessions']
+
+    counts = HostspotUser.objects.filter(status='active').aggregate(total_clients=Count('id'))
+    counts.update(Session.objects.filter(is_active=True, status='active').aggregate(active_sessions=Count('id')))
+
+    return {
+        'stats': {
+            'monthly_amount': float(sum(
+                row['amount'] or 0 for day, row in revenue_by_day.items() if day >= month_start
+            )),
+            'total_clients': counts['total_clients'],
+            'active_sessions': counts['active_sessions'],
+            'recent_payments': sum(
+                row['payments'] or 0 for day, row in revenue_by_day.items() if day >= week[0]
+            ),
+        },
+        'payment_chart': {
+            'labels': [day.strftime('%a') for day in week],
+            'data': [float((revenue_by_day.get(day) or {}).get('amount') or 0) for day in week],
+        },
+        'user_activity': {
+            'labels': [day.strftime('%a') for day in week],
+            'data': [sessions_by_day.get(day, 0) for day in week],
+        },
+        'package_distribution': {
+            'labels': list(sessions_by_package.keys()),
+            'data': list(sessions_by_package.values()),
+        },
+        'generated_at': now.isoformat(),
+    }
+
+
+def get_dashboard_snapshot():
+    """Return the cached dashboard snapshot, rebuilding it when missing or stale"""
+    snapshot = cache.get(CACHE_KEY)
+    if snapshot is None:
+        snapshot = build_dashboard_snapshot()
+        cache.set(CACHE_KEY, snapshot, getattr(settings, 'DASHBOARD_CACHE_TTL', 30))
+    return snapshot
+
+
+def invalidate_dashboard():
+    cache.delete(CACHE_KEY)
@@ -0,0 +1,246 @@
+import logging
+import select
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from .metrics import active_sessions, session_expiry_batch_seconds, sessions_expired_total
+from .models import Session
+from .rollups import record_sessions_ended
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'session_expiry'
+
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel with one-second ticks.
+
+    Level 0 holds deadlines in the next minute (one bucket per second), level
+    1 the next hour (one bucket per minute), level 2 the next day and level 3
+    the next 30 days. When the wheel enters a new slot of a higher level that
+    bucket is cascaded down, so adding and expiring an entry is O(1)
+    regardless of how many sessions are scheduled. Deadlines further out wait
+    in an overflow list until they fit.
+
+    Rescheduling a key just adds it again; stale entries are skipped because
+    only the latest deadline recorded for a key is honoured.
+    """
+    def __init__(self, now_tick, slots=(60, 60, 24, 30)):
+        self.slots = slots
+        self.spans = []
+        span = 1
+        for count in slots:
+            self.spans.append(span)
+            span *= count
+        self.horizon = span
+        self.wheels = [[[] for _ in range(count)] for count in slots]
+        self.overflow = []
+        self.deadlines = {}
+        self.now_tick = now_tick
+        self._due = []
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def add(self, key, deadline):
+        self.deadlines[key] = deadline
+        self._place(key, deadline)
+
+    def remove(self, key):
+        self.deadlines.pop(key, None)
+
+    def advance(self, to_tick):
+        """Move the wheel forward to `to_tick` and return the keys that expired"""
+        expired = self._collect(self._due)
+        self._due = []
+        while self.now_tick < to_tick:
+            self.now_tick += 1
+            tick = self.now_tick
+            if tick % self.horizon == 0:
+                overflow, self.overflow = self.overflow, []
+                for key, deadline in overflow:
+                    self._place(key, deadline)
+            for level in range(len(self.slots) - 1, 0, -1):
+                span = self.spans[level]
+                if tick % span == 0:
+                    bucket = self.wheels[level][(tick // span) % self.slots[level]]
+                    entries = bucket[:]
+                    bucket.clear()
+                    for key, deadline in entries:
+                        self._place(key, deadline)
+            bucket = self.wheels[0][tick % self.slots[0]]
+            expired.extend(self._collect(bucket))
+            bucket.clear()
+            expired.extend(self._collect(self._due))
+            self._due = []
+        return expired
+
+    def _place(self, key, deadline):
+        if deadline <= self.now_tick:
+            self._due.append((key, deadline))
+            return
+        for level, span in enumerate(self.spans):
+            if deadline // span - self.now_tick // span < self.slots[level]:
+                self.wheels[level][(deadline // span) % self.slots[level]].append((key, deadline))
+                return
+        self.overflow.append((key, deadline))
+
+    def _collect(self, entries):
+        expired = []
+        for key, deadline in entries:
+            if self.deadlines.get(key) == deadline:
+                del self.deadlines[key]
+                expired.append(key)
+        return expired
+
+
+def notify_session_scheduled(session):
+    """Tell a running expiry service about a new or extended session"""
+    notify_sessions_scheduled([session])
+
+
+def notify_sessions_scheduled(sessions):
+    """
+    notify_session_scheduled for many sessions, e.g. after a bulk_create or
+    bulk_update (which send no post_save); one NOTIFY per session, sent with
+    a single query after commit.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    payloads = [
+        f"{session.pk}:{int(session.end_time.timestamp())}"
+        for session in sessions if session.end_time and session.status == 'active'
+    ]
+    if not payloads:
+        return
+
+    def send():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload", [NOTIFY_CHANNEL, payloads])
+
+    transaction.on_commit(send)
+
+
+class SessionExpiryService:
+    """
+    Expires sessions within a second of their end_time.
+
+    Active sessions are loaded into a TimingWheel at start-up, new ones
+    arrive through PostgreSQL LISTEN/NOTIFY, and every tick the due sessions
+    are expired in batches of `batch_size` and kicked off the router. On
+    other databases there is no notification channel, so the wheel is
+    rebuilt from the database every `resync_interval` seconds instead.
+    """
+    def __init__(self, batch_size=200, resync_interval=3600, kick_users=True):
+        self.batch_size = batch_size
+        self.resync_interval = resync_interval
+        self.kick_users = kick_users
+        self.wheel = None
+        self._listener = None
+        self._router_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-kick')
+        self._last_rebuild = 0
+        self.expired_total = 0
+
+    def rebuild(self):
+        """Load every active session with an end_time into a fresh wheel"""
+        self.wheel = TimingWheel(int(time.time()))
+        sessions = Session.objects.filter(
+            status='active',
+            end_time__isnull=False
+        ).values_list('pk', 'end_time').iterator(chunk_size=5000)
+        for pk, end_time in sessions:
+            self.wheel.add(pk, int(end_time.timestamp()))
+        self._last_rebuild = time.time()
+        logger.info(f"Session expiry wheel loaded with {len(self.wheel)} sessions")
+
+    def run(self, stop=lambda: False):
+        self._listen()
+        self.rebuild()
+        while not stop():
+            next_tick = int(time.time()) + 1
+            self._wait_for_notifications(next_tick - time.time())
+            if time.time() >= next_tick:
+                self.expire(self.wheel.advance(int(time.time())))
+            if time.time() - self._last_rebuild >= self._current_resync_interval():
+                self.rebuild()
+
+    def expire(self, session_ids):
+        """Expire the given sessions in small batches; returns how many were expired"""
+        expired = 0
+        for start in range(0, len(session_ids), self.batch_size):
+            batch = session_ids[start:start + self.batch_size]
+            now = timezone.now()
+            with session_expiry_batch_seconds.time(), transaction.atomic():
+                due = list(
+                    Session.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+                        pk__in=batch,
+                        status='active',
+                        end_time__lte=now
+                    ).values_list('pk', 'device_mac', 'user__username')
+                )
+                Session.objects.filter(pk__in=[pk for pk, _, _ in due]).update(
+                    status='expired',
+                    is_active=False,
+                    disconnected_at=now
+                )
+                record_sessions_ended([pk for pk, _, _ in due])
+            # Reschedule sessions that were extended or locked by another writer
+            for pk, end_time in Session.objects.filter(
+                pk__in=set(batch) - {pk for pk, _, _ in due},
+                status='active',
+                end_time__isnull=False
+            ).values_list('pk', 'end_time'):
+                self.wheel.add(pk, max(int(end_time.timestamp()), self.wheel.now_tick + 1))
+            sessions_expired_total.inc(len(due))
+            active_sessions.dec(len(due))
+            if due and self.kick_users:
+                self._router_executor.submit(self._kick, due)
+            expired += len(due)
+        if expired:
+            self.expired_total += expired
+            logger.info(f"Expired {expired} sessions")
+        return expired
+
+    def _kick(self, sessions):
+        from .mikrotik import MikroTik
+        try:
+            MikroTik().disconnect_active(
+                mac_addresses={mac for _, mac, _ in sessions if mac},
+                usernames={username for _, _, username in sessions if username}
+            )
+        except Exception as e:
+            logger.error(f"Failed to disconnect expired sessions from router: {str(e)}")
+        finally:
+            close_old_connections()
+
+    def _current_resync_interval(self):
+        if self._listener is None:
+            return min(self.resync_interval, 30)
+        return self.resync_interval
+
+    def _listen(self):
+        if connection.vendor != 'postgresql':
+            logger.warning("No LISTEN/NOTIFY support; session expiry falls back to periodic rebuilds")
+            return
+        self._listener = connection.get_new_connection(connection.get_connection_params())
+        self._listener.autocommit = True
+        with self._listener.cursor() as cursor:
+            cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+
+    def _wait_for_notifications(self, timeout):
+        timeout = max(timeout, 0)
+        if self._listener is None:
+            time.sleep(timeout)
+            return
+        if select.select([self._listener], [], [], timeout) == ([], [], []):
+            return
+        self._listener.poll()
+        while self._listener.notifies:
+            notification = self._listener.notifies.pop(0)
+            try:
+                pk, deadline = notification.payload.split(':')
+                self.wheel.add(int(pk), int(deadline))
+            except ValueError:
+                logger.error(f"Invalid session expiry notification: {notification.payload}")
@@ -0,0 +1,169 @@
+import csv
+import json
+import logging
+import zlib
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Payment, Session, Voucher
+
+logger = logging.getLogger(__name__)
+
+# Column header -> ORM lookup. Rows are read with values_list so no model
+# instances are built.
+EXPORTS = {
+    'payments': (Payment, [
+        ('id', 'id'),
+        ('transaction_id', 'transaction_id'),
+        ('mpesa_receipt', 'mpesa_receipt'),
+        ('phone', 'phone'),
+        ('amount', 'amount'),
+        ('package', 'package__package_name'),
+        ('status', 'status'),
+        ('is_checked', 'is_checked'),
+        ('created_at', 'created_at'),
+        ('completed_at', 'completed_at'),
+    ]),
+    'sessions': (Session, [
+        ('session_id', 'session_id'),
+        ('phone', 'phone'),
+        ('voucher_code', 'voucher_code'),
+        ('device_mac', 'device_mac'),
+        ('ip_address', 'ip_address'),
+        ('package', 'package__package_name'),
+        ('payment', 'payment__transaction_id'),
+        ('status', 'status'),
+        ('duration_minutes', 'duration_minutes'),
+        ('bytes_in', 'bytes_in'),
+        ('bytes_out', 'bytes_out'),
+        ('created_at', 'created_at'),
+        ('end_time', 'end_time'),
+        ('disconnected_at', 'disconnected_at'),
+    ]),
+    'vouchers': (Voucher, [
+        ('code', 'code'),
+        ('batch_id', 'batch_id'),
+        ('phone', 'phone'),
+        ('package', 'payment__package__package_name'),
+        ('payment', 'payment__transaction_id'),
+        ('is_used', 'is_used'),
+        ('created_at', 'created_at'),
+        ('end_time', 'end_time'),
+    ]),
+}
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class ExportError(Exception):
+    """Invalid export parameters"""
+
+
+def parse_bound(value, end=False):
+    """
+    Parse a `start`/`end` query value. A bare date covers the whole day, so
+    end=2024-05-31 includes everything up to midnight of June 1st.
+    """
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ExportError(f"Invalid date: {value}")
+        moment = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_queryset(dataset, start=None, end=None):
+    """
+    values_list queryset of a dataset within [start, end), oldest first.
+
+    Ordering on (created_at, id) walks the same index as the range filter
+    instead of sorting the whole range by id.
+    """
+    model, columns = EXPORTS[dataset]
+    queryset = model.objects.all()
+    if start is not None:
+        queryset = queryset.filter(created_at__gte=start)
+    if end is not None:
+        queryset = queryset.filter(created_at__lt=end)
+    return queryset.order_by('created_at', 'id').values_list(*[lookup for _, lookup in columns])
+
+
+def _cell(value):
+    if value is None:
+        return None
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    # Decimal, UUID
+    return str(value)
+
+
+class _Buffer:
+    """File-like sink for csv.writer that hands back what was written"""
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, value):
+        self.parts.append(value)
+        self.size += len(value)
+
+    def take(self):
+        data = ''.join(self.parts)
+        self.parts = []
+        self.size = 0
+        return data
+
+
+def stream_rows(dataset, file_format, queryset, compress=False, chunk_size=None, flush_bytes=65536):
+    """
+    Yield the encoded export in pieces of roughly `flush_bytes`.
+
+    Rows come from a server-side cursor (`iterator(chunk_size=...)`) and are
+    encoded and optionally gzipped as they arrive, so memory stays flat no
+    matter how many rows the range holds.
+    """
+    chunk_size = chunk_size or getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+    headers = [name for name, _ in EXPORTS[dataset][1]]
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = _Buffer()
+    writer = csv.writer(buffer)
+    rows = 0
+
+    def emit(text):
+        data = text.encode('utf-8')
+        return compressor.compress(data) if compressor else data
+
+    if file_format == 'csv':
+        writer.writerow(headers)
+    try:
+        for row in queryset.iterator(chunk_size=chunk_size):
+            if file_format == 'csv':
+                writer.writerow(['' if value is None else _cell(value) for value in row])
+            else:
+                buffer.write(json.dumps(dict(zip(headers, map(_cell, row))), separators=(',', ':')) + '\n')
+            rows += 1
+            if buffer.size >= flush_bytes:
+                data = emit(buffer.take())
+                if data:
+                    yield data
+        data = emit(buffer.take())
+        if compressor:
+            data += compressor.flush()
+        if data:
+            yield data
+    except Exception as e:
+        # Headers are already sent; all we can do is cut the stream short
+        logger.exception(f"Export of {dataset} failed after {rows} rows: {str(e)}")
+        raise
+    logger.info(f"Exported {rows} {dataset} as {file_format}{' (gzip)' if compress else ''}")
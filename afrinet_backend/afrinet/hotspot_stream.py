@@ -0,0 +1,176 @@
+import logging
+import queue
+import threading
+import time
+import routeros_api
+from django.conf import settings
+from django.db import close_old_connections
+from .mikrotik import disconnect_sessions, reconcile_active_sessions, sample_usage, sync_all_devices
+from .models import MikroTikDevice
+
+logger = logging.getLogger(__name__)
+
+
+def _params(device):
+    return (device.ip, device.port, device.username, device.password)
+
+
+class RouterStream(threading.Thread):
+    """
+    Follows /ip/hotspot/active on one router with the RouterOS `listen`
+    command and queues each change as ('up', entry) or ('down', mac).
+
+    The stream holds its own long-lived connection outside the request pool.
+    After any disconnect it reconnects with backoff and queues ('resync',
+    None) because changes made while it was away were missed.
+    """
+    def __init__(self, device, events, max_backoff=60):
+        super().__init__(name=f'hotspot-stream-{device.pk if device else "default"}', daemon=True)
+        self.device = device
+        self.events = events
+        self.max_backoff = max_backoff
+        self._stopped = threading.Event()
+        self._connection = None
+
+    def stop(self):
+        self._stopped.set()
+        if self._connection is not None:
+            self._connection.disconnect()
+
+    def run(self):
+        failures = 0
+        while not self._stopped.is_set():
+            try:
+                self._follow()
+                failures = 0
+            except Exception as e:
+                if self._stopped.is_set():
+                    return
+                failures += 1
+                logger.warning(f"Hotspot stream for {self._host()} lost: {str(e)}")
+            self.events.put(('resync', None))
+            self._stopped.wait(min(2 ** failures, self.max_backoff))
+
+    def _follow(self):
+        if self.device is None:
+            params = (settings.MIKROTIK_HOST, settings.MIKROTIK_PORT, settings.MIKROTIK_USERNAME, settings.MIKROTIK_PASSWORD)
+        else:
+            params = (self.device.ip, int(self.device.port or 8728), self.device.username, self.device.password)
+        self._connection = routeros_api.RouterOsApiPool(
+            host=params[0],
+            port=params[1],
+            username=params[2],
+            password=params[3],
+            plaintext_login=True
+        )
+        try:
+            api = self._connection.get_api()
+            # Changes can be quiet for hours; TCP keepalive detects a dead router instead
+            self._connection.set_timeout(None)
+            resource = api.get_resource('/ip/hotspot/active')
+            changes = resource.call_async('listen')
+            # Removals only carry the .id, so remember which MAC each id belongs to
+            macs = {entry['id']: entry.get('mac-address') for entry in resource.get()}
+            logger.info(f"Following hotspot changes on {self._host()} ({len(macs)} active)")
+            for entry in changes:
+                entry_id = entry.get('id')
+                if entry.get('.dead') in ('true', 'yes', True):
+                    mac = macs.pop(entry_id, None)
+                    if mac:
+                        self.events.put(('down', mac))
+                elif entry.get('mac-address'):
+                    macs[entry_id] = entry['mac-address']
+                    entry['router'] = self.device.pk if self.device else None
+                    self.events.put(('up', entry))
+        finally:
+            self._connection.disconnect()
+
+    def _host(self):
+        return self.device.ip if self.device else settings.MIKROTIK_HOST
+
+
+class HotspotStreamService:
+    """
+    Keeps Session rows in line with the routers by applying only the deltas.
+
+    One RouterStream per router feeds a shared queue. Every `flush_interval`
+    seconds the queued logins are upserted with one reconciliation pass and
+    the logouts disconnected with one UPDATE. A full sync_all_devices runs at
+    start-up, every `resync_interval` seconds and whenever a stream
+    reconnects, to correct any drift; it also picks up added or removed
+    devices. Data usage counters are sampled every `usage_interval` seconds.
+    """
+    def __init__(self, resync_interval=900, flush_interval=1.0, usage_interval=300):
+        self.resync_interval = resync_interval
+        self.flush_interval = flush_interval
+        self.usage_interval = usage_interval
+        self.events = queue.Queue()
+        self.streams = {}
+        self.applied = 0
+
+    def run(self, stop=lambda: False):
+        resync_at = 0
+        usage_at = time.monotonic() + self.usage_interval
+        try:
+            while not stop():
+                resync = time.monotonic() >= resync_at
+                ups, downs = {}, set()
+                deadline = time.monotonic() + self.flush_interval
+                while True:
+                    try:
+                        kind, value = self.events.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                    if kind == 'up':
+                        ups[value['mac-address']] = value
+                        downs.discard(value['mac-address'])
+                    elif kind == 'down':
+                        ups.pop(value, None)
+                        downs.add(value)
+                    else:
+                        resync = True
+
+                try:
+                    if resync:
+                        self._refresh_streams()
+                        result = sync_all_devices()
+                        resync_at = time.monotonic() + self.resync_interval
+                        usage_at = time.monotonic() + self.usage_interval
+                        logger.info(
+                            f"Hotspot resync: {result['synced_users']} active, {result['created']} created, "
+                            f"{result['updated']} updated, {result['disconnected']} disconnected"
+                        )
+                    else:
+                        self._apply(ups, downs)
+                        if time.monotonic() >= usage_at:
+                            usage_at = time.monotonic() + self.usage_interval
+                            sample_usage()
+                except Exception as e:
+                    logger.exception(f"Hotspot stream apply failed: {str(e)}")
+                    resync_at = 0
+                    close_old_connections()
+        finally:
+            for stream in self.streams.values():
+                stream.stop()
+
+    def _apply(self, ups, downs):
+        if ups:
+            # Upserts only; logouts arrive as their own events
+            reconcile_active_sessions(list(ups.values()), disconnect=False)
+        if downs:
+            disconnect_sessions(downs)
+        self.applied += len(ups) + len(downs)
+
+    def _refresh_streams(self):
+        devices = {device.pk: device for device in MikroTikDevice.objects.all()} or {None: None}
+        for key in set(self.streams) - set(devices):
+            self.streams.pop(key).stop()
+        for key, device in devices.items():
+            stream = self.streams.get(key)
+            if stream is not None and device is not None and _params(stream.device) != _params(device):
+                stream.stop()
+                stream = None
+            if stream is None or not stream.is_alive():
+                stream = RouterStream(device, self.events)
+                stream.start()
+                self.streams[key] = stream
@@ -0,0 +1,108 @@
+import json
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from rest_framework import parsers, renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.encoders import JSONEncoder as DRFJSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib fallback
+    orjson = None
+
+# orjson.JSONDecodeError subclasses this, so callers can keep catching it
+JSONDecodeError = json.JSONDecodeError
+
+_drf_default = DRFJSONEncoder().default
+_django_default = DjangoJSONEncoder().default
+
+
+def accelerated():
+    """True when responses are encoded with orjson"""
+    return orjson is not None and getattr(settings, 'FAST_JSON', True)
+
+
+def dumps(data, drf=False):
+    """
+    Encode `data` to UTF-8 JSON bytes.
+
+    With drf=True the output matches DRF's JSONRenderer (Decimal as a
+    number, datetimes in full with a Z suffix), otherwise Django's
+    JsonResponse (Decimal as a string, datetimes to the millisecond).
+    Anything orjson rejects, like non-string keys or huge integers, is
+    encoded with the stdlib encoder instead.
+    """
+    if accelerated():
+        try:
+            if drf:
+                return orjson.dumps(data, default=_drf_default, option=orjson.OPT_UTC_Z)
+            # Let DjangoJSONEncoder format datetimes so output stays identical
+            return orjson.dumps(data, default=_django_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except (orjson.JSONEncodeError, TypeError):
+            pass
+    return json.dumps(
+        data,
+        cls=DRFJSONEncoder if drf else DjangoJSONEncoder,
+        ensure_ascii=not drf,
+        separators=(',', ':') if drf else None,
+    ).encode('utf-8')
+
+
+def loads(data):
+    """Decode JSON from bytes or str; raises JSONDecodeError on bad input"""
+    if accelerated():
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class JsonResponse(HttpResponse):
+    """
+    Drop-in for django.http.JsonResponse that encodes with `dumps`. A custom
+    encoder or json_dumps_params go through the stdlib path as before.
+    """
+    def __init__(self, data, encoder=DjangoJSONEncoder, safe=True, json_dumps_params=None, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError('In order to allow non-dict objects to be serialized set the safe parameter to False.')
+        kwargs.setdefault('content_type', 'application/json')
+        if encoder is DjangoJSONEncoder and not json_dumps_params:
+            content = dumps(data)
+        else:
+            content = json.dumps(data, cls=encoder, **(json_dumps_params or {}))
+        super().__init__(content=content, **kwargs)
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """
+    DRF JSONRenderer that encodes with orjson when it can. Indented output
+    (browsable API, `; indent=` in Accept) and non-default JSON settings use
+    the stock renderer.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not accelerated() or self.encoder_class is not DRFJSONEncoder \
+                or not (self.compact and self.ensure_ascii is False and self.strict) \
+                or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        content = dumps(data, drf=True)
+        # Same escaping as DRF: U+2028/U+2029 are valid JSON but break JavaScript
+        if b'\xe2\x80' in content:
+            content = content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return content
+
+
+class JSONParser(parsers.JSONParser):
+    """DRF JSONParser that decodes with orjson when the body is UTF-8"""
+    renderer_class = JSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if not accelerated() or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,104 @@
+import io
+import json
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.http import JsonResponse as StockJsonResponse
+from django.utils import timezone
+from rest_framework.parsers import JSONParser as StockJSONParser
+from rest_framework.renderers import JSONRenderer as StockJSONRenderer
+from afrinet import jsoncodec
+from afrinet.models import Payment, Session
+from afrinet.serializers import ActiveSessionSerializer, PaymentSerializer
+
+
+def synthetic_payloads(rows):
+    """A serialized payment page and a values() style list with native Decimal/UUID/datetime"""
+    now = timezone.now()
+    serialized = [
+        {
+            'id': i,
+            'user': i % 1000,
+            'phone': f'2547{i:08d}',
+            'amount': f'{50 + i % 5 * 10}.00',
+            'transaction_id': f'ws_CO_{i:012d}',
+            'mpesa_receipt': f'RK{i:08d}',
+            'package': 'p1',
+            'status': 'completed',
+            'created_at': (now - timedelta(minutes=i)).isoformat(),
+            'is_checked': i % 3 == 0,
+        }
+        for i in range(rows)
+    ]
+    native = [
+        {
+            'session_id': uuid.UUID(int=i),
+            'phone': f'2547{i:08d}',
+            'price': Decimal(50 + i % 5 * 10),
+            'created_at': now - timedelta(minutes=i),
+            'end_time': now + timedelta(minutes=60 - i % 60),
+            'bytes_in': i * 1024,
+            'bytes_out': i * 256,
+        }
+        for i in range(rows)
+    ]
+    return serialized, native
+
+
+class Command(BaseCommand):
+    help = 'Compares the stock JSON renderer/parser/JsonResponse with afrinet.jsoncodec'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Rows per payload')
+        parser.add_argument('--repeat', type=int, default=50, help='Runs per case for the timing')
+        parser.add_argument('--db', action='store_true', help='Also serialize real payments and sessions')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        serialized, native = synthetic_payloads(rows)
+        payloads = [('serialized payments', serialized), ('native sessions', native)]
+        if options['db']:
+            payloads += [
+                ('db payments (PaymentSerializer)',
+                 PaymentSerializer(Payment.objects.select_related('user', 'package').order_by('-id')[:rows], many=True).data),
+                ('db sessions (ActiveSessionSerializer)',
+                 ActiveSessionSerializer(Session.objects.select_related('package').order_by('-id')[:rows], many=True).data),
+            ]
+
+        self.stdout.write(f'orjson: {"yes" if jsoncodec.accelerated() else "no (stdlib fallback)"}')
+        stock_renderer, fast_renderer = StockJSONRenderer(), jsoncodec.JSONRenderer()
+        for name, data in payloads:
+            stock = stock_renderer.render(data)
+            fast = fast_renderer.render(data)
+            if json.loads(stock) != json.loads(fast):
+                self.stdout.write(self.style.ERROR(f'{name}: renderer output differs'))
+            self.report(f'{name}: DRF render', options['repeat'],
+                        lambda: stock_renderer.render(data), lambda: fast_renderer.render(data))
+            self.report(f'{name}: DRF parse', options['repeat'],
+                        lambda: StockJSONParser().parse(io.BytesIO(stock)), lambda: jsoncodec.JSONParser().parse(io.BytesIO(fast)))
+
+            body = {'results': data}
+            stock_response = StockJsonResponse(body).content
+            if json.loads(stock_response) != json.loads(jsoncodec.JsonResponse(body).content):
+                self.stdout.write(self.style.ERROR(f'{name}: JsonResponse output differs'))
+            self.report(f'{name}: JsonResponse', options['repeat'],
+                        lambda: StockJsonResponse(body), lambda: jsoncodec.JsonResponse(body))
+            self.report(f'{name}: json.loads', options['repeat'],
+                        lambda: json.loads(stock_response), lambda: jsoncodec.loads(stock_response))
+
+    def report(self, name, repeat, stock, fast):
+        results = []
+        for case in (stock, fast):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                case()
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            results.append(timings[len(timings) // 2])
+        self.stdout.write(self.style.MIGRATE_HEADING(name))
+        self.stdout.write(
+            f'  stock p50 {results[0]:.2f} ms  fast p50 {results[1]:.2f} ms  ({results[0] / max(results[1], 1e-6):.1f}x)'
+        )
@@ -0,0 +1,140 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+from afrinet.models import HostspotUser, Package, Payment, Session
+
+BENCH_PREFIX = 'BENCH'
+
+
+def hot_queries():
+    """The Session/Payment query shapes used by the API views"""
+    now = timezone.now()
+    return [
+        ('active sessions (ActiveUserList)',
+         Session.objects.filter(is_active=True, status='active')[:100]),
+        ('latest session by phone (UserSessionView)',
+         Session.objects.filter(phone=f'{BENCH_PREFIX}0000042', status='active').order_by('-created_at')[:1]),
+        ('due sessions (expiry)',
+         Session.objects.filter(status='active', end_time__lte=now).values_list('pk')[:200]),
+        ('session by payment (verify_session)',
+         Session.objects.filter(payment_id=1)[:1]),
+        ('sessions in last 30 days per package (dashboard)',
+         Session.objects.filter(created_at__gte=now - timedelta(days=30), package_id=1).values('pk')),
+        ('payment by transaction and phone (verify_session)',
+         Payment.objects.filter(transaction_id=f'{BENCH_PREFIX}-42', phone=f'{BENCH_PREFIX}0000042')[:1]),
+        ('completed revenue this month (dashboard)',
+         Payment.objects.filter(status='completed', created_at__gte=now - timedelta(days=30)).values('status').annotate(total=Sum('amount'))),
+        ('unchecked payments newest first (PaymentListView)',
+         Payment.objects.filter(is_checked=False).order_by('-created_at')[:50]),
+        ('payments newest first (PaymentListView)',
+         Payment.objects.order_by('-created_at')[:50]),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Seeds synthetic sessions/payments and reports query plans and timings for the hot query shapes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=1_000_000)
+        parser.add_argument('--payments', type=int, default=1_000_000)
+        parser.add_argument('--seed', action='store_true', help='Insert the synthetic rows before measuring')
+        parser.add_argument('--cleanup', action='store_true', help='Delete the synthetic rows and exit')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per query for the timing')
+        parser.add_argument('--chunk-size', type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            deleted, _ = Payment.objects.filter(transaction_id__startswith=f'{BENCH_PREFIX}-').delete()
+            deleted += Session.objects.filter(phone__startswith=BENCH_PREFIX).delete()[0]
+            HostspotUser.objects.filter(username__startswith=f'{BENCH_PREFIX}-').delete()
+            self.stdout.write(f'Deleted {deleted} benchmark rows')
+            return
+
+        if options['seed']:
+            self.seed(options['sessions'], options['payments'], options['chunk_size'])
+
+        analyze = connection.vendor == 'postgresql'
+        for name, queryset in hot_queries():
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(
+                f'  p50 {timings[len(timings) // 2]:.2f} ms  max {timings[-1]:.2f} ms  ({options["repeat"]} runs)'
+            )
+            plan = queryset.explain(analyze=True) if analyze else queryset.explain()
+            for line in plan.splitlines():
+                self.stdout.write(f'  {line}')
+
+    def seed(self, session_count, payment_count, chunk_size):
+        if Payment.objects.filter(transaction_id__startswith=f'{BENCH_PREFIX}-').exists():
+            raise CommandError('Benchmark rows already exist; run with --cleanup first')
+
+        packages = list(Package.objects.all()[:10])
+        if not packages:
+            raise CommandError('Create at least one Package before seeding')
+
+        users = HostspotUser.objects.bulk_create(
+            HostspotUser(username=f'{BENCH_PREFIX}-{i}', phone=f'{BENCH_PREFIX}{i:07d}', user_type='hotspot')
+            for i in range(1000)
+        )
+        if users[0].pk is None:
+            users = list(HostspotUser.objects.filter(username__startswith=f'{BENCH_PREFIX}-').order_by('pk'))
+
+        now = timezone.now()
+        statuses = ['completed'] * 8 + ['failed', 'pending']
+        for start in range(0, payment_count, chunk_size):
+            with transaction.atomic():
+                Payment.objects.bulk_create([
+                    Payment(
+                        user=users[i % len(users)],
+                        phone=users[i % len(users)].phone,
+                        amount=packages[i % len(packages)].price,
+                        package=packages[i % len(packages)],
+                        transaction_id=f'{BENCH_PREFIX}-{i}',
+                        status=statuses[i % len(statuses)],
+                        is_checked=i % 3 == 0,
+                    )
+                    for i in range(start, min(start + chunk_size, payment_count))
+                ])
+            self.stdout.write(f'\rPayments: {min(start + chunk_size, payment_count)}/{payment_count}', ending='')
+        self.stdout.write('')
+
+        # auto_now_add ignores explicit values, so spread creation dates over a year afterwards
+        first_payment = Payment.objects.filter(transaction_id__startswith=f'{BENCH_PREFIX}-').order_by('id').values_list('id', flat=True).first()
+        for days in range(365):
+            Payment.objects.filter(
+                transaction_id__startswith=f'{BENCH_PREFIX}-',
+                id__gte=first_payment + days * payment_count // 365,
+                id__lt=first_payment + (days + 1) * payment_count // 365
+            ).update(created_at=now - timedelta(days=days))
+
+        for start in range(0, session_count, chunk_size):
+            with transaction.atomic():
+                Session.objects.bulk_create([
+                    Session(
+                        user=users[i % len(users)],
+                        phone=users[i % len(users)].phone,
+                        package=packages[i % len(packages)],
+                        payment_id=first_payment + i if i < payment_count else None,
+                        device_mac=f'02:00:{i >> 24 & 255:02x}:{i >> 16 & 255:02x}:{i >> 8 & 255:02x}:{i & 255:02x}',
+                        created_at=now - timedelta(minutes=i % (365 * 1440)),
+                        end_time=now - timedelta(minutes=i % (365 * 1440)) + timedelta(minutes=60),
+                        duration_minutes=60,
+                        status='active' if i % 50 == 0 else 'expired',
+                        is_active=i % 50 == 0,
+                    )
+                    for i in range(start, min(start + chunk_size, session_count))
+                ])
+            self.stdout.write(f'\rSessions: {min(start + chunk_size, session_count)}/{session_count}', ending='')
+        self.stdout.write('')
+
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {Payment._meta.db_table}, {Session._meta.db_table}')
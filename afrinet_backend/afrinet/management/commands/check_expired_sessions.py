@@ -0,0 +1,26 @@
+# management/commands/check_expired_sessions.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from afrinet.metrics import active_sessions, sessions_expired_total
+from afrinet.models import Session
+from afrinet.rollups import record_sessions_ended
+
+class Command(BaseCommand):
+    help = 'Checks and expires old sessions'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            expired_ids = list(Session.objects.filter(
+                end_time__lte=timezone.now(),
+                status='active'
+            ).values_list('pk', flat=True))
+            expired = Session.objects.filter(pk__in=expired_ids).update(
+                status='expired',
+                is_active=False,
+                disconnected_at=timezone.now()
+            )
+            record_sessions_ended(expired_ids)
+        sessions_expired_total.inc(expired)
+        active_sessions.dec(expired)
+        self.stdout.write(f'Expired {expired} sessions')
\ No newline at end of file
@@ -0,0 +1,173 @@
+import json
+import logging
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.test import override_settings
+from afrinet.models import Package
+from afrinet.vouchers import create_voucher_batch
+from loadtest.driver import LoadDriver
+from loadtest.fake_daraja import FakeDaraja
+from loadtest.fake_routeros import FakeRouterOS
+from mpesa.services import token_manager
+
+LOADTEST_PACKAGES = [
+    ('LT-1H', 'Load test 1 hour', 20, 1, 'hour', '5M'),
+    ('LT-1D', 'Load test 1 day', 50, 1, 'day', '10M'),
+]
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    # Headers and body go out in separate writes; with Nagle on, keep-alive
+    # requests would wait ~40 ms for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Replays portal traffic (packages, stk_push, callbacks, verify_session, vouchers) against local Daraja '
+        'and RouterOS stand-ins and reports throughput and p50/p95/p99 latencies. Without --target the backend '
+        'is served from this process; use a throwaway database, the run leaves its payments and sessions behind.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', help='Base URL of a running backend (e.g. gunicorn) instead of an in-process server; '
+                                             'start it with MPESA_BASE_URL and MIKROTIK_HOST/PORT pointing at the stand-ins')
+        parser.add_argument('--concurrency', type=int, default=20, help='Simultaneous portal customers')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to keep starting visits')
+        parser.add_argument('--visits', type=int, help='Stop after this many visits')
+        parser.add_argument('--voucher-share', type=float, default=0.3, help='Fraction of visits that use a voucher')
+        parser.add_argument('--vouchers', type=int, default=500, help='Vouchers to generate for redemption')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between verify_session polls')
+        parser.add_argument('--poll-timeout', type=float, default=60, help='Seconds a customer waits for a session')
+        parser.add_argument('--daraja-port', type=int, default=0)
+        parser.add_argument('--daraja-latency', type=float, default=0.2, help='Seconds each Daraja request takes')
+        parser.add_argument('--daraja-jitter', type=float, default=0.1, help='Extra random seconds per Daraja request and callback')
+        parser.add_argument('--callback-delay', type=float, default=3.0, help='Seconds from STK push to callback')
+        parser.add_argument('--stk-failure-rate', type=float, default=0.02, help='Fraction of pushes Daraja rejects')
+        parser.add_argument('--cancel-rate', type=float, default=0.1, help='Fraction of pushes the customer cancels')
+        parser.add_argument('--drop-rate', type=float, default=0.02, help='Fraction of callbacks never delivered')
+        parser.add_argument('--routeros-port', type=int, default=0)
+        parser.add_argument('--routeros-latency', type=float, default=0.01, help='Seconds each RouterOS command takes')
+        parser.add_argument('--routeros-failure-rate', type=float, default=0.0, help='Fraction of RouterOS commands that trap')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        router = FakeRouterOS(
+            port=options['routeros_port'],
+            latency=options['routeros_latency'],
+            failure_rate=options['routeros_failure_rate']
+        ).start()
+        daraja = FakeDaraja(
+            port=options['daraja_port'],
+            latency=options['daraja_latency'],
+            jitter=options['daraja_jitter'],
+            callback_delay=options['callback_delay'],
+            failure_rate=options['stk_failure_rate'],
+            cancel_rate=options['cancel_rate'],
+            drop_rate=options['drop_rate']
+        ).start()
+        if options['verbosity'] < 2:
+            # Per-request INFO logs of the in-process backend would bury the report
+            logging.disable(logging.INFO)
+        try:
+            if options['target']:
+                base_url = options['target'].rstrip('/')
+                daraja.callback_url = f'{base_url}/mpesa/callback/'
+                self.stderr.write(f'Daraja stand-in on {daraja.url}, RouterOS stand-in on 127.0.0.1:{router.port}')
+                report = self.run_load(base_url, options)
+            else:
+                report = self.run_in_process(daraja, router, options)
+        finally:
+            logging.disable(logging.NOTSET)
+            daraja.stop()
+            router.stop()
+
+        report['daraja'] = daraja.stats()
+        report['routeros'] = router.stats()
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report)
+
+    def run_in_process(self, daraja, router, options):
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler, ipv6=False)
+        server.set_app(get_internal_wsgi_application())
+        base_url = f'http://127.0.0.1:{server.server_address[1]}'
+        overrides = {
+            'MPESA_BASE_URL': daraja.url,
+            'MPESA_CALLBACK_URL': f'{base_url}/mpesa/callback/',
+            'MPESA_CONSUMER_KEY': 'loadtest',
+            'MPESA_CONSUMER_SECRET': 'loadtest',
+            'MPESA_SHORTCODE': settings.MPESA_SHORTCODE or '174379',
+            'MPESA_PASSKEY': settings.MPESA_PASSKEY or 'loadtest',
+            'MIKROTIK_HOST': router.host,
+            'MIKROTIK_PORT': router.port,
+            'MIKROTIK_USERNAME': 'admin',
+            'MIKROTIK_PASSWORD': '',
+        }
+        with override_settings(**overrides):
+            # A token cached for the real Daraja would be sent to the stand-in
+            token_manager.invalidate()
+            threading.Thread(target=server.serve_forever, name='loadtest-server', daemon=True).start()
+            try:
+                return self.run_load(base_url, options)
+            finally:
+                server.shutdown()
+                server.server_close()
+                token_manager.invalidate()
+
+    def run_load(self, base_url, options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+        package = self.ensure_packages()
+        vouchers = []
+        if options['voucher_share'] > 0 and options['vouchers'] > 0:
+            _, created = create_voucher_batch(package, options['vouchers'])
+            vouchers = [voucher.code for voucher in created]
+
+        driver = LoadDriver(
+            base_url,
+            concurrency=options['concurrency'],
+            duration=options['duration'],
+            visits=options['visits'],
+            voucher_share=options['voucher_share'],
+            poll_interval=options['poll_interval'],
+            poll_timeout=options['poll_timeout'],
+            vouchers=vouchers
+        )
+        self.stderr.write(f'Running {options["concurrency"]} customers against {base_url} ...')
+        return driver.run()
+
+    def ensure_packages(self):
+        """Create the load test packages when the catalogue is empty; returns a package for vouchers"""
+        if not Package.objects.exists():
+            for package_id, name, price, duration_value, duration_unit, speed in LOADTEST_PACKAGES:
+                Package.objects.create(
+                    package_id=package_id,
+                    package_name=name,
+                    price=price,
+                    duration_value=duration_value,
+                    duration_unit=duration_unit,
+                    speed=speed
+                )
+        return Package.objects.order_by('id').first()
+
+    def print_report(self, report):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{report["visits"]} visits, {report["requests"]} requests in {report["elapsed_s"]}s '
+            f'({report["rps"]} req/s, concurrency {report["concurrency"]})'
+        ))
+        self.stdout.write(f'{"step":<20}{"count":>8}{"errors":>8}{"req/s":>9}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"max ms":>10}')
+        for step, row in report['steps'].items():
+            self.stdout.write(
+                f'{step:<20}{row["count"]:>8}{row["errors"]:>8}{row["rps"]:>9}'
+                f'{row["p50_ms"]:>10}{row["p95_ms"]:>10}{row["p99_ms"]:>10}{row["max_ms"]:>10}'
+            )
+        self.stdout.write(f'outcomes: {report["outcomes"]}')
+        self.stdout.write(f'daraja: {report["daraja"]}')
+        self.stdout.write(f'routeros: {report["routeros"]}')
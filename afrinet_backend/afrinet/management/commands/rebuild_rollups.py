@@ -0,0 +1,35 @@
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+from afrinet.dashboard import invalidate_dashboard
+from afrinet.models import Payment, Session
+from afrinet.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the daily revenue and usage rollups from the Payment and Session tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='First day (YYYY-MM-DD), defaults to 30 days ago')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day (YYYY-MM-DD), defaults to today')
+        parser.add_argument('--all', action='store_true', help='Rebuild the whole history')
+
+    def handle(self, *args, **options):
+        end = options['end'] or timezone.localdate()
+        if options['all']:
+            first = [
+                value for value in (
+                    Payment.objects.aggregate(first=Min('created_at'))['first'],
+                    Session.objects.aggregate(first=Min('created_at'))['first'],
+                ) if value
+            ]
+            start = timezone.localdate(min(first)) if first else end
+        else:
+            start = options['start'] or end - timedelta(days=30)
+        if start > end:
+            raise CommandError('--start must not be after --end')
+
+        rebuild_rollups(start, end)
+        invalidate_dashboard()
+        self.stdout.write(f'Rebuilt rollups for {start} to {end}')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from afrinet.hotspot_stream import HotspotStreamService
+
+class Command(BaseCommand):
+    help = 'Follows hotspot logins and logouts on every router and applies them to sessions as they happen'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--resync-interval', type=int, default=900, help='Seconds between full syncs that correct drift')
+        parser.add_argument('--flush-interval', type=float, default=1.0, help='Seconds of changes applied together')
+        parser.add_argument('--usage-interval', type=int, default=300, help='Seconds between data usage samples')
+
+    def handle(self, *args, **options):
+        service = HotspotStreamService(
+            resync_interval=options['resync_interval'],
+            flush_interval=options['flush_interval'],
+            usage_interval=options['usage_interval']
+        )
+        self.stdout.write('Hotspot stream started')
+        try:
+            service.run()
+        except KeyboardInterrupt:
+            self.stdout.write(f'Stopped after applying {service.applied} changes')
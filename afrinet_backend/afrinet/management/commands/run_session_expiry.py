@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from afrinet.expiry import SessionExpiryService
+
+class Command(BaseCommand):
+    help = 'Runs the session expiry service, expiring sessions to the second and kicking them off the router'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--resync-interval', type=int, default=3600, help='Seconds between full rebuilds from the database')
+        parser.add_argument('--no-kick', action='store_true', help='Only update the database, do not disconnect users on the router')
+
+    def handle(self, *args, **options):
+        service = SessionExpiryService(
+            batch_size=options['batch_size'],
+            resync_interval=options['resync_interval'],
+            kick_users=not options['no_kick']
+        )
+        self.stdout.write('Session expiry service started')
+        try:
+            service.run()
+        except KeyboardInterrupt:
+            self.stdout.write(f'Stopped after expiring {service.expired_total} sessions')
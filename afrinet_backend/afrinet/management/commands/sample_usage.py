@@ -0,0 +1,24 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from afrinet.mikrotik import sample_usage
+from afrinet.models import SessionUsageSample
+
+
+class Command(BaseCommand):
+    help = 'Records per-session data usage from every router and prunes old usage samples'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-prune', action='store_true', help='Keep samples older than USAGE_SAMPLE_RETENTION_DAYS')
+
+    def handle(self, *args, **options):
+        result = sample_usage()
+        self.stdout.write(
+            f"Recorded usage for {result['sessions']} sessions "
+            f"({result['bytes_in']} bytes in, {result['bytes_out']} bytes out, {result['failed_devices']} routers failed)"
+        )
+        if not options['no_prune']:
+            cutoff = timezone.now() - timedelta(days=getattr(settings, 'USAGE_SAMPLE_RETENTION_DAYS', 90))
+            deleted, _ = SessionUsageSample.objects.filter(sampled_at__lt=cutoff).delete()
+            self.stdout.write(f'Pruned {deleted} usage samples')
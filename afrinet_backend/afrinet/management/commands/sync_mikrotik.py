@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from afrinet.mikrotik import sync_all_devices
+
+
+class Command(BaseCommand):
+    help = 'Syncs active hotspot sessions from every registered MikroTik router'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--timeout', type=float, help='Seconds each router gets to answer')
+        parser.add_argument('--workers', type=int, help='Routers polled in parallel')
+
+    def handle(self, *args, **options):
+        result = sync_all_devices(timeout=options['timeout'], max_workers=options['workers'])
+        for entry in result['devices']:
+            if entry['status'] == 'Online':
+                self.stdout.write(f"{entry['device']}: {entry['active_users']} active in {entry['elapsed_ms']} ms")
+            else:
+                self.stdout.write(self.style.WARNING(f"{entry['device']}: {entry['error']}"))
+        self.stdout.write(
+            f"Synced {result['synced_users']} users in {result['elapsed_ms']} ms "
+            f"(created {result['created']}, updated {result['updated']}, disconnected {result['disconnected']})"
+        )
@@ -0,0 +1,406 @@
+import atexit
+import glob
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows development servers run a single process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ARCHIVE = 'archive.json'
+ANCHORS = 'anchors.json'
+FLUSH_REQUEST = 'flush-request'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, help_text, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return json.dumps([str(labels[name]) for name in self.labels])
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount:
+            self.registry._add('counters', self.name, self._key(labels), amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        self.registry._observe(self, self._key(labels), value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the block's duration; a `result` label, if declared, can be set on the yielded dict"""
+        start = time.perf_counter()
+        outcome = dict(labels)
+        try:
+            yield outcome
+        except BaseException:
+            if 'result' in self.labels and 'result' not in labels:
+                outcome['result'] = 'error'
+            raise
+        finally:
+            if 'result' in self.labels:
+                outcome.setdefault('result', 'ok')
+            self.observe(time.perf_counter() - start, **outcome)
+
+
+class TrackedGauge(_Metric):
+    """
+    Gauge kept current from increments and decrements at the places that
+    change it, so scrapes never need a COUNT. The deltas of every process
+    are summed like counters; `count` (a query) re-anchors the value at most
+    every `resync_interval` seconds to absorb changes made by paths that do
+    not report. The anchor (the count and the summed deltas it already
+    includes) is shared by all processes through the metrics directory.
+    """
+    kind = 'gauge'
+
+    def __init__(self, registry, name, help_text, count, resync_interval=300):
+        super().__init__(registry, name, help_text)
+        self.count = count
+        self.resync_interval = resync_interval
+
+    def inc(self, amount=1):
+        if amount:
+            self.registry._add('deltas', self.name, '[]', amount)
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def value(self, deltas, anchor):
+        return max(anchor['value'] + deltas - anchor['deltas'], 0)
+
+
+class MetricsRegistry:
+    """
+    Process-local metrics with cross-process aggregation for gunicorn.
+
+    Updates only touch a dict under a lock. A daemon thread writes this
+    process's totals to its own file in `directory` every `flush_interval`
+    seconds (and at exit); a scrape flushes its own process, then sums the
+    files of all processes. Files of processes that have exited are folded
+    into an archive so their counts survive worker restarts. After a fork the
+    child starts from zero with a file of its own.
+
+    Before a tracked gauge is re-counted, every process is asked to flush
+    and given up to `sync_timeout` seconds to do so; otherwise deltas still
+    in a worker's memory would be in the count and, once flushed, counted a
+    second time.
+    """
+    def __init__(self, directory=None, flush_interval=5, sync_timeout=2):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'afrinet-metrics')
+        self.flush_interval = flush_interval
+        self.sync_timeout = sync_timeout
+        self.metrics = []
+        self._lock = threading.Lock()
+        self._reset()
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(self, name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help_text, labels, buckets))
+
+    def tracked_gauge(self, name, help_text, count, resync_interval=300):
+        return self._register(TrackedGauge(self, name, help_text, count, resync_interval))
+
+    def flush(self):
+        with self._lock:
+            if self._pid != os.getpid() or self._flusher is None:
+                return
+            snapshot = json.dumps({**self._values, 'flushed_at': time.time()})
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = f'{self._path}.tmp'
+        with open(temporary, 'w') as handle:
+            handle.write(snapshot)
+        os.replace(temporary, self._path)
+
+    def collect(self):
+        """Totals of all processes: {'counters': ..., 'histograms': ..., 'deltas': ...}"""
+        self.flush()
+        totals = {'counters': {}, 'histograms': {}, 'deltas': {}}
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                archive_path = os.path.join(self.directory, ARCHIVE)
+                archive = self._read(archive_path) or {'counters': {}, 'histograms': {}, 'deltas': {}}
+                archived = False
+                for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+                    values = self._read(path)
+                    if values is None:
+                        continue
+                    if not self._alive(path):
+                        self._merge(archive, values)
+                        os.remove(path)
+                        archived = True
+                    else:
+                        self._merge(totals, values)
+                if archived:
+                    self._write(archive_path, archive)
+                self._merge(totals, archive)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        return totals
+
+    def render(self):
+        """Prometheus text exposition (version 0.0.4) of all processes"""
+        anchors_path = os.path.join(self.directory, ANCHORS)
+        anchors = self._read(anchors_path) or {}
+        stale = [
+            metric for metric in self.metrics
+            if metric.kind == 'gauge' and time.time() - anchors.get(metric.name, {}).get('at', 0) >= metric.resync_interval
+        ]
+        if stale:
+            self.sync_processes()
+        totals = self.collect()
+        if stale:
+            for metric in stale:
+                anchors[metric.name] = {
+                    'value': metric.count(),
+                    'deltas': totals['deltas'].get(metric.name, {}).get('[]', 0),
+                    'at': time.time(),
+                }
+            self._write(anchors_path, anchors)
+
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            if metric.kind == 'gauge':
+                deltas = totals['deltas'].get(metric.name, {}).get('[]', 0)
+                lines.append(f'{metric.name} {_format_value(metric.value(deltas, anchors[metric.name]))}')
+                continue
+            series = totals['counters' if metric.kind == 'counter' else 'histograms'].get(metric.name, {})
+            for key in sorted(series):
+                label_values = json.loads(key)
+                if metric.kind == 'counter':
+                    lines.append(f'{metric.name}{_format_labels(metric.labels, label_values)} {_format_value(series[key])}')
+                    continue
+                buckets, total, count = series[key][:-2], series[key][-2], series[key][-1]
+                cumulative = 0
+                for bound, bucket in zip(metric.buckets + (math.inf,), buckets):
+                    cumulative += bucket
+                    le = ('le', _format_value(bound))
+                    lines.append(f'{metric.name}_bucket{_format_labels(metric.labels, label_values, le)} {_format_value(cumulative)}')
+                lines.append(f'{metric.name}_sum{_format_labels(metric.labels, label_values)} {_format_value(total)}')
+                lines.append(f'{metric.name}_count{_format_labels(metric.labels, label_values)} {_format_value(count)}')
+        return '\n'.join(lines) + '\n'
+
+    def sync_processes(self):
+        """Ask every live process to flush now; returns False if some did not within `sync_timeout`"""
+        requested = time.time()
+        os.makedirs(self.directory, exist_ok=True)
+        self._write(os.path.join(self.directory, FLUSH_REQUEST), requested)
+        self.flush()
+        deadline = time.monotonic() + self.sync_timeout
+        while True:
+            pending = [
+                path for path in glob.glob(os.path.join(self.directory, 'metrics_*.json'))
+                if self._alive(path) and (self._read(path) or {}).get('flushed_at', 0) < requested
+            ]
+            if not pending:
+                return True
+            if time.monotonic() >= deadline:
+                logger.warning(f"Metrics: {len(pending)} processes did not flush within {self.sync_timeout}s")
+                return False
+            time.sleep(0.05)
+
+    def _register(self, metric):
+        if any(existing.name == metric.name for existing in self.metrics):
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics.append(metric)
+        return metric
+
+    def _reset(self):
+        self._values = {'counters': {}, 'histograms': {}, 'deltas': {}}
+        self._pid = os.getpid()
+        self._path = os.path.join(self.directory, f'metrics_{self._pid}_{uuid.uuid4().hex[:8]}.json')
+        self._flusher = None
+
+    def _ensure_process(self):
+        # Called with the lock held
+        if self._pid != os.getpid():
+            self._reset()
+        if self._flusher is None:
+            # An empty file right away, so a scrape knows to wait for this process's first flush
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                self._write(self._path, {'flushed_at': 0})
+            except OSError as e:
+                logger.error(f"Metrics file could not be created: {str(e)}")
+            self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+            self._flusher.start()
+
+    def _add(self, section, name, key, amount):
+        with self._lock:
+            self._ensure_process()
+            series = self._values[section].setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def _observe(self, histogram, key, value):
+        with self._lock:
+            self._ensure_process()
+            series = self._values['histograms'].setdefault(histogram.name, {})
+            values = series.get(key)
+            if values is None:
+                values = series[key] = [0] * (len(histogram.buckets) + 3)
+            for index, bound in enumerate(histogram.buckets):
+                if value <= bound:
+                    break
+            else:
+                index = len(histogram.buckets)
+            values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        request_path = os.path.join(self.directory, FLUSH_REQUEST)
+        flushed_at = time.time()
+        while self._pid == pid:
+            # Wake up often enough to answer a scrape's flush request quickly
+            time.sleep(min(self.flush_interval, 0.25))
+            if time.time() - flushed_at < self.flush_interval and (self._read(request_path) or 0) <= flushed_at:
+                continue
+            flushed_at = time.time()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Metrics flush failed: {str(e)}")
+
+    @staticmethod
+    def _alive(path):
+        if fcntl is None:
+            # No cheap liveness probe on Windows (signal 0 is CTRL_C_EVENT there)
+            return True
+        pid = int(os.path.basename(path).split('_')[1])
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write(path, value):
+        # Several processes may write the same file; each needs its own temporary
+        temporary = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump(value, handle)
+        os.replace(temporary, path)
+
+    @staticmethod
+    def _merge(into, values):
+        for section in ('counters', 'deltas'):
+            for name, series in values.get(section, {}).items():
+                target = into[section].setdefault(name, {})
+                for key, amount in series.items():
+                    target[key] = target.get(key, 0) + amount
+        for name, series in values.get('histograms', {}).items():
+            target = into['histograms'].setdefault(name, {})
+            for key, buckets in series.items():
+                current = target.get(key)
+                target[key] = buckets if current is None else [a + b for a, b in zip(current, buckets)]
+
+
+registry = MetricsRegistry(
+    directory=getattr(settings, 'METRICS_DIR', None),
+    flush_interval=getattr(settings, 'METRICS_FLUSH_INTERVAL', 5),
+    sync_timeout=getattr(settings, 'METRICS_SYNC_TIMEOUT', 2)
+)
+atexit.register(registry.flush)
+
+
+def _active_sessions():
+    from .models import Session
+    return Session.objects.filter(status='active').count()
+
+
+def _pending_payments():
+    from .models import Payment
+    return Payment.objects.filter(status='pending').count()
+
+
+GAUGE_RESYNC = getattr(settings, 'METRICS_GAUGE_RESYNC', 300)
+
+stk_push_seconds = registry.histogram(
+    'afrinet_stk_push_seconds', 'STK push requests to Daraja by result', labels=('result',))
+callbacks_total = registry.counter(
+    'afrinet_mpesa_callbacks_total', 'M-Pesa callbacks taken from the inbox by outcome', labels=('status',))
+callback_batch_seconds = registry.histogram(
+    'afrinet_mpesa_callback_batch_seconds', 'Time to process one batch of inbox callbacks')
+verify_fallback_seconds = registry.histogram(
+    'afrinet_verify_session_fallback_seconds', 'STK status queries made by verify_session by result', labels=('result',))
+voucher_validation_seconds = registry.histogram(
+    'afrinet_voucher_validation_seconds', 'Portal voucher checks by result', labels=('result',),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5))
+routeros_call_seconds = registry.histogram(
+    'afrinet_routeros_call_seconds', 'RouterOS API calls per router, including connection checkout',
+    labels=('router', 'result'))
+sessions_expired_total = registry.counter(
+    'afrinet_sessions_expired_total', 'Sessions expired by the expiry service and sweeps')
+session_expiry_batch_seconds = registry.histogram(
+    'afrinet_session_expiry_batch_seconds', 'Time to expire one batch of sessions')
+active_sessions = registry.tracked_gauge(
+    'afrinet_active_sessions', 'Sessions with status active', _active_sessions, GAUGE_RESYNC)
+pending_payments = registry.tracked_gauge(
+    'afrinet_pending_payments', 'Payments waiting for a callback', _pending_payments, GAUGE_RESYNC)
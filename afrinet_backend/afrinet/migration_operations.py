@@ -0,0 +1,55 @@
+from django.db import NotSupportedError, migrations
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    """
+    AddIndex that uses CREATE INDEX CONCURRENTLY on PostgreSQL, so writes to
+    the table are not blocked while the index builds. Other databases add
+    the index normally. The migration must set `atomic = False`.
+
+    django.contrib.postgres.operations has the same operation, but it needs
+    psycopg to import and fails on SQLite, which development uses.
+    """
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        _ensure_not_in_transaction(schema_editor, self)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        _ensure_not_in_transaction(schema_editor, self)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+
+
+class RemoveIndexConcurrently(migrations.RemoveIndex):
+    """RemoveIndex that uses DROP INDEX CONCURRENTLY on PostgreSQL; see AddIndexConcurrently"""
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        _ensure_not_in_transaction(schema_editor, self)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            index = from_state.models[app_label, self.model_name_lower].get_index_by_name(self.name)
+            schema_editor.remove_index(model, index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        _ensure_not_in_transaction(schema_editor, self)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            index = to_state.models[app_label, self.model_name_lower].get_index_by_name(self.name)
+            schema_editor.add_index(model, index, concurrently=True)
+
+
+def _ensure_not_in_transaction(schema_editor, operation):
+    if schema_editor.connection.in_atomic_block:
+        raise NotSupportedError(
+            f'{operation.__class__.__name__} cannot run inside a transaction; set atomic = False on the migration'
+        )
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:32
+
+from django.db import migrations, models
+
+SEQUENCE_NAME = 'afrinet_hotspot_username_seq'
+
+
+def seed_username_sequence(apps, schema_editor):
+    """Start numbering after the highest existing D-username"""
+    HostspotUser = apps.get_model('afrinet', 'HostspotUser')
+    UsernameSequence = apps.get_model('afrinet', 'UsernameSequence')
+
+    highest = 0
+    for username in HostspotUser.objects.filter(username__startswith='D').values_list('username', flat=True).iterator():
+        if username[1:].isdigit():
+            highest = max(highest, int(username[1:]))
+
+    UsernameSequence.objects.update_or_create(prefix='D', defaults={'next_value': highest + 1})
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f"CREATE SEQUENCE IF NOT EXISTS {SEQUENCE_NAME} START WITH {highest + 1}")
+
+
+def drop_username_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f"DROP SEQUENCE IF EXISTS {SEQUENCE_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('afrinet', '0005_payment_async_stk_push'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsernameSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(max_length=10, unique=True)),
+                ('next_value', models.PositiveBigIntegerField(default=1)),
+            ],
+        ),
+        migrations.RunPython(seed_username_sequence, drop_username_sequence),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:34
+
+from django.db import migrations, models
+from afrinet.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE/DROP INDEX CONCURRENTLY cannot run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('afrinet', '0006_usernamesequence'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['status', 'created_at'], name='payment_status_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['-created_at'], name='payment_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['is_checked', '-created_at'], name='payment_checked_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('push_status', 'queued')), fields=['created_at'], name='payment_push_queued_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='session',
+            index=models.Index(fields=['status', 'is_active'], name='session_status_active_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='session',
+            index=models.Index(fields=['phone', 'status', '-created_at'], name='session_phone_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='session',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['end_time'], name='session_active_end_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='session',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['device_mac'], name='session_device_mac_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='session',
+            index=models.Index(fields=['created_at', 'package'], name='session_created_package_idx'),
+        ),
+    ]
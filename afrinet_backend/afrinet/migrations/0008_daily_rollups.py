@@ -0,0 +1,77 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    """Build the rollups for all existing history"""
+    Payment = apps.get_model('afrinet', 'Payment')
+    Session = apps.get_model('afrinet', 'Session')
+    DailyRevenue = apps.get_model('afrinet', 'DailyRevenue')
+    DailyUsage = apps.get_model('afrinet', 'DailyUsage')
+
+    DailyRevenue.objects.bulk_create([
+        DailyRevenue(date=row['day'], package_id=row['package_id'], count=row['count'], sum_amount=row['sum_amount'])
+        for row in Payment.objects.filter(status='completed')
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'package_id')
+        .annotate(count=Count('id'), sum_amount=Sum('amount'))
+    ], batch_size=1000)
+
+    DailyUsage.objects.bulk_create([
+        DailyUsage(
+            date=row['day'],
+            package_id=row['package_id'],
+            sessions=row['sessions'],
+            minutes=row['minutes'] or 0,
+            data_used=row['data_used'] or 0
+        )
+        for row in Session.objects.annotate(day=TruncDate('created_at'))
+        .values('day', 'package_id')
+        .annotate(
+            sessions=Count('id'),
+            minutes=Sum('duration_minutes'),
+            data_used=Sum('data_used', filter=Q(status='expired'))
+        )
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('afrinet', '0007_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('sum_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('package', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='afrinet.package')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'package'), name='daily_revenue_date_package_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('sessions', models.PositiveIntegerField(default=0)),
+                ('data_used', models.BigIntegerField(default=0)),
+                ('minutes', models.BigIntegerField(default=0)),
+                ('package', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='afrinet.package')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'package'), name='daily_usage_date_package_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
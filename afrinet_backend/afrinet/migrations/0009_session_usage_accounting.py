@@ -0,0 +1,47 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('afrinet', '0008_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='bytes_in',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='bytes_out',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='router_bytes_in',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='router_bytes_out',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='SessionUsageSample',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sampled_at', models.DateTimeField()),
+                ('bytes_in', models.BigIntegerField(default=0)),
+                ('bytes_out', models.BigIntegerField(default=0)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_samples', to='afrinet.session')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['session', 'sampled_at'], name='usage_session_time_idx'), models.Index(fields=['sampled_at'], name='usage_sampled_at_idx')],
+            },
+        ),
+    ]
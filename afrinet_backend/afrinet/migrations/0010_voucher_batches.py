@@ -0,0 +1,24 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('afrinet', '0009_session_usage_accounting'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voucher',
+            name='batch_id',
+            field=models.UUIDField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='afrinet.hostspotuser'),
+        ),
+    ]
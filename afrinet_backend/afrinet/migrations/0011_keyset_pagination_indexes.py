@@ -0,0 +1,45 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:48
+
+from django.db import migrations, models
+from afrinet.migration_operations import AddIndexConcurrently, RemoveIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE/DROP INDEX CONCURRENTLY cannot run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('afrinet', '0010_voucher_batches'),
+    ]
+
+    operations = [
+        # Build the keyset indexes before dropping the ones they replace
+        AddIndexConcurrently(
+            model_name='hostspotuser',
+            index=models.Index(fields=['-created_at', '-id'], name='hotspotuser_created_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['-created_at', '-id'], name='payment_created_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['is_checked', '-created_at', '-id'], name='payment_checked_created_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='session',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['-created_at', '-id'], name='session_active_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='voucher',
+            index=models.Index(fields=['-created_at', '-id'], name='voucher_created_id_idx'),
+        ),
+        RemoveIndexConcurrently(
+            model_name='payment',
+            name='payment_created_idx',
+        ),
+        RemoveIndexConcurrently(
+            model_name='payment',
+            name='payment_checked_created_idx',
+        ),
+    ]
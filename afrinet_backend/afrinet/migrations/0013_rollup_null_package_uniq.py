@@ -0,0 +1,44 @@
+# Generated by Django 5.2.1 on 2026-10-18 12:37
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_null_package_rows(apps, schema_editor):
+    """Fold duplicate rows without a package into one row per day"""
+    for model_name, fields in (('DailyRevenue', ('count', 'sum_amount')), ('DailyUsage', ('sessions', 'data_used', 'minutes'))):
+        model = apps.get_model('afrinet', model_name)
+        duplicated = (
+            model.objects.filter(package__isnull=True)
+            .values('date')
+            .annotate(rows=Count('id'))
+            .filter(rows__gt=1)
+            .values_list('date', flat=True)
+        )
+        for day in list(duplicated):
+            rows = list(model.objects.filter(package__isnull=True, date=day).order_by('pk'))
+            keep = rows[0]
+            for row in rows[1:]:
+                for field in fields:
+                    setattr(keep, field, getattr(keep, field) + getattr(row, field))
+            keep.save(update_fields=fields)
+            model.objects.filter(pk__in=[row.pk for row in rows[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('afrinet', '0012_session_router'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_null_package_rows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dailyrevenue',
+            constraint=models.UniqueConstraint(condition=models.Q(('package__isnull', True)), fields=('date',), name='daily_revenue_date_no_package_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyusage',
+            constraint=models.UniqueConstraint(condition=models.Q(('package__isnull', True)), fields=('date',), name='daily_usage_date_no_package_uniq'),
+        ),
+    ]
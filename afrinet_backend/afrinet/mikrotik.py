@@ -1,61 +1,420 @@
-from datetime import timezone
-import routeros_api
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from routeros_api.exceptions import RouterOsApiCommunicationError
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .expiry import notify_sessions_scheduled
+from .metrics import active_sessions
+from .models import MikroTikDevice, Session, SessionUsageSample, HostspotUser
+from .profiling import external
+from .rollups import record_sessions_created, record_sessions_ended, record_sessions_reopened
+from .routeros import registry
+
+logger = logging.getLogger(__name__)
+
+
+def reconcile_active_sessions(active_users, scope=None, disconnect=True):
+    """
+    Bring Session rows in line with a router's /ip/hotspot/active list.
+
+    Existing sessions are loaded once and matched by MAC address, usernames
+    are resolved with one IN query, and the inserts, updates and disconnects
+    are applied in bulk inside one transaction. An entry's `router` key
+    (a MikroTikDevice pk, or None for the router in settings) is recorded on
+    its session. `scope` optionally limits which active sessions may be
+    disconnected (e.g. one router's clients); sessions without a MAC address
+    are never disconnected since the router has not seen them yet. With
+    `disconnect=False` the entries are only upserted, so just the sessions of
+    their MACs are loaded. Returns a dict of counts.
+    """
+    entries = {user['mac-address']: user for user in active_users if user.get('mac-address')}
+    now = timezone.now()
+
+    with transaction.atomic():
+        sessions = {}
+        if disconnect:
+            current = Session.objects.filter(Q(is_active=True, status='active') | Q(device_mac__in=list(entries), status='disconnected'))
+        else:
+            current = Session.objects.filter(
+                Q(is_active=True, status='active') | Q(status='disconnected'),
+                device_mac__in=list(entries)
+            )
+        current = current.exclude(device_mac__isnull=True).order_by('created_at')
+        for session in current:
+            # Prefer the active session for a MAC, then the most recent one
+            existing = sessions.get(session.device_mac)
+            if existing is None or session.is_active or not existing.is_active:
+                sessions[session.device_mac] = session
+
+        users = HostspotUser.objects.select_related('package').in_bulk(
+            {entry['user'] for entry in entries.values() if entry.get('user')},
+            field_name='username'
+        )
+
+        to_create, to_update = [], []
+        reactivated_pks = set()
+        for mac, entry in entries.items():
+            user = users.get(entry.get('user'))
+            ip_address = entry.get('address') or '127.0.0.1'
+            session = sessions.get(mac)
+            if session is not None and session.end_time and session.end_time <= now:
+                if session.status == 'active':
+                    # Leave sessions past their end time to the expiry service
+                    continue
+                # The device logged in again after its last session ended
+                session = None
+            if session is None:
+                package = user.package if user else None
+                to_create.append(Session(
+                    device_mac=mac,
+                    ip_address=ip_address,
+                    user=user,
+                    phone=user.phone if user else None,
+                    package=package,
+                    duration_minutes=package.duration_minutes if package else 0,
+                    router_id=entry.get('router'),
+                    created_at=now,
+                    end_time=now + timedelta(minutes=package.duration_minutes) if package else None,
+                    is_active=True,
+                    status='active'
+                ))
+                continue
+            router_id = entry.get('router', session.router_id)
+            if (session.ip_address, session.user_id, session.router_id, session.is_active, session.status) != (ip_address, user.pk if user else None, router_id, True, 'active'):
+                if session.status != 'active':
+                    reactivated_pks.add(session.pk)
+                    # A new router entry counts from zero; the old baseline would swallow its first bytes
+                    session.router_bytes_in = session.router_bytes_out = 0
+                session.ip_address = ip_address
+                session.user = user
+                session.router_id = router_id
+                session.is_active = True
+                session.status = 'active'
+                session.disconnected_at = None
+                to_update.append(session)
+
+        if to_create:
+            Session.objects.bulk_create(to_create, batch_size=500)
+            record_sessions_created(to_create)
+        if reactivated_pks:
+            record_sessions_reopened(reactivated_pks)
+        if to_update:
+            Session.objects.bulk_update(
+                to_update,
+                ['ip_address', 'user', 'router', 'is_active', 'status', 'disconnected_at', 'router_bytes_in', 'router_bytes_out'],
+                batch_size=500
+            )
+        # Bulk writes send no post_save, so tell the expiry service here
+        notify_sessions_scheduled(to_create + [session for session in to_update if session.pk in reactivated_pks])
+
+        disconnected = 0
+        stale = [
+            session.pk for mac, session in sessions.items()
+            if session.is_active and session.status == 'active' and mac not in entries
+        ]
+        if scope is not None and stale:
+            stale = list(scope.filter(pk__in=stale).values_list('pk', flat=True))
+        if stale:
+            disconnected = Session.objects.filter(pk__in=stale).update(
+                is_active=False,
+                status='disconnected',
+                disconnected_at=now
+            )
+            record_sessions_ended(stale)
+
+    active_sessions.inc(len(reactivated_pks) - disconnected)
+    return {'created': len(to_create), 'updated': len(to_update), 'disconnected': disconnected}
 
-from .models import Session, HostspotUser
 
 class MikroTik:
-    def __init__(self):
-        self.connection = None
-        self.api = None
+    """RouterOS operations for one router; connections come from the shared pool"""
+    def __init__(self, device=None):
+        self.device = device
+        self.pool = registry.get(device)
     
-    def connect(self):
-        if not self.connection:
-            self.connection = routeros_api.RouterOsApiPool(
-                host=settings.MIKROTIK_HOST,
-                username=settings.MIKROTIK_USERNAME,
-                password=settings.MIKROTIK_PASSWORD,
-                port=settings.MIKROTIK_PORT,
-                plaintext_login=True
-            )
-            self.api = self.connection.get_api()
-        return self.api
+    def fetch_active_users(self, timeout=None):
+        """The router's active hotspot entries, each tagged with the router's pk under `router`"""
+        with self.pool.connection(timeout) as api:
+            active_users = api.get_resource('/ip/hotspot/active').get()
+        router_id = self.device.pk if self.device else None
+        for entry in active_users:
+            entry['router'] = router_id
+        return active_users
     
     def sync_active_users(self):
-        api = self.connect()
-        hotspot_active = api.get_resource('/ip/hotspot/active')
-        active_users = hotspot_active.get()
-        
-        # Update or create sessions
-        for user in active_users:
-            Session.objects.update_or_create(
-                device_mac=user['mac-address'],
-                defaults={
-                    'ip_address': user['address'],
-                    'user': HostspotUser.objects.filter(username=user['user']).first(),
-                    'is_active': True,
-                    'status': 'active'
-                }
-            )
-        
-        # Mark disconnected sessions
-        active_macs = [u['mac-address'] for u in active_users]
-        Session.objects.filter(is_active=True).exclude(device_mac__in=active_macs).update(
-            is_active=False,
-            status='disconnected',
-            disconnected_at=timezone.now()
-        )
-        
+        active_users = self.fetch_active_users()
+        # Other routers' clients are not in this list
+        scope = Session.objects.filter(router=self.device) if self.device else None
+        reconcile_active_sessions(active_users, scope=scope)
         return len(active_users)
     
     def create_hotspot_user(self, username, password, profile='default'):
-        api = self.connect()
-        user = api.get_resource('/ip/hotspot/user')
-        user.add(name=username, password=password, profile=profile)
+        with self.pool.connection() as api:
+            api.get_resource('/ip/hotspot/user').add(name=username, password=password, profile=profile)
         return True
     
     def generate_voucher(self, code, profile='voucher', uptime=None):
-        api = self.connect()
-        user = api.get_resource('/ip/hotspot/user')
-        user.add(name=code, password=code, profile=profile, limit_uptime=uptime)
-        return True
\ No newline at end of file
+        with self.pool.connection() as api:
+            api.get_resource('/ip/hotspot/user').add(name=code, password=code, profile=profile, limit_uptime=uptime)
+        return True
+    
+    def generate_vouchers(self, codes, profile='voucher', uptime=None, window=200):
+        """
+        Add many voucher users with pipelined API sentences.
+
+        Up to `window` add commands are written before their replies are
+        read, so a batch costs about len(codes) / window round trips instead
+        of one per code. Returns {code: None on success or the error}.
+        Codes whose reply never arrived because the connection dropped are
+        reported as failed too.
+        """
+        results = {}
+        try:
+            with self.pool.connection() as api:
+                users = api.get_resource('/ip/hotspot/user')
+                for start in range(0, len(codes), window):
+                    promises = []
+                    for code in codes[start:start + window]:
+                        arguments = {'name': code, 'password': code, 'profile': profile}
+                        if uptime:
+                            arguments['limit-uptime'] = uptime
+                        promises.append((code, users.call_async('add', arguments)))
+                    for code, promise in promises:
+                        try:
+                            promise.get()
+                            results[code] = None
+                        except RouterOsApiCommunicationError as e:
+                            results[code] = e.original_message.decode(errors='replace')
+        except Exception as e:
+            for code in codes:
+                results.setdefault(code, str(e) or e.__class__.__name__)
+        return results
+    
+    def login_hotspot(self, username, password, mac_address, ip_address):
+        """Log a client device into the hotspot without the captive portal page"""
+        with self.pool.connection() as api:
+            api.get_resource('/ip/hotspot/active').call('login', {
+                'user': username,
+                'password': password,
+                'mac-address': mac_address,
+                'ip': ip_address
+            })
+        return True
+    
+    def disconnect_active(self, mac_addresses=(), usernames=()):
+        """Remove matching entries from /ip/hotspot/active; returns how many were kicked"""
+        removed = 0
+        with self.pool.connection() as api:
+            hotspot_active = api.get_resource('/ip/hotspot/active')
+            for entry in hotspot_active.get():
+                if entry.get('mac-address') in mac_addresses or entry.get('user') in usernames:
+                    hotspot_active.remove(id=entry['id'])
+                    removed += 1
+        return removed
+
+
+def _counter(value):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def ingest_usage(active_users, sampled_at=None):
+    """
+    Add the traffic since the last sample to each active session.
+
+    bytes-in/bytes-out on a hotspot active entry count up from the user's
+    login, so the delta is the difference from the last counters stored on
+    the session; a counter lower than before means the router started a new
+    entry (re-login or reboot) and counts in full. reconcile_active_sessions
+    resets the stored counters when it reactivates a session, since a lower
+    counter alone misses an entry that has already passed the old one.
+    Sessions are updated with
+    one bulk_update and every non-zero delta is appended to
+    SessionUsageSample in the same transaction. Returns the totals.
+    """
+    sampled_at = sampled_at or timezone.now()
+    counters = {
+        entry['mac-address']: (_counter(entry.get('bytes-in')), _counter(entry.get('bytes-out')))
+        for entry in active_users if entry.get('mac-address')
+    }
+    if not counters:
+        return {'sessions': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+    with transaction.atomic():
+        sessions = Session.objects.filter(
+            device_mac__in=list(counters),
+            is_active=True,
+            status='active'
+        ).only('pk', 'device_mac', 'bytes_in', 'bytes_out', 'data_used', 'router_bytes_in', 'router_bytes_out')
+
+        changed, samples = [], []
+        total_in = total_out = 0
+        for session in sessions:
+            bytes_in, bytes_out = counters[session.device_mac]
+            delta_in = bytes_in - session.router_bytes_in if bytes_in >= session.router_bytes_in else bytes_in
+            delta_out = bytes_out - session.router_bytes_out if bytes_out >= session.router_bytes_out else bytes_out
+            if (bytes_in, bytes_out) == (session.router_bytes_in, session.router_bytes_out):
+                continue
+            session.router_bytes_in, session.router_bytes_out = bytes_in, bytes_out
+            session.bytes_in += delta_in
+            session.bytes_out += delta_out
+            session.data_used = session.bytes_in + session.bytes_out
+            changed.append(session)
+            if delta_in or delta_out:
+                samples.append(SessionUsageSample(
+                    session=session,
+                    sampled_at=sampled_at,
+                    bytes_in=delta_in,
+                    bytes_out=delta_out
+                ))
+                total_in += delta_in
+                total_out += delta_out
+
+        if changed:
+            Session.objects.bulk_update(
+                changed, ['bytes_in', 'bytes_out', 'data_used', 'router_bytes_in', 'router_bytes_out'], batch_size=500
+            )
+        if samples:
+            SessionUsageSample.objects.bulk_create(samples, batch_size=1000)
+
+    return {'sessions': len(samples), 'bytes_in': total_in, 'bytes_out': total_out}
+
+
+def disconnect_sessions(mac_addresses):
+    """Mark the active sessions of these MACs as disconnected; returns how many changed"""
+    with transaction.atomic():
+        ended = list(Session.objects.select_for_update().filter(
+            device_mac__in=list(mac_addresses),
+            is_active=True,
+            status='active'
+        ).values_list('pk', flat=True))
+        disconnected = Session.objects.filter(pk__in=ended).update(
+            is_active=False,
+            status='disconnected',
+            disconnected_at=timezone.now()
+        )
+        record_sessions_ended(ended)
+    active_sessions.dec(disconnected)
+    return disconnected
+
+
+def _fetch_active(device, timeout=None):
+    started = time.monotonic()
+    active_users = MikroTik(device).fetch_active_users(timeout)
+    return active_users, (time.monotonic() - started) * 1000
+
+
+def fetch_all_devices(devices=None, timeout=None, max_workers=None):
+    """
+    Pull /ip/hotspot/active from every router in parallel.
+
+    Each router gets `timeout` seconds from the moment its own fetch starts,
+    so routers waiting for a free worker are not charged for the wait; the
+    same limit is applied to the router's socket, so a hung fetch ends by
+    itself. A router that fails or times out is marked Offline and does not
+    hold up the others. Falls back to the router in settings when no
+    MikroTikDevice is registered. Returns the merged entries (tagged with
+    their router, see MikroTik.fetch_active_users), a per-device report and
+    the number of failed routers.
+    """
+    if devices is None:
+        devices = list(MikroTikDevice.objects.all())
+    targets = devices or [None]
+    timeout = timeout or getattr(settings, 'MIKROTIK_SYNC_TIMEOUT', 15)
+    max_workers = max_workers or getattr(settings, 'MIKROTIK_SYNC_WORKERS', 16)
+
+    started = {}
+
+    def fetch(index, device):
+        started[index] = time.monotonic()
+        return _fetch_active(device, timeout)
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(targets)), thread_name_prefix='mikrotik-sync')
+    # Worker threads do not see the request profile, so time the whole fan-out here
+    with external('routeros'):
+        try:
+            futures = {executor.submit(fetch, index, device): index for index, device in enumerate(targets)}
+            pending, timed_out = set(futures), set()
+            while pending:
+                running = {future: started[futures[future]] for future in pending if futures[future] in started}
+                wait_for = min(running.values(), default=time.monotonic()) + timeout - time.monotonic()
+                if len(running) < len(pending):
+                    # Look again soon to start the clock of fetches still queued
+                    wait_for = min(wait_for, 0.1)
+                _, pending = wait(pending, timeout=max(wait_for, 0), return_when=FIRST_COMPLETED)
+                now = time.monotonic()
+                expired = {future for future in pending if future in running and now - running[future] >= timeout}
+                timed_out |= expired
+                pending -= expired
+        finally:
+            executor.shutdown(wait=False)
+
+    merged, report, failed = [], [], 0
+    for future, index in futures.items():
+        device = targets[index]
+        entry = {'device': device.name if device else settings.MIKROTIK_HOST, 'id': device.pk if device else None}
+        if future in timed_out:
+            failed += 1
+            entry.update(status='Offline', error=f'Timed out after {timeout}s', elapsed_ms=timeout * 1000)
+        elif future.exception() is not None:
+            failed += 1
+            entry.update(status='Offline', error=str(future.exception()), elapsed_ms=None)
+        else:
+            active_users, elapsed_ms = future.result()
+            merged.extend(active_users)
+            entry.update(status='Online', active_users=len(active_users), elapsed_ms=round(elapsed_ms, 1))
+        if entry['status'] == 'Offline':
+            logger.warning(f"Sync of router {entry['device']} failed: {entry['error']}")
+        report.append(entry)
+
+    now = timezone.now()
+    updated = []
+    for device, entry in zip(targets, report):
+        if device is not None:
+            device.status = entry['status']
+            device.lastUpdate = now
+            updated.append(device)
+    if updated:
+        MikroTikDevice.objects.bulk_update(updated, ['status', 'lastUpdate'])
+
+    return merged, report, failed
+
+
+def sync_all_devices(devices=None, timeout=None, max_workers=None):
+    """
+    Reconcile sessions and record data usage from every router in one pass.
+
+    A router that did not answer hides its clients this round, so while
+    any router is down only sessions on the routers that answered can be
+    disconnected; sessions not yet tied to a router wait until every router
+    has answered. Returns the totals and a per-device report.
+    """
+    started = time.monotonic()
+    merged, report, failed = fetch_all_devices(devices, timeout, max_workers)
+    scope = None
+    if failed:
+        answered = [entry['id'] for entry in report if entry['status'] == 'Online' and entry['id'] is not None]
+        scope = Session.objects.filter(router__in=answered)
+    result = reconcile_active_sessions(merged, scope=scope)
+    result['usage'] = ingest_usage(merged)
+    result.update(
+        synced_users=len(merged),
+        failed_devices=failed,
+        elapsed_ms=round((time.monotonic() - started) * 1000, 1),
+        devices=report
+    )
+    return result
+
+
+def sample_usage(devices=None):
+    """Record data usage from every router without touching session state"""
+    merged, report, failed = fetch_all_devices(devices)
+    result = ingest_usage(merged)
+    result['failed_devices'] = failed
+    return result
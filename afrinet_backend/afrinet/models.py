@@ -98,14 +98,35 @@ class HostspotUser(models.Model):
     last_online = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # User list pages, newest first
+            models.Index(fields=['-created_at', '-id'], name='hotspotuser_created_id_idx'),
+        ]
+
+class UsernameSequence(models.Model):
+    """Counter row for hotspot usernames on databases without native sequences"""
+    prefix = models.CharField(max_length=10, unique=True)
+    next_value = models.PositiveBigIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.prefix}{self.next_value}"
+
 class Payment(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Pending'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
     )
+    PUSH_STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
 
-    user = models.ForeignKey(HostspotUser, on_delete=models.CASCADE)
+    # Empty for voucher batches, which are paid for offline
+    user = models.ForeignKey(HostspotUser, on_delete=models.CASCADE, null=True, blank=True)
     phone = models.CharField(max_length=15)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     transaction_id = models.CharField(max_length=100, unique=True)
@@ -117,7 +138,23 @@ class Payment(models.Model):
     is_successful = models.BooleanField(default=False)
     is_finished = models.BooleanField(default=False)
     is_checked = models.BooleanField(default=False)
+    # Set for payments whose STK push is sent asynchronously
+    idempotency_key = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+    push_status = models.CharField(max_length=10, choices=PUSH_STATUS_CHOICES, default='sent')
+    push_attempts = models.PositiveSmallIntegerField(default=0)
+    push_started_at = models.DateTimeField(null=True, blank=True)
+    push_error = models.CharField(max_length=255, blank=True, default='')
 
+    class Meta:
+        indexes = [
+            # Dashboard revenue and recent payment counts
+            models.Index(fields=['status', 'created_at'], name='payment_status_created_idx'),
+            # Payment list pages, newest first, optionally filtered by is_checked
+            models.Index(fields=['-created_at', '-id'], name='payment_created_id_idx'),
+            models.Index(fields=['is_checked', '-created_at', '-id'], name='payment_checked_created_id_idx'),
+            # Asynchronous STK push queue
+            models.Index(fields=['created_at'], name='payment_push_queued_idx', condition=models.Q(push_status='queued')),
+        ]
 
     def __str__(self):
         return f"{self.phone} - {self.amount} - {self.status}"
@@ -133,9 +170,16 @@ class Session(models.Model):
     end_time = models.DateTimeField(auto_created=True, null=True, blank=True)
     duration_minutes = models.PositiveIntegerField()
     disconnected = models.BooleanField(default=False)
-    data_used = models.BigIntegerField(default=0)  # bytes
+    data_used = models.BigIntegerField(default=0)  # bytes, bytes_in + bytes_out
+    bytes_in = models.BigIntegerField(default=0)
+    bytes_out = models.BigIntegerField(default=0)
+    # Last raw counters read from the router, used to compute the next delta
+    router_bytes_in = models.BigIntegerField(default=0)
+    router_bytes_out = models.BigIntegerField(default=0)
     package = models.ForeignKey(Package, on_delete=models.SET_NULL, null=True, blank=True)
     payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True)
+    # Router the session was last seen on; null for sessions no router has reported yet
+    router = models.ForeignKey('MikroTikDevice', related_name='sessions', on_delete=models.SET_NULL, null=True, blank=True)
     is_active = models.BooleanField(default=True)
     disconnected_at = models.DateTimeField(null=True, blank=True)
     
@@ -149,6 +193,22 @@ class Session(models.Model):
         default='active'
     )
 
+    class Meta:
+        indexes = [
+            # Active session lists and counts
+            models.Index(fields=['status', 'is_active'], name='session_status_active_idx'),
+            # Portal lookup of a phone's latest active session
+            models.Index(fields=['phone', 'status', '-created_at'], name='session_phone_status_idx'),
+            # Expiry sweeps only ever look at active sessions
+            models.Index(fields=['end_time'], name='session_active_end_idx', condition=models.Q(status='active')),
+            # Router sync matches sessions by MAC address
+            models.Index(fields=['device_mac'], name='session_device_mac_idx', condition=models.Q(is_active=True)),
+            # Dashboard activity and package distribution windows
+            models.Index(fields=['created_at', 'package'], name='session_created_package_idx'),
+            # Active session list pages, newest first
+            models.Index(fields=['-created_at', '-id'], name='session_active_created_idx', condition=models.Q(status='active')),
+        ]
+
     @property
     def time_remaining(self):
         if self.end_time:
@@ -177,6 +237,22 @@ class Session(models.Model):
     def __str__(self):
         return f"{self.phone or self.device_mac} - {self.status}"
     
+class SessionUsageSample(models.Model):
+    """Traffic of one session between two router samples; only non-zero deltas are stored"""
+    session = models.ForeignKey(Session, related_name='usage_samples', on_delete=models.CASCADE)
+    sampled_at = models.DateTimeField()
+    bytes_in = models.BigIntegerField(default=0)
+    bytes_out = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['session', 'sampled_at'], name='usage_session_time_idx'),
+            models.Index(fields=['sampled_at'], name='usage_sampled_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.session_id} @ {self.sampled_at}: {self.bytes_in}/{self.bytes_out}"
+
 class Voucher(models.Model):
     code = models.CharField(max_length=100, unique=True)
     phone = models.CharField(max_length=50, default="")
@@ -185,6 +261,14 @@ class Voucher(models.Model):
     end_time = models.DateTimeField(null=True, blank=True)
     payment = models.ForeignKey(Payment, related_name='vouchers', on_delete=models.CASCADE, default=None)
     quantity = models.PositiveIntegerField(default=1)
+    # Vouchers generated together share a batch id
+    batch_id = models.UUIDField(null=True, blank=True, db_index=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Voucher list pages, newest first
+            models.Index(fields=['-created_at', '-id'], name='voucher_created_id_idx'),
+        ]
     
     def is_valid(self):
         return not self.is_used and (self.end_time is None or self.end_time > timezone.now())
@@ -192,6 +276,40 @@ class Voucher(models.Model):
     def __str__(self):
         return self.code
     
+class DailyRevenue(models.Model):
+    """Completed payments per local day (of created_at) and package; one row per day has no package"""
+    date = models.DateField()
+    package = models.ForeignKey(Package, on_delete=models.SET_NULL, null=True, blank=True)
+    count = models.PositiveIntegerField(default=0)
+    sum_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'package'], name='daily_revenue_date_package_uniq'),
+            # NULLs never collide in the constraint above
+            models.UniqueConstraint(fields=['date'], condition=models.Q(package__isnull=True), name='daily_revenue_date_no_package_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.package_id} - {self.sum_amount}"
+
+class DailyUsage(models.Model):
+    """Sessions per local day (of created_at) and package; data_used is added when a session ends"""
+    date = models.DateField()
+    package = models.ForeignKey(Package, on_delete=models.SET_NULL, null=True, blank=True)
+    sessions = models.PositiveIntegerField(default=0)
+    data_used = models.BigIntegerField(default=0)  # bytes
+    minutes = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'package'], name='daily_usage_date_package_uniq'),
+            models.UniqueConstraint(fields=['date'], condition=models.Q(package__isnull=True), name='daily_usage_date_no_package_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.package_id} - {self.sessions}"
+
 class MikroTikDevice(models.Model):
     name = models.CharField(max_length=100)
     ip = models.CharField(max_length=15)
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.core.cache import cache
+from .jsoncodec import JSONRenderer
+from .models import Package
+
+VERSION_KEY = 'packages:version'
+
+
+class PackageCatalogue:
+    """
+    In-process copy of the Package table for the portal and payment views.
+
+    Each process keeps the packages, their rendered JSON and its ETag, tagged
+    with the catalogue version stored in the shared cache. Saving or deleting
+    a package writes a new version, so every worker reloads on its next
+    check; the version is read at most once every `check_interval` seconds.
+    Without a shared cache (no REDIS_URL) other workers only notice after
+    `max_age` seconds, which bounds how stale a copy can get.
+    """
+    def __init__(self, check_interval=1, max_age=300):
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._state = None
+        self._checked_at = 0
+        self._loaded_at = 0
+        self._pid = None
+        self.loads = 0
+
+    def all(self):
+        return self._current()['packages']
+
+    def get(self, pk):
+        try:
+            return self._current()['by_pk'].get(int(pk))
+        except (TypeError, ValueError):
+            return None
+
+    def by_package_id(self, package_id):
+        return self._current()['by_package_id'].get(package_id)
+
+    def by_price(self, amount):
+        """The first package (by id) with this price, like filter(price=...).first()"""
+        try:
+            price = Decimal(str(amount))
+        except (InvalidOperation, ValueError):
+            return None
+        return self._current()['by_price'].get(price)
+
+    def response(self):
+        """(JSON body, strong ETag) of the catalogue endpoint"""
+        state = self._current()
+        return state['body'], state['etag']
+
+    def invalidate(self):
+        """Publish a new version after a package changed"""
+        cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+        with self._lock:
+            self._state = None
+
+    def _current(self):
+        now = time.monotonic()
+        state = self._state
+        if state is not None and self._pid == os.getpid() and now - self._checked_at < self.check_interval:
+            return state
+        with self._lock:
+            state = self._state
+            if state is not None and self._pid == os.getpid() and now - self._checked_at < self.check_interval:
+                return state
+            version = cache.get(VERSION_KEY)
+            if version is None:
+                version = uuid.uuid4().hex
+                cache.add(VERSION_KEY, version, None)
+                version = cache.get(VERSION_KEY, version)
+            if state is None or self._pid != os.getpid() or state['version'] != version \
+                    or now - self._loaded_at >= self.max_age:
+                state = self._load(version)
+                self._state = state
+                self._loaded_at = now
+                self._pid = os.getpid()
+            self._checked_at = now
+            return state
+
+    def _load(self, version):
+        from .serializers import PackageSerializer
+
+        packages = list(Package.objects.order_by('id'))
+        body = JSONRenderer().render(PackageSerializer(packages, many=True).data)
+        by_price = {}
+        for package in packages:
+            by_price.setdefault(package.price, package)
+        self.loads += 1
+        return {
+            'version': version,
+            'packages': packages,
+            'by_pk': {package.pk: package for package in packages},
+            'by_package_id': {package.package_id: package for package in packages},
+            'by_price': by_price,
+            'body': body,
+            'etag': f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"',
+        }
+
+
+package_catalogue = PackageCatalogue(
+    check_interval=getattr(settings, 'PACKAGE_CACHE_CHECK_INTERVAL', 1),
+    max_age=getattr(settings, 'PACKAGE_CACHE_MAX_AGE', 300)
+)
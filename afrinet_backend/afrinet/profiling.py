@@ -0,0 +1,168 @@
+import contextvars
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.db import connections
+from .jsoncodec import dumps
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('request_profile', default=None)
+_PLACEHOLDER_RUN = re.compile(r'%s(?:\s*,\s*%s)+')
+
+
+class QueryBudgetExceeded(Exception):
+    """A view ran more queries than its budget allows (raised when QUERY_BUDGET_STRICT)"""
+
+
+def query_shape(sql):
+    """SQL with runs of placeholders collapsed, so IN lists of any length compare equal"""
+    return _PLACEHOLDER_RUN.sub('%s...', sql)
+
+
+class Profile:
+    """Per-request counters filled in by the DB wrapper and `external()`"""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.shapes = Counter()
+        self.external = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.shapes[query_shape(sql)] += 1
+
+    def duplicates(self):
+        """Query shapes run more than once, most repeated first"""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > 1]
+
+    @contextmanager
+    def capture(self):
+        token = _current.set(self)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self))
+                yield self
+        finally:
+            _current.reset(token)
+
+
+@contextmanager
+def external(kind):
+    """Count the block's wall time as outbound I/O of `kind` (daraja, routeros) for the current request"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.external[kind] = profile.external.get(kind, 0.0) + time.perf_counter() - start
+
+
+def query_budget(max_queries):
+    """Declare the query budget (number or {method: number}) of a function view; class views set `query_budget`"""
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+@contextmanager
+def assert_max_queries(max_queries, max_duplicates=None):
+    """Fail a test when the block runs more than `max_queries` (or repeats a query shape too often)"""
+    profile = Profile()
+    with profile.capture():
+        yield profile
+    problems = []
+    if profile.queries > max_queries:
+        problems.append(f"{profile.queries} queries (budget {max_queries})")
+    duplicates = profile.duplicates()
+    if max_duplicates is not None and sum(count - 1 for _, count in duplicates) > max_duplicates:
+        problems.append(f"repeated queries: {duplicates[:3]}")
+    if problems:
+        raise QueryBudgetExceeded('; '.join(problems))
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in (REQUEST_PROFILING) per-request profile: SQL count and time,
+    repeated query shapes, outbound Daraja/RouterOS time and the remaining
+    Python time. Each response carries a Server-Timing header and one JSON
+    log line is written per request.
+
+    Views declare a `query_budget` (class attribute or @query_budget), either
+    a number or a dict per HTTP method; a QUERY_BUDGETS setting keyed by URL
+    name overrides it, which lets tests pin budgets with override_settings.
+    Over-budget requests are logged, or raise QueryBudgetExceeded when
+    QUERY_BUDGET_STRICT is on, as in CI.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = Profile()
+        with profile.capture():
+            request._profile_view = None
+            response = self.get_response(request)
+        total = time.perf_counter() - profile.started
+        external_time = sum(profile.external.values())
+        python_time = max(total - profile.db_time - external_time, 0)
+
+        timings = [f'db;dur={profile.db_time * 1000:.1f};desc="{profile.queries} queries"']
+        timings += [f'{kind};dur={seconds * 1000:.1f}' for kind, seconds in profile.external.items()]
+        timings += [f'app;dur={python_time * 1000:.1f}', f'total;dur={total * 1000:.1f}']
+        response['Server-Timing'] = ', '.join(timings)
+
+        view_name = request.resolver_match.view_name if request.resolver_match else None
+        duplicates = profile.duplicates()
+        budget = self.budget(view_name, request._profile_view, request.method)
+        logger.info(dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': view_name,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'db_ms': round(profile.db_time * 1000, 1),
+            'queries': profile.queries,
+            'query_budget': budget,
+            'duplicate_queries': sum(count - 1 for _, count in duplicates),
+            'top_duplicates': [{'sql': shape[:200], 'count': count} for shape, count in duplicates[:3]],
+            'external_ms': {kind: round(seconds * 1000, 1) for kind, seconds in profile.external.items()},
+            'python_ms': round(python_time * 1000, 1),
+        }).decode())
+
+        if budget is not None and profile.queries > budget:
+            message = f"{view_name or request.path} ran {profile.queries} queries (budget {budget})"
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._profile_view = view_func
+
+    def budget(self, view_name, view_func, method):
+        budgets = getattr(settings, 'QUERY_BUDGETS', {})
+        if view_name in budgets:
+            budget = budgets[view_name]
+        elif view_func is None:
+            return None
+        else:
+            budget = getattr(view_func, 'query_budget', None)
+            if budget is None:
+                budget = getattr(getattr(view_func, 'view_class', None), 'query_budget', None)
+        if isinstance(budget, dict):
+            return budget.get(method)
+        return budget
@@ -0,0 +1,109 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import HostspotUser, Session, Voucher
+from .voucher_cache import voucher_validator
+
+logger = logging.getLogger(__name__)
+
+
+class RedemptionError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def redeem_voucher(code, phone='', mac_address=None, ip_address=None):
+    """
+    Spend a voucher and start its session in one transaction.
+
+    The voucher is claimed with a conditional UPDATE (is_used=false and not
+    expired), so of two devices redeeming the same code at the same moment
+    exactly one wins and no row lock is held while waiting. The Session is
+    created from the package duration and, when the device is known, the
+    router login is queued after commit. Raises RedemptionError on failure.
+    """
+    if not voucher_validator.known(code):
+        raise RedemptionError('Invalid voucher code', 404)
+
+    now = timezone.now()
+    with transaction.atomic():
+        claimed = Voucher.objects.filter(
+            Q(end_time__isnull=True) | Q(end_time__gt=now),
+            code=code,
+            is_used=False
+        ).update(is_used=True)
+        if not claimed:
+            voucher = Voucher.objects.filter(code=code).only('is_used', 'end_time').first()
+            if voucher is None:
+                raise RedemptionError('Invalid voucher code', 404)
+            if voucher.is_used:
+                raise RedemptionError('Voucher already used', 409)
+            raise RedemptionError('Voucher expired', 410)
+
+        voucher = Voucher.objects.select_related('payment__package').get(code=code)
+        package = voucher.payment.package if voucher.payment else None
+        if package is None:
+            raise RedemptionError('Voucher has no package', 400)
+        if phone and not voucher.phone:
+            Voucher.objects.filter(pk=voucher.pk).update(phone=phone)
+
+        session = Session.objects.create(
+            user=HostspotUser.objects.filter(phone=phone).first() if phone else None,
+            phone=phone or voucher.phone or None,
+            voucher_code=code,
+            device_mac=mac_address,
+            ip_address=ip_address or '127.0.0.1',
+            package=package,
+            payment=voucher.payment,
+            duration_minutes=package.duration_minutes,
+            created_at=now,
+            end_time=now + timedelta(minutes=package.duration_minutes)
+        )
+        transaction.on_commit(lambda: voucher_validator.invalidate(code))
+        if mac_address and ip_address:
+            login_queue.enqueue(code, mac_address, ip_address)
+
+    logger.info(f"Voucher redeemed: code={code}, session_id={session.session_id}")
+    return session
+
+
+def _login_device(code, mac_address, ip_address):
+    from .mikrotik import MikroTik
+    try:
+        MikroTik().login_hotspot(code, code, mac_address, ip_address)
+    except Exception as e:
+        logger.error(f"Hotspot login failed for voucher {code} ({mac_address}): {str(e)}")
+    finally:
+        close_old_connections()
+
+
+class RouterLoginQueue:
+    """Thread pool that logs redeemed devices into the hotspot off the request path"""
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix='hotspot-login'
+                    )
+        return self._executor
+
+    def enqueue(self, code, mac_address, ip_address):
+        transaction.on_commit(lambda: self.executor.submit(_login_device, code, mac_address, ip_address))
+
+
+login_queue = RouterLoginQueue(max_workers=getattr(settings, 'HOTSPOT_LOGIN_WORKERS', 4))
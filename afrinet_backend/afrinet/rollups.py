@@ -0,0 +1,135 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .metrics import active_sessions
+from .models import DailyRevenue, DailyUsage, Payment, Session
+
+
+def _increment(model, day, package_id, **deltas):
+    """Add `deltas` to the (day, package) rollup row, creating it if needed"""
+    rows = model.objects.filter(date=day, package_id=package_id)
+    if rows.update(**{field: F(field) + value for field, value in deltas.items()}):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(date=day, package_id=package_id, **deltas)
+    except IntegrityError:
+        # Another worker created the row first
+        rows.update(**{field: F(field) + value for field, value in deltas.items()})
+
+
+def record_payment_completed(payment):
+    """Call once when a payment moves to completed"""
+    _increment(
+        DailyRevenue,
+        timezone.localdate(payment.created_at),
+        payment.package_id,
+        count=1,
+        sum_amount=payment.amount
+    )
+
+
+def record_payment_adjusted(payment, amount, count=0):
+    """Add `amount` (negative for refunds) and `count` to a completed payment's day"""
+    _increment(
+        DailyRevenue,
+        timezone.localdate(payment.created_at),
+        payment.package_id,
+        count=count,
+        sum_amount=amount
+    )
+
+
+def record_session_created(session):
+    record_sessions_created([session])
+
+
+def record_sessions_created(sessions):
+    """Count sessions that were inserted without post_save (e.g. bulk_create)"""
+    totals = {}
+    for session in sessions:
+        key = (timezone.localdate(session.created_at), session.package_id)
+        count, minutes = totals.get(key, (0, 0))
+        totals[key] = (count + 1, minutes + (session.duration_minutes or 0))
+    for (day, package_id), (count, minutes) in totals.items():
+        _increment(DailyUsage, day, package_id, sessions=count, minutes=minutes)
+    active_sessions.inc(sum(1 for session in sessions if session.status == 'active'))
+
+
+def record_sessions_ended(session_ids):
+    """
+    Add the data used by sessions that just left 'active' (expired or
+    disconnected) to their day's usage. Call once per transition, with the
+    ids of the rows that actually changed.
+    """
+    _add_session_data(session_ids, 1)
+
+
+def record_sessions_reopened(session_ids):
+    """Take back the data of ended sessions that are active again; it is added once more when they end"""
+    _add_session_data(session_ids, -1)
+
+
+def _add_session_data(session_ids, sign):
+    rows = (
+        Session.objects.filter(pk__in=session_ids, data_used__gt=0)
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'package_id')
+        .annotate(data_used=Sum('data_used'))
+    )
+    for row in rows:
+        _increment(DailyUsage, row['day'], row['package_id'], data_used=sign * row['data_used'])
+
+
+def fold_package_rollups(package_id):
+    """
+    Move a package's rollup rows into the rows without a package before the
+    package is deleted, so SET_NULL cannot leave two rows for one day.
+    """
+    for model, fields in ((DailyRevenue, ('count', 'sum_amount')), (DailyUsage, ('sessions', 'data_used', 'minutes'))):
+        rows = list(model.objects.filter(package_id=package_id).values('pk', 'date', *fields))
+        for row in rows:
+            _increment(model, row['date'], None, **{field: row[field] for field in fields})
+        model.objects.filter(pk__in=[row['pk'] for row in rows]).delete()
+
+
+def rebuild_rollups(start, end):
+    """
+    Recompute the rollups for local dates start..end (inclusive) from the
+    Payment and Session tables. Safe to run repeatedly for the same range.
+    """
+    with transaction.atomic():
+        DailyRevenue.objects.filter(date__gte=start, date__lte=end).delete()
+        DailyUsage.objects.filter(date__gte=start, date__lte=end).delete()
+
+        DailyRevenue.objects.bulk_create([
+            DailyRevenue(date=row['day'], package_id=row['package_id'], count=row['count'], sum_amount=row['sum_amount'])
+            for row in Payment.objects.filter(
+                status='completed',
+                created_at__date__gte=start,
+                created_at__date__lte=end
+            ).annotate(day=TruncDate('created_at'))
+            .values('day', 'package_id')
+            .annotate(count=Count('id'), sum_amount=Sum('amount'))
+        ], batch_size=1000)
+
+        DailyUsage.objects.bulk_create([
+            DailyUsage(
+                date=row['day'],
+                package_id=row['package_id'],
+                sessions=row['sessions'],
+                minutes=row['minutes'] or 0,
+                data_used=row['data_used'] or 0
+            )
+            for row in Session.objects.filter(
+                created_at__date__gte=start,
+                created_at__date__lte=end
+            ).annotate(day=TruncDate('created_at'))
+            .values('day', 'package_id')
+            .annotate(
+                sessions=Count('id'),
+                minutes=Sum('duration_minutes'),
+                data_used=Sum('data_used', filter=~Q(status='active'))
+            )
+        ], batch_size=1000)
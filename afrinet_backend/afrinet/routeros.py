@@ -0,0 +1,285 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+import routeros_api
+from routeros_api.exceptions import RouterOsApiCommunicationError, RouterOsApiError
+from django.conf import settings
+from .metrics import routeros_call_seconds
+from .profiling import external
+
+logger = logging.getLogger(__name__)
+
+
+class RouterUnavailable(Exception):
+    """The router cannot be reached right now (down, backing off or pool exhausted)"""
+
+
+class RouterPool:
+    """
+    Bounded pool of logged-in RouterOS API connections to one router.
+
+    Connections are handed out with `connection()` and returned afterwards.
+    One that has been idle for `health_check_after` seconds is checked with a
+    cheap identity query first, and one that hit a socket or protocol error
+    is closed instead of being returned. Failed logins back off exponentially
+    up to `max_backoff` seconds so a dead router is not hammered by every
+    request.
+    """
+    def __init__(self, host, username, password, port=8728, max_size=4, idle_timeout=300,
+                 health_check_after=30, acquire_timeout=10, socket_timeout=10, max_backoff=60):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.port = int(port)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.acquire_timeout = acquire_timeout
+        self.socket_timeout = socket_timeout
+        self.max_backoff = max_backoff
+        self._idle = []  # (RouterOsApiPool, api, last_used)
+        self._size = 0
+        self._condition = threading.Condition()
+        self._failures = 0
+        self._retry_at = 0
+        self._closed = False
+        self.connects = 0
+        self.reuses = 0
+        self.discards = 0
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Borrow a logged-in RouterOsApi for the duration of the block. With
+        `timeout`, waiting for a connection, connecting and every socket read
+        in the block are limited to that many seconds instead of the pool's.
+        """
+        with external('routeros'), routeros_call_seconds.time(router=self.host):
+            entry = self._acquire(timeout)
+            if timeout is not None:
+                entry[0].set_timeout(timeout)
+            try:
+                yield entry[1]
+            except (OSError, RouterOsApiError) as e:
+                if isinstance(e, RouterOsApiCommunicationError) and entry[0].connected:
+                    # The router rejected the command; the connection itself is fine
+                    self._release(entry)
+                else:
+                    self._discard(entry)
+                raise
+            except BaseException:
+                self._release(entry)
+                raise
+            else:
+                self._release(entry)
+
+    def close_idle(self, max_idle=None):
+        """Close connections unused for `max_idle` seconds (default idle_timeout)"""
+        cutoff = time.monotonic() - (self.idle_timeout if max_idle is None else max_idle)
+        with self._condition:
+            stale = [entry for entry in self._idle if entry[2] <= cutoff]
+            self._idle = [entry for entry in self._idle if entry[2] > cutoff]
+            self._size -= len(stale)
+            self._condition.notify_all()
+        for entry in stale:
+            self._close(entry)
+        return len(stale)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+        self.close_idle(max_idle=-1)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'host': self.host,
+                'size': self._size,
+                'idle': len(self._idle),
+                'max_size': self.max_size,
+                'connects': self.connects,
+                'reuses': self.reuses,
+                'discards': self.discards,
+                'failures': self._failures,
+                'backoff_remaining': max(self._retry_at - time.monotonic(), 0),
+            }
+
+    def _acquire(self, timeout=None):
+        deadline = time.monotonic() + min(self.acquire_timeout, timeout or self.acquire_timeout)
+        while True:
+            with self._condition:
+                if self._closed:
+                    raise RouterUnavailable(f"Connection pool for {self.host} is closed")
+                if self._idle:
+                    entry = self._idle.pop()
+                elif self._size < self.max_size:
+                    if time.monotonic() < self._retry_at:
+                        raise RouterUnavailable(f"Router {self.host} is unreachable, retrying later")
+                    self._size += 1
+                    entry = None
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise RouterUnavailable(f"No free connection to {self.host}")
+                    self._condition.wait(remaining)
+                    continue
+
+            if entry is None:
+                return self._connect(timeout)
+            if time.monotonic() - entry[2] < self.health_check_after or self._healthy(entry):
+                self.reuses += 1
+                return entry
+            self._discard(entry)
+
+    def _connect(self, timeout=None):
+        pool = routeros_api.RouterOsApiPool(
+            host=self.host,
+            username=self.username,
+            password=self.password,
+            port=self.port,
+            plaintext_login=True
+        )
+        pool.socket_timeout = timeout or self.socket_timeout
+        try:
+            api = pool.get_api()
+        except Exception as e:
+            with self._condition:
+                self._size -= 1
+                self._failures += 1
+                backoff = min(2 ** (self._failures - 1), self.max_backoff)
+                self._retry_at = time.monotonic() + backoff
+                self._condition.notify()
+            pool.disconnect()
+            logger.warning(f"RouterOS login to {self.host} failed ({str(e)}), backing off {backoff}s")
+            raise RouterUnavailable(f"Cannot connect to {self.host}: {str(e)}") from e
+        with self._condition:
+            self._failures = 0
+            self._retry_at = 0
+        self.connects += 1
+        return (pool, api, time.monotonic())
+
+    def _healthy(self, entry):
+        try:
+            entry[1].get_resource('/system/identity').get()
+            return True
+        except Exception as e:
+            logger.info(f"Dropping stale RouterOS connection to {self.host}: {str(e)}")
+            return False
+
+    def _release(self, entry):
+        if not entry[0].connected:
+            self._discard(entry)
+            return
+        if entry[0].socket_timeout != self.socket_timeout:
+            entry[0].set_timeout(self.socket_timeout)
+        with self._condition:
+            if self._closed:
+                self._size -= 1
+            else:
+                self._idle.append((entry[0], entry[1], time.monotonic()))
+                entry = None
+            self._condition.notify()
+        if entry is not None:
+            self._close(entry)
+
+    def _discard(self, entry):
+        with self._condition:
+            self._size -= 1
+            self.discards += 1
+            self._condition.notify()
+        self._close(entry)
+
+    def _close(self, entry):
+        try:
+            entry[0].disconnect()
+        except Exception:
+            pass
+
+
+class RouterRegistry:
+    """
+    Process-wide map of RouterPools, one per router.
+
+    Pools are keyed by MikroTikDevice primary key (or 'default' for the
+    router in settings) and rebuilt when the device's address or credentials
+    change. A daemon thread closes connections idle for longer than
+    MIKROTIK_POOL_IDLE_TIMEOUT. After a fork the child starts with an empty
+    registry so sockets are never shared between processes.
+    """
+    def __init__(self):
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._reaper = None
+
+    def get(self, device=None):
+        """Return the pool for a MikroTikDevice, or for the settings router if None"""
+        if device is None:
+            key = 'default'
+            params = (settings.MIKROTIK_HOST, settings.MIKROTIK_PORT,
+                      settings.MIKROTIK_USERNAME, settings.MIKROTIK_PASSWORD)
+        else:
+            key = device.pk
+            params = (device.ip, int(device.port or 8728), device.username, device.password)
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pools = {}
+                self._reaper = None
+                self._pid = os.getpid()
+            current = self._pools.get(key)
+            if current is not None and current[0] == params:
+                return current[1]
+            pool = RouterPool(
+                host=params[0],
+                port=params[1],
+                username=params[2],
+                password=params[3],
+                max_size=getattr(settings, 'MIKROTIK_POOL_SIZE', 4),
+                idle_timeout=getattr(settings, 'MIKROTIK_POOL_IDLE_TIMEOUT', 300),
+                socket_timeout=getattr(settings, 'MIKROTIK_SOCKET_TIMEOUT', 10),
+            )
+            self._pools[key] = (params, pool)
+            self._start_reaper()
+        if current is not None:
+            current[1].close()
+        return pool
+
+    def discard(self, device):
+        """Close the pool of a deleted or reconfigured device"""
+        with self._lock:
+            current = self._pools.pop(device.pk, None)
+        if current is not None:
+            current[1].close()
+
+    def stats(self):
+        with self._lock:
+            pools = list(self._pools.items())
+        return {str(key): pool.stats() for key, (_, pool) in pools}
+
+    def close_idle(self):
+        with self._lock:
+            pools = [pool for _, pool in self._pools.values()]
+        return sum(pool.close_idle() for pool in pools)
+
+    def _start_reaper(self):
+        if self._reaper is not None:
+            return
+        self._reaper = threading.Thread(target=self._reap, name='routeros-reaper', daemon=True)
+        self._reaper.start()
+
+    def _reap(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(max(getattr(settings, 'MIKROTIK_POOL_IDLE_TIMEOUT', 300) / 2, 1))
+            try:
+                closed = self.close_idle()
+                if closed:
+                    logger.debug(f"Closed {closed} idle RouterOS connections")
+            except Exception as e:
+                logger.error(f"RouterOS idle reaper failed: {str(e)}")
+
+
+registry = RouterRegistry()
@@ -1,8 +1,10 @@
 from rest_framework import serializers
-from .models import HostspotUser, Payment, Session, Package, Voucher, MikroTikDevice
+from .models import HostspotUser, Payment, Session, SessionUsageSample, Package, Voucher, MikroTikDevice
 from rest_framework import serializers
 from .models import CustomUser
 from django.contrib.auth import authenticate
+from .package_cache import package_catalogue
+from .sparse_fields import SparseFieldsSerializerMixin
 
 class CustomUserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -79,32 +81,61 @@ class UserLoginSerializer(serializers.Serializer):
             raise serializers.ValidationError("Must include 'email' and 'password'.")
         return data
     
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = HostspotUser
         fields = [
             'id', 'username', 'phone', 'user_type', 
-            'status', 'package', 'expiry_date', 'last_online'
+            'status', 'package', 'expiry_date', 'last_online', 'data_used'
         ]
+        sparse_sources = {'data_used': []}
     
     package = serializers.StringRelatedField()
+    data_used = serializers.SerializerMethodField()
 
-class SessionSerializer(serializers.ModelSerializer):
+    def get_data_used(self, obj):
+        # Annotated by the list view; 0 for freshly created users
+        return getattr(obj, 'data_used', 0)
+
+class SessionSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     time_remaining = serializers.SerializerMethodField()
     
     class Meta:
         model = Session
         fields = '__all__'
+        sparse_sources = {'time_remaining': ['end_time']}
     
     def get_time_remaining(self, obj):
         return obj.time_remaining
         
+class SessionUsageSampleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SessionUsageSample
+        fields = ['sampled_at', 'bytes_in', 'bytes_out']
+
+class ActiveSessionSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
+    id = serializers.CharField(source='session_id', read_only=True)
+    package_name = serializers.SerializerMethodField()
+    start_time = serializers.DateTimeField(source='created_at', read_only=True)
+    time_remaining = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Session
+        fields = ['id', 'phone', 'device_mac', 'ip_address', 'package_name', 'start_time', 'time_remaining', 'status']
+        sparse_sources = {'package_name': ['package'], 'time_remaining': ['end_time']}
+
+    def get_package_name(self, obj):
+        return obj.package.package_id if obj.package else "N/A"
+
+    def get_time_remaining(self, obj):
+        return obj.time_remaining
+
 class PackageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Package
         fields = ['id', 'package_id', 'package_name', 'price', 'duration_value', 'duration_unit', 'speed', 'popular']
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     user = serializers.StringRelatedField()
     package = serializers.StringRelatedField()
     
@@ -137,17 +168,18 @@ class PaymentInitiationSerializer(serializers.Serializer):
         return value
 
     def validate_package_id(self, value):
-        if not Package.objects.filter(package_id=value).exists():
+        if package_catalogue.by_package_id(value) is None:
             raise serializers.ValidationError("Invalid package ID")
         return value
 
-class VoucherSerializer(serializers.ModelSerializer):
+class VoucherSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     is_valid = serializers.SerializerMethodField()
     
     class Meta:
         model = Voucher
         fields = '__all__'
-        read_only_fields = fields
+        read_only_fields = ['code', 'phone', 'is_used', 'created_at', 'end_time', 'payment', 'quantity', 'batch_id']
+        sparse_sources = {'is_valid': ['is_used', 'end_time']}
         
     def get_is_valid(self, obj):
         return obj.is_valid()
@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from .dashboard import invalidate_dashboard
+from .expiry import notify_session_scheduled
+from .metrics import pending_payments
+from .models import MikroTikDevice, Package, Payment, Session
+from .package_cache import package_catalogue
+from .rollups import fold_package_rollups, record_session_created
+from .routeros import registry
+
+@receiver(post_save, sender=Session)
+def schedule_session_expiry(sender, instance, **kwargs):
+    if instance.status == 'active' and instance.end_time:
+        notify_session_scheduled(instance)
+
+@receiver(post_save, sender=Session)
+def count_new_session(sender, instance, created, **kwargs):
+    if created:
+        record_session_created(instance)
+
+@receiver(post_save, sender=Payment)
+def refresh_dashboard_on_payment(sender, instance, **kwargs):
+    if instance.status == 'completed':
+        # After commit, so a dashboard read in between cannot cache the old totals again
+        transaction.on_commit(invalidate_dashboard)
+
+@receiver(post_save, sender=Payment)
+def count_pending_payment(sender, instance, created, **kwargs):
+    if created and instance.status == 'pending':
+        pending_payments.inc()
+
+@receiver(post_save, sender=Package)
+@receiver(post_delete, sender=Package)
+def refresh_package_catalogue(sender, instance, **kwargs):
+    # After commit, so no worker reloads the old rows under the new version
+    transaction.on_commit(package_catalogue.invalidate)
+
+
+@receiver(pre_delete, sender=Package)
+def fold_deleted_package_rollups(sender, instance, **kwargs):
+    fold_package_rollups(instance.pk)
+
+
+@receiver(post_delete, sender=MikroTikDevice)
+def close_device_connections(sender, instance, **kwargs):
+    registry.discard(instance)
@@ -0,0 +1,69 @@
+from rest_framework import serializers
+
+
+class SparseFieldsSerializerMixin:
+    """
+    Serializer that only renders the fields named in `?fields=a,b`.
+
+    Method fields read model attributes the ORM cannot see; list them in
+    Meta.sparse_sources (e.g. {'time_remaining': ['end_time']}) so the view
+    loads them.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = requested_fields(self.context.get('request'))
+        if requested is not None:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+
+def requested_fields(request):
+    """The set of field names in ?fields=, or None when all fields are wanted"""
+    if request is None or request.method != 'GET':
+        return None
+    value = request.query_params.get('fields')
+    if not value:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsViewMixin:
+    """
+    List view that reads only the columns behind the requested fields.
+
+    The queryset is narrowed with .only() to the model fields the remaining
+    serializer fields need (plus created_at and id for pagination), and
+    select_related joins for relations that were not requested are dropped.
+    """
+    always_load = ('id', 'created_at')
+
+    def requested_fields(self):
+        return requested_fields(self.request)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        requested = self.requested_fields()
+        if requested is None:
+            return queryset
+
+        serializer_class = self.get_serializer_class()
+        sparse_sources = getattr(serializer_class.Meta, 'sparse_sources', {})
+        fields = self.get_serializer().fields
+        model = queryset.model
+        concrete = {field.name for field in model._meta.concrete_fields}
+
+        load, relations = set(self.always_load) & concrete, set()
+        for name, field in fields.items():
+            sources = sparse_sources.get(name)
+            if sources is None:
+                sources = [name if field.source == '*' else field.source.split('.')[0]]
+            for source in sources:
+                if source in concrete:
+                    load.add(source)
+                    if model._meta.get_field(source).is_relation:
+                        relations.add(source)
+
+        selected = queryset.query.select_related
+        if isinstance(selected, dict):
+            queryset = queryset.select_related(None).select_related(*(name for name in selected if name in relations))
+        return queryset.only(*load)
@@ -1,3 +1,578 @@
-from django.test import TestCase
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models.signals import post_init
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+from loadtest.driver import percentile
+from .expiry import TimingWheel
+from .exports import export_queryset
+from .hotspot_stream import HotspotStreamService
+from .metrics import MetricsRegistry
+from .mikrotik import fetch_all_devices, ingest_usage, reconcile_active_sessions, sync_all_devices
+from .models import CustomUser, DailyUsage, HostspotUser, MikroTikDevice, Package, Payment, Session, Voucher
+from .package_cache import package_catalogue
+from .profiling import QueryBudgetExceeded
+from .redemption import RedemptionError, redeem_voucher
+from .rollups import rebuild_rollups
+from .usernames import UsernameAllocator
+from .voucher_cache import VoucherValidator
+from .vouchers import create_voucher_batch
 
-# Create your tests here.
+PROFILED = ['afrinet.profiling.ProfilingMiddleware', *[
+    name for name in settings.MIDDLEWARE if name != 'afrinet.profiling.ProfilingMiddleware'
+]]
+
+
+def make_package(package_id='p1', price=50, duration_value=1, duration_unit='hour'):
+    return Package.objects.create(
+        package_id=package_id, package_name=f'Package {package_id}', price=price,
+        duration_value=duration_value, duration_unit=duration_unit, speed='5M'
+    )
+
+
+@override_settings(MIDDLEWARE=PROFILED, QUERY_BUDGET_STRICT=True, QUERY_BUDGETS={})
+class QueryBudgetTests(TestCase):
+    """Every view with a query_budget stays within it with several rows per related object"""
+    rows = 6
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_superuser('admin@example.com', 'secret')
+        packages = [make_package(f'p{i}', price=20 + i) for i in range(3)]
+        for i in range(cls.rows):
+            package = packages[i % len(packages)]
+            user = HostspotUser.objects.create(username=f'D{i:04d}', phone=f'2547000000{i:02d}', package=package)
+            payment = Payment.objects.create(
+                user=user, phone=user.phone, amount=package.price, package=package,
+                transaction_id=f'ws_CO_{i}', status='completed'
+            )
+            Session.objects.create(
+                user=user, phone=user.phone, package=package, payment=payment, device_mac=f'02:00:00:00:00:{i:02X}',
+                duration_minutes=60, end_time=timezone.now() + timedelta(hours=1), status='active'
+            )
+        create_voucher_batch(packages[0], cls.rows)
+
+    def setUp(self):
+        cache.clear()
+        package_catalogue.invalidate()
+        token = RefreshToken.for_user(self.admin).access_token
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+
+    def assertWithinBudget(self, method, url, **kwargs):
+        try:
+            response = getattr(self.client, method)(url, **kwargs)
+        except QueryBudgetExceeded as e:
+            self.fail(str(e))
+        self.assertLess(response.status_code, 400, url)
+
+    def test_dashboard(self):
+        self.assertWithinBudget('get', reverse('dashboard'))
+
+    def test_packages(self):
+        self.assertWithinBudget('get', reverse('package-list'))
+
+    def test_payments(self):
+        self.assertWithinBudget('get', reverse('payment-list'))
+
+    def test_users(self):
+        self.assertWithinBudget('get', reverse('users'))
+        self.assertWithinBudget('get', reverse('users'), data={'fields': 'id,username,package'})
+
+    def test_active_users(self):
+        self.assertWithinBudget('get', reverse('active-user-list'))
+
+    def test_active_user_stats(self):
+        self.assertWithinBudget('get', reverse('active-user-stats'))
+
+    def test_all_active_sessions(self):
+        self.assertWithinBudget('get', reverse('all_active_sessions'))
+
+    def test_vouchers(self):
+        self.assertWithinBudget('get', reverse('voucher-list-create'))
+
+    def test_validate_voucher(self):
+        self.assertWithinBudget('post', reverse('validate-voucher'), data={'code': 'NOSUCHCODE'},
+                                content_type='application/json')
+
+    def test_budget_is_enforced(self):
+        with override_settings(QUERY_BUDGETS={'users': 0}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('users'))
+
+
+class VoucherValidatorTests(TestCase):
+    def setUp(self):
+        package = make_package()
+        self.payment = Payment.objects.create(phone='', amount=50, package=package, transaction_id='VOUCHER-1', status='completed')
+        self.validator = VoucherValidator(refresh_interval=0)
+
+    def make_voucher(self, code, **kwargs):
+        return Voucher.objects.create(code=code, payment=self.payment, **kwargs)
+
+    def test_unknown_code_is_rejected_without_a_lookup(self):
+        self.make_voucher('REAL0001')
+        self.assertEqual(self.validator.validate('GUESS001'), {'valid': False, 'message': 'Invalid voucher code'})
+        self.assertEqual(self.validator.db_lookups, 0)
+
+    def test_late_commit_with_a_lower_id_is_picked_up(self):
+        self.make_voucher('LATER010', id=10)
+        self.assertTrue(self.validator.known('LATER010'))
+        # A batch that took its ids earlier but committed after id 10 was seen
+        self.make_voucher('EARLY005', id=5)
+        self.assertTrue(self.validator.known('EARLY005'))
+        self.assertTrue(self.validator.validate('EARLY005')['valid'])
+
+    def test_used_and_expired(self):
+        self.make_voucher('USED0001', is_used=True)
+        self.make_voucher('OLD00001', end_time=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.validator.validate('USED0001')['message'], 'Voucher already used')
+        self.assertEqual(self.validator.validate('OLD00001')['message'], 'Voucher expired')
+
+
+class SyncAllDevicesTests(TestCase):
+    def setUp(self):
+        self.up = MikroTikDevice.objects.create(name='up', ip='10.0.0.1', username='admin', password='')
+        self.down = MikroTikDevice.objects.create(name='down', ip='10.0.0.2', username='admin', password='')
+
+    def make_session(self, mac, router=None):
+        return Session.objects.create(device_mac=mac, router=router, duration_minutes=60, status='active')
+
+    def fetch(self, device, timeout=None):
+        if device == self.down:
+            raise ConnectionError('no route to host')
+        return [{'.id': '*1', 'mac-address': '02:00:00:00:00:01', 'address': '10.5.0.1', 'router': device.pk}], 1.0
+
+    def test_only_routers_that_answered_disconnect(self):
+        seen = self.make_session('02:00:00:00:00:01')
+        gone = self.make_session('02:00:00:00:00:02', router=self.up)
+        hidden = self.make_session('02:00:00:00:00:03', router=self.down)
+        unassigned = self.make_session('02:00:00:00:00:04')
+        with mock.patch('afrinet.mikrotik._fetch_active', side_effect=self.fetch):
+            result = sync_all_devices()
+
+        self.assertEqual((result['failed_devices'], result['disconnected']), (1, 1))
+        seen.refresh_from_db()
+        self.assertEqual((seen.status, seen.router), ('active', self.up))
+        self.assertEqual(Session.objects.get(pk=gone.pk).status, 'disconnected')
+        self.assertEqual(Session.objects.get(pk=hidden.pk).status, 'active')
+        self.assertEqual(Session.objects.get(pk=unassigned.pk).status, 'active')
+
+    def test_queued_routers_get_their_own_timeout(self):
+        devices = [self.up, self.down] + [
+            MikroTikDevice.objects.create(name=f'r{i}', ip=f'10.0.1.{i}', username='admin', password='') for i in range(2)
+        ]
+
+        def fetch(device, timeout=None):
+            time.sleep(0.15)
+            return [], 150.0
+
+        # One worker runs the routers back to back, well past a single timeout in total
+        with mock.patch('afrinet.mikrotik._fetch_active', side_effect=fetch):
+            _, report, failed = fetch_all_devices(devices, timeout=0.3, max_workers=1)
+
+        self.assertEqual(failed, 0)
+        self.assertEqual([entry['status'] for entry in report], ['Online'] * 4)
+
+    def test_only_the_hung_router_times_out(self):
+        release = threading.Event()
+
+        def fetch(device, timeout=None):
+            if device == self.down:
+                release.wait(5)
+            return [], 1.0
+
+        with mock.patch('afrinet.mikrotik._fetch_active', side_effect=fetch):
+            _, report, failed = fetch_all_devices([self.down, self.up], timeout=0.2, max_workers=2)
+        release.set()
+
+        self.assertEqual(failed, 1)
+        self.assertEqual([entry['status'] for entry in report], ['Offline', 'Online'])
+        self.assertIn('Timed out', report[0]['error'])
+
+
+class UsageIngestTests(TestCase):
+    mac = '02:00:00:00:00:01'
+
+    def setUp(self):
+        self.session = Session.objects.create(device_mac=self.mac, duration_minutes=60, status='active')
+
+    def sample(self, bytes_in, bytes_out):
+        return ingest_usage([{'mac-address': self.mac, 'bytes-in': str(bytes_in), 'bytes-out': str(bytes_out)}])
+
+    def test_deltas_accumulate(self):
+        self.sample(1000, 200)
+        result = self.sample(1500, 300)
+        self.session.refresh_from_db()
+        self.assertEqual((result['bytes_in'], result['bytes_out']), (500, 100))
+        self.assertEqual((self.session.bytes_in, self.session.bytes_out, self.session.data_used), (1500, 300, 1800))
+        self.assertEqual(self.session.usage_samples.count(), 2)
+
+    def test_counter_reset_counts_in_full(self):
+        self.sample(1000, 200)
+        self.sample(400, 50)
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.bytes_in, self.session.bytes_out), (1400, 250))
+
+    def test_unchanged_counters_store_no_sample(self):
+        self.sample(1000, 200)
+        self.assertEqual(self.sample(1000, 200)['sessions'], 0)
+        self.assertEqual(self.session.usage_samples.count(), 1)
+
+    def test_reactivated_session_starts_a_new_baseline(self):
+        self.sample(5000, 1000)
+        Session.objects.filter(pk=self.session.pk).update(is_active=False, status='disconnected')
+        reconcile_active_sessions([{'mac-address': self.mac, 'address': '10.5.0.1'}])
+        # The new router entry has already passed the old counters
+        self.sample(6000, 1500)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.status, 'active')
+        self.assertEqual((self.session.bytes_in, self.session.bytes_out), (11000, 2500))
+
+
+class UsernameAllocatorTests(TestCase):
+    def test_rolled_back_numbers_are_not_handed_out_twice(self):
+        first, second = UsernameAllocator(prefix='T', block_size=5), UsernameAllocator(prefix='T', block_size=5)
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                first.allocate()
+                raise RuntimeError('callback failed')
+        names = [first.allocate() for _ in range(3)] + [second.allocate() for _ in range(3)]
+        self.assertEqual(len(set(names)), 6)
+
+
+class ReconcileTests(TestCase):
+    def test_created_session_gets_the_package_end_time(self):
+        package = make_package(duration_value=2)
+        HostspotUser.objects.create(username='D1', phone='254700000001', package=package)
+        reconcile_active_sessions([
+            {'mac-address': '02:00:00:00:00:01', 'address': '10.5.0.1', 'user': 'D1'},
+            {'mac-address': '02:00:00:00:00:02', 'address': '10.5.0.2', 'user': 'guest'},
+        ])
+        known = Session.objects.get(device_mac='02:00:00:00:00:01')
+        self.assertEqual(known.end_time - known.created_at, timedelta(hours=2))
+        self.assertIsNone(Session.objects.get(device_mac='02:00:00:00:00:02').end_time)
+
+    def test_created_and_reactivated_sessions_are_scheduled_for_expiry(self):
+        package = make_package()
+        HostspotUser.objects.create(username='D1', phone='254700000001', package=package)
+        returning = Session.objects.create(
+            device_mac='02:00:00:00:00:02', duration_minutes=60, end_time=timezone.now() + timedelta(minutes=30),
+            status='disconnected', is_active=False
+        )
+        with mock.patch('afrinet.mikrotik.notify_sessions_scheduled') as notify:
+            reconcile_active_sessions([
+                {'mac-address': '02:00:00:00:00:01', 'address': '10.5.0.1', 'user': 'D1'},
+                {'mac-address': '02:00:00:00:00:02', 'address': '10.5.0.2'},
+            ])
+        (scheduled,), _ = notify.call_args
+        self.assertEqual(
+            sorted(session.pk for session in scheduled),
+            sorted([Session.objects.get(device_mac='02:00:00:00:00:01').pk, returning.pk])
+        )
+        self.assertTrue(all(session.end_time for session in scheduled))
+
+    def test_device_returning_after_its_session_ended_gets_a_new_session(self):
+        ended = Session.objects.create(device_mac='02:00:00:00:00:01', duration_minutes=60)
+        # Disconnected before its end time, which has since passed
+        Session.objects.filter(pk=ended.pk).update(
+            end_time=timezone.now() - timedelta(minutes=5), status='disconnected', is_active=False
+        )
+        reconcile_active_sessions([{'mac-address': '02:00:00:00:00:01', 'address': '10.5.0.1'}])
+        ended.refresh_from_db()
+        self.assertEqual(ended.status, 'disconnected')
+        self.assertTrue(Session.objects.filter(device_mac='02:00:00:00:00:01', status='active').exclude(pk=ended.pk).exists())
+
+    def test_active_session_past_its_end_is_left_to_the_expiry_service(self):
+        overdue = Session.objects.create(device_mac='02:00:00:00:00:01', duration_minutes=60)
+        Session.objects.filter(pk=overdue.pk).update(end_time=timezone.now() - timedelta(minutes=5))
+        result = reconcile_active_sessions([{'mac-address': '02:00:00:00:00:01', 'address': '10.5.0.1'}])
+        self.assertEqual((result['created'], result['updated']), (0, 0))
+        self.assertEqual(Session.objects.get().pk, overdue.pk)
+
+
+class RollupTests(TestCase):
+    mac = '02:00:00:00:00:01'
+
+    def setUp(self):
+        self.package = make_package()
+        self.session = self.make_session(self.mac, self.package)
+
+    def make_session(self, mac, package, data_used=1000):
+        session = Session.objects.create(
+            device_mac=mac, package=package, duration_minutes=60,
+            end_time=timezone.now() + timedelta(hours=1), status='active'
+        )
+        Session.objects.filter(pk=session.pk).update(data_used=data_used)
+        return session
+
+    def usage(self):
+        return DailyUsage.objects.get(package=self.package).data_used
+
+    def test_disconnected_session_data_is_counted_and_rebuilt(self):
+        admin = CustomUser.objects.create_superuser('admin@example.com', 'secret')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(admin).access_token}'
+        response = self.client.patch(reverse('disconnect-user', args=[self.session.session_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.usage(), 1000)
+
+        today = timezone.localdate()
+        rebuild_rollups(today, today)
+        self.assertEqual(self.usage(), 1000)
+
+    def test_reopened_session_is_counted_once_when_it_ends_again(self):
+        reconcile_active_sessions([])
+        self.assertEqual(self.usage(), 1000)
+        reconcile_active_sessions([{'mac-address': self.mac, 'address': '10.5.0.1'}])
+        self.assertEqual(self.usage(), 0)
+
+        Session.objects.filter(pk=self.session.pk).update(data_used=1500)
+        reconcile_active_sessions([])
+        self.assertEqual(self.usage(), 1500)
+
+    def test_one_row_without_a_package_per_day(self):
+        DailyUsage.objects.create(date=timezone.localdate())
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DailyUsage.objects.create(date=timezone.localdate())
+
+    def test_deleted_packages_fold_into_the_row_without_a_package(self):
+        other = make_package('p2')
+        self.make_session('02:00:00:00:00:02', other)
+        self.package.delete()
+        other.delete()
+        self.assertEqual(DailyUsage.objects.get(package__isnull=True).sessions, 2)
+
+
+class DashboardInvalidationTests(TestCase):
+    def test_completed_payment_invalidates_after_commit(self):
+        package = make_package()
+        with mock.patch('afrinet.signals.invalidate_dashboard') as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                Payment.objects.create(phone='254700000000', amount=50, package=package, status='completed')
+                invalidate.assert_not_called()
+        invalidate.assert_called_once_with()
+
+
+class MetricsEndpointTests(TestCase):
+    def test_open_to_internal_addresses_without_a_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.7').status_code, 403)
+        # Prometheus usually scrapes from another host on the private network
+        for address in ('10.1.2.3', '172.20.0.5', '192.168.88.10'):
+            self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR=address).status_code, 200, address)
+        # A proxy on the same host would otherwise make every request look local
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_X_FORWARDED_FOR='203.0.113.7').status_code, 403)
+
+    @override_settings(METRICS_ALLOWED_NETWORKS=['10.9.0.0/16'])
+    def test_allowed_networks_can_be_narrowed(self):
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.9.1.1').status_code, 200)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.1.2.3').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_token_is_required_when_set(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-secret', REMOTE_ADDR='203.0.113.7')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE afrinet_active_sessions gauge', response.content)
+
+
+class TrackedGaugeTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.active = 0
+
+    def registry(self):
+        # A stand-in for one gunicorn worker; it only flushes on its own once a minute
+        registry = MetricsRegistry(self.directory, flush_interval=60, sync_timeout=5)
+        return registry, registry.tracked_gauge('sessions', 'Active sessions', lambda: self.active, resync_interval=3600)
+
+    def value(self, registry):
+        return [line for line in registry.render().splitlines() if line.startswith('sessions ')][0]
+
+    def test_unflushed_deltas_are_not_counted_twice(self):
+        scraper, _ = self.registry()
+        worker, gauge = self.registry()
+        gauge.inc(3)
+        self.active = 3
+        self.assertEqual(self.value(scraper), 'sessions 3')
+        worker.flush()
+        self.assertEqual(self.value(scraper), 'sessions 3')
+
+    def test_processes_share_the_anchor(self):
+        first, first_gauge = self.registry()
+        second, _ = self.registry()
+        self.active = 2
+        self.assertEqual(self.value(first), 'sessions 2')
+        # A change no delta reported is only picked up at the next re-count, by every process alike
+        self.active = 5
+        first_gauge.inc()
+        first.flush()
+        self.assertEqual(self.value(second), 'sessions 3')
+        self.assertEqual(self.value(first), 'sessions 3')
+
+
+class RedeemVoucherTests(TransactionTestCase):
+    def test_concurrent_redeems_spend_the_voucher_once(self):
+        package = make_package()
+        _, (voucher,) = create_voucher_batch(package, 1)
+        devices = 8
+        barrier = threading.Barrier(devices)
+        outcomes = []
+
+        def redeem(index):
+            barrier.wait()
+            try:
+                for _ in range(50):
+                    try:
+                        redeem_voucher(voucher.code, phone=f'25470000{index:04d}')
+                        outcomes.append('redeemed')
+                        return
+                    except RedemptionError as e:
+                        outcomes.append(e.status_code)
+                        return
+                    except OperationalError:
+                        # SQLite refuses a second writer instead of waiting for it
+                        time.sleep(0.01)
+                outcomes.append('locked')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=redeem, args=(index,)) for index in range(devices)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(outcomes, key=str), [409] * (devices - 1) + ['redeemed'])
+        self.assertEqual(Session.objects.filter(voucher_code=voucher.code).count(), 1)
+
+
+class TimingWheelTests(TestCase):
+    def test_deadlines_expire_on_their_tick(self):
+        wheel = TimingWheel(1000)
+        deadlines = {'now': 1000, 'second': 1001, 'minute': 1075, 'hour': 1000 + 7300, 'day': 1000 + 90000}
+        for key, deadline in deadlines.items():
+            wheel.add(key, deadline)
+        expired = {}
+        for tick in range(1001, 1000 + 7400):
+            for key in wheel.advance(tick):
+                expired[key] = tick
+        self.assertEqual(expired, {'now': 1001, 'second': 1001, 'minute': 1075, 'hour': 1000 + 7300})
+        self.assertEqual(wheel.advance(1000 + 89999), [])
+        self.assertEqual(wheel.advance(1000 + 90000), ['day'])
+        self.assertEqual(len(wheel), 0)
+
+    def test_beyond_the_horizon(self):
+        wheel = TimingWheel(0, slots=(4, 4, 4))
+        deadline = wheel.horizon * 2 + 5
+        wheel.add('far', deadline)
+        self.assertEqual(wheel.advance(deadline - 1), [])
+        self.assertEqual(wheel.advance(deadline), ['far'])
+
+    def test_reschedule_and_remove(self):
+        wheel = TimingWheel(0)
+        wheel.add('extended', 10)
+        wheel.add('extended', 200)
+        wheel.add('removed', 10)
+        wheel.remove('removed')
+        self.assertEqual(wheel.advance(10), [])
+        self.assertEqual(wheel.advance(199), [])
+        self.assertEqual(wheel.advance(200), ['extended'])
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_superuser('admin@example.com', 'secret')
+
+    def setUp(self):
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.admin).access_token}'
+        package = make_package()
+        moment = timezone.now()
+        for i in range(7):
+            payment = Payment.objects.create(phone='254700000000', amount=50, package=package, transaction_id=f'ws_CO_{i}')
+            # Ties on created_at are broken by id
+            Payment.objects.filter(pk=payment.pk).update(created_at=moment - timedelta(minutes=i // 3))
+        self.expected = list(Payment.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+
+    def page(self, url, **params):
+        response = self.client.get(url, data=params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_cover_every_row_once(self):
+        seen, url, pages = [], reverse('payment-list'), []
+        data = self.page(url, page_size=2)
+        while True:
+            pages.append(data)
+            seen.extend(row['id'] for row in data['results'])
+            if not data['next']:
+                break
+            data = self.page(data['next'])
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(len(pages), 4)
+
+        # Going back from the last page returns the page before it
+        previous = self.page(pages[-1]['previous'])
+        self.assertEqual([row['id'] for row in previous['results']], [row['id'] for row in pages[-2]['results']])
+
+    def test_rows_added_while_paging_are_not_repeated(self):
+        first = self.page(reverse('payment-list'), page_size=3)
+        Payment.objects.create(phone='254700000000', amount=50, transaction_id='ws_CO_new')
+        second = self.page(first['next'])
+        self.assertEqual([row['id'] for row in second['results']], self.expected[3:6])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('payment-list'), data={'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class HotspotStreamTests(TestCase):
+    def test_flush_only_touches_the_macs_in_the_batch(self):
+        for i in range(5):
+            Session.objects.create(device_mac=f'02:00:00:00:01:{i:02X}', duration_minutes=60, status='active')
+        returning = Session.objects.create(device_mac='02:00:00:00:00:01', duration_minutes=60, status='disconnected', is_active=False)
+        ups = {mac: {'mac-address': mac, 'address': '10.5.0.1'} for mac in ('02:00:00:00:00:01', '02:00:00:00:00:02')}
+
+        loaded = []
+        def count_loads(sender, instance, **kwargs):
+            if instance.pk is not None:
+                loaded.append(instance.device_mac)
+        post_init.connect(count_loads, sender=Session)
+        self.addCleanup(post_init.disconnect, count_loads, sender=Session)
+
+        HotspotStreamService()._apply(ups, set())
+
+        self.assertEqual(loaded, ['02:00:00:00:00:01'])
+        returning.refresh_from_db()
+        self.assertEqual(returning.status, 'active')
+        self.assertEqual(Session.objects.filter(status='active').count(), 7)
+
+
+class ExportTests(TestCase):
+    def test_rows_come_in_created_at_order(self):
+        package = make_package()
+        moment = timezone.now()
+        for i, minutes in enumerate((5, 1, 3)):
+            payment = Payment.objects.create(phone='254700000000', amount=50, package=package, transaction_id=f'ws_CO_{i}')
+            Payment.objects.filter(pk=payment.pk).update(created_at=moment - timedelta(minutes=minutes))
+        rows = list(export_queryset('payments', start=moment - timedelta(hours=1)))
+        self.assertEqual([row[1] for row in rows], ['ws_CO_0', 'ws_CO_2', 'ws_CO_1'])
+
+
+class PercentileTests(SimpleTestCase):
+    def test_nearest_rank(self):
+        ordered = list(range(1, 101))
+        self.assertEqual([percentile(ordered, f) for f in (0.5, 0.95, 0.99, 1.0)], [50, 95, 99, 100])
+        self.assertEqual(percentile([1, 2, 3, 4], 0.5), 2)
+        self.assertEqual(percentile([7], 0.99), 7)
+        self.assertEqual(percentile([], 0.5), 0.0)
@@ -7,8 +7,11 @@ from .views import (
     ActiveUserDetail,
     ActiveUserList,
     ActiveUserStats,
+    ActiveUserUsage,
+    DashboardAPIView,
     DashboardStatsAPIView,
     DisconnectActiveUser,
+    ExportView,
     PackageDistributionDataAPIView,
     PackageListCreateView,
     InitiatePaymentView,
@@ -25,6 +28,7 @@ from .views import (
     AllActiveSessionsView,
     UserListAPIView,
     PaymentListView,
+    RedeemVoucher,
     ValidateVoucher,
     VerifyResetCodeAPIView,
     VoucherDetail,
@@ -36,7 +40,8 @@ from .views import (
     mikrotik_device_list,
     test_mikrotik_connection,
     GenerateVouchersView,
-    create_superuser
+    create_superuser,
+    metrics
 )
 
 def create_superuser_view(request):
@@ -62,12 +67,15 @@ urlpatterns = [
     path('auth/logout/', UserLogoutAPIView.as_view(), name='logout'),    
     path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('auth/verify/', TokenVerifyView.as_view(), name='token-verify'),
+    path('metrics/', metrics, name='metrics'),
+    path('dashboard/', DashboardAPIView.as_view(), name='dashboard'),
     path('dashboard/stats/', DashboardStatsAPIView.as_view()),
     path('dashboard/payment-chart/', PaymentChartDataAPIView.as_view()),
     path('dashboard/user-activity/', UserActivityDataAPIView.as_view()),
     path('dashboard/package-distribution/', PackageDistributionDataAPIView.as_view()),
     path('packages/', PackageListCreateView.as_view(), name='package-list'),
     path('payments/', PaymentListView.as_view(), name='payment-list'),
+    path('exports/<str:dataset>.<str:file_format>', ExportView.as_view(), name='export'),
     path('users/', UserListAPIView.as_view(), name='users'),
     path('initiate-payment/', InitiatePaymentView.as_view(), name='initiate-payment'),
     path('sessions/', AllActiveSessionsView.as_view(), name='all_active_sessions'),
@@ -76,14 +84,16 @@ urlpatterns = [
     path('mpesa/auth-test/', MpesaAuthTestView.as_view(), name='mpesa-auth-test'),
     path('active-users/', ActiveUserList.as_view(), name='active-user-list'),
     path('active-users/<uuid:session_id>/', ActiveUserDetail.as_view(), name='active-user-detail'),
+    path('active-users/<uuid:session_id>/usage/', ActiveUserUsage.as_view(), name='active-user-usage'),
     path('active-users/<uuid:session_id>/disconnect/', DisconnectActiveUser.as_view(), name='disconnect-user'),
     path('active-users/stats/', ActiveUserStats.as_view(), name='active-user-stats'),
     
     # Vouchers
     path('vouchers/', VoucherListCreate.as_view(), name='voucher-list-create'),
-    path('vouchers/<str:code>/', VoucherDetail.as_view(), name='voucher-detail'),
     path('vouchers/validate/', ValidateVoucher.as_view(), name='validate-voucher'),
+    path('vouchers/redeem/', RedeemVoucher.as_view(), name='redeem-voucher'),
     path('vouchers/generate/', GenerateVouchersView.as_view(), name='generate-voucher'),
+    path('vouchers/<str:code>/', VoucherDetail.as_view(), name='voucher-detail'),
         
     # MikroTik
     path('mikrotik/sync/', sync_mikrotik, name='sync-mikrotik'),
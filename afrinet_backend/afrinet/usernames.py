@@ -0,0 +1,62 @@
+import os
+import threading
+from collections import deque
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from .models import UsernameSequence
+
+SEQUENCE_NAME = 'afrinet_hotspot_username_seq'
+
+
+class UsernameAllocator:
+    """
+    Hands out hotspot usernames (D1, D2, ...) without scanning HostspotUser.
+
+    Each process reserves a block of numbers in one round trip and serves
+    them from memory. On PostgreSQL the numbers come from a native sequence,
+    which is never rolled back, so two workers can never receive the same
+    number. Other databases fall back to the UsernameSequence counter row;
+    there a caller's transaction can roll the counter back, so inside one
+    a single number is taken with the caller's writes and nothing is cached.
+    """
+    def __init__(self, prefix='D', block_size=50):
+        self.prefix = prefix
+        self.block_size = block_size
+        self._numbers = deque()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def allocate(self):
+        if connection.vendor != 'postgresql' and connection.in_atomic_block:
+            # A block cached here would outlive a rollback of the counter and be handed out again
+            return f"{self.prefix}{self._reserve_block(1)[0]}"
+        with self._lock:
+            if self._pid != os.getpid():
+                # Numbers reserved before a fork would be handed out twice
+                self._numbers.clear()
+                self._pid = os.getpid()
+            if not self._numbers:
+                self._numbers.extend(self._reserve_block())
+            return f"{self.prefix}{self._numbers.popleft()}"
+
+    def _reserve_block(self, size=None):
+        size = size or self.block_size
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT nextval('{SEQUENCE_NAME}') FROM generate_series(1, %s)",
+                    [size]
+                )
+                return [row[0] for row in cursor.fetchall()]
+
+        with transaction.atomic():
+            sequence, _ = UsernameSequence.objects.select_for_update().get_or_create(prefix=self.prefix)
+            start = sequence.next_value
+            UsernameSequence.objects.filter(pk=sequence.pk).update(
+                next_value=F('next_value') + size
+            )
+        return range(start, start + size)
+
+
+username_allocator = UsernameAllocator(block_size=getattr(settings, 'HOTSPOT_USERNAME_BLOCK_SIZE', 50))
@@ -1,23 +1,36 @@
+import hmac
+import ipaddress
 import random
 import string
 from tokenize import TokenError
 from rest_framework import generics, status, filters
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from .dashboard import get_dashboard_snapshot
+from .exports import CONTENT_TYPES, EXPORTS, ExportError, export_queryset, parse_bound, stream_rows
 from .mikrotik_utils import test_connection_to_device
-from .mikrotik import MikroTik
-from .models import CustomUser, Package, HostspotUser, Payment, Session, Voucher, MikroTikDevice
-from .serializers import PaymentSerializer, PackageSerializer, PaymentInitiationSerializer, MikroTikDeviceSerializer, UserRegistrationSerializer,UserSerializer, SessionSerializer, VoucherSerializer
+from .metrics import active_sessions, registry as metrics_registry
+from .mikrotik import MikroTik, sync_all_devices
+from .package_cache import package_catalogue
+from .redemption import RedemptionError, redeem_voucher
+from .rollups import record_sessions_ended
+from .sparse_fields import SparseFieldsViewMixin
+from .voucher_cache import voucher_validator
+from .vouchers import create_voucher_batch, rollback_vouchers
+from .models import CustomUser, Package, HostspotUser, Payment, Session, SessionUsageSample, Voucher, MikroTikDevice
+from .serializers import PaymentSerializer, PackageSerializer, PaymentInitiationSerializer, MikroTikDeviceSerializer, UserRegistrationSerializer,UserSerializer, SessionSerializer, SessionUsageSampleSerializer, VoucherSerializer, ActiveSessionSerializer
 from django.utils import timezone
 from datetime import timedelta
 import logging
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.conf import settings
 import base64
 from datetime import datetime
 import requests
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from django.db import transaction
 from django.db.models import Avg
+from django.db.models.functions import Coalesce
 from rest_framework.decorators import api_view
 logger = logging.getLogger(__name__)
 from rest_framework_simplejwt.tokens import RefreshToken
@@ -28,7 +41,7 @@ from .serializers import PackageSerializer
 from .serializers import UserLoginSerializer, CustomUserSerializer
 from django.contrib.auth import authenticate
 from django.contrib.auth import get_user_model
-from django.http import JsonResponse
+from .jsoncodec import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 import os
 from django.core.mail import send_mail
@@ -318,103 +331,86 @@ def send_password_reset_email(user, reset_link):
         fail_silently=False,
     )
 
-class DashboardStatsAPIView(APIView):
+class DashboardAPIView(APIView):
     permission_classes = [IsAuthenticated]
+    query_budget = 5  # queries per request, including the JWT user lookup
 
     def get(self, request):
-        # Current month calculations
-        current_month = timezone.now().month
-        monthly_amount = Payment.objects.filter(
-            created_at__month=current_month,
-            status='completed'
-        ).aggregate(total=Sum('amount'))['total'] or 0
-
-        # Total active users
-        total_clients = HostspotUser.objects.filter(status='active').count()
-
-        # Current active sessions
-        active_sessions = Session.objects.filter(
-            is_active=True,
-            status='active'
-        ).count()
-
-        # Recent payments count
-        recent_payments = Payment.objects.filter(
-            created_at__gte=timezone.now() - timedelta(days=7)
-        ).count()
+        # All dashboard panels from one cached snapshot
+        return Response(get_dashboard_snapshot())
 
-        return Response({
-            'monthly_amount': float(monthly_amount),
-            'total_clients': total_clients,
-            'active_sessions': active_sessions,
-            'recent_payments': recent_payments
-        })
+class DashboardStatsAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response(get_dashboard_snapshot()['stats'])
 
 class PaymentChartDataAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         # Last 7 days payment data
-        date_range = [timezone.now() - timedelta(days=i) for i in range(6, -1, -1)]
-        
-        daily_payments = []
-        for day in date_range:
-            total = Payment.objects.filter(
-                created_at__date=day.date(),
-                status='completed'
-            ).aggregate(total=Sum('amount'))['total'] or 0
-            daily_payments.append(float(total))
-
-        return Response({
-            'labels': [day.strftime('%a') for day in date_range],
-            'data': daily_payments
-        })
+        return Response(get_dashboard_snapshot()['payment_chart'])
 
 class UserActivityDataAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         # Last 7 days user activity
-        date_range = [timezone.now() - timedelta(days=i) for i in range(6, -1, -1)]
-        
-        active_users = []
-        for day in date_range:
-            count = Session.objects.filter(
-                created_at__date=day.date()
-            ).count()
-            active_users.append(count)
-
-        return Response({
-            'labels': [day.strftime('%a') for day in date_range],
-            'data': active_users
-        })
+        return Response(get_dashboard_snapshot()['user_activity'])
 
 class PackageDistributionDataAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         # Package distribution data
-        packages = Package.objects.all()
-        package_data = []
-        labels = []
-        
-        for package in packages:
-            count = Session.objects.filter(
-                package=package,
-                created_at__gte=timezone.now() - timedelta(days=30)
-            ).count()
-            if count > 0:  # Only include packages with usage
-                package_data.append(count)
-                labels.append(package.package_name)
-
-        return Response({
-            'labels': labels,
-            'data': package_data
-        })
+        return Response(get_dashboard_snapshot()['package_distribution'])
       
+class ExportView(APIView):
+    """
+    Stream a full history export, e.g. /api/exports/payments.csv?start=2024-05-01&end=2024-05-31&gzip=1
+
+    `start` and `end` filter on created_at (dates or datetimes, end date
+    inclusive); `gzip=1` compresses the stream.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, dataset, file_format):
+        if dataset not in EXPORTS or file_format not in CONTENT_TYPES:
+            return Response({'error': 'Unknown export'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            start = parse_bound(request.query_params.get('start'))
+            end = parse_bound(request.query_params.get('end'), end=True)
+        except ExportError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        compress = request.query_params.get('gzip', '').lower() in ('1', 'true')
+
+        filename = f"{dataset}.{file_format}{'.gz' if compress else ''}"
+        response = StreamingHttpResponse(
+            stream_rows(dataset, file_format, export_queryset(dataset, start, end), compress=compress),
+            content_type='application/gzip' if compress else CONTENT_TYPES[file_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['Cache-Control'] = 'no-store'
+        return response
+
 class PackageListCreateView(generics.ListCreateAPIView):
     queryset = Package.objects.all()
     serializer_class = PackageSerializer
+    pagination_class = None  # Small table the portal needs whole
+    query_budget = {'GET': 2}
+
+    def list(self, request, *args, **kwargs):
+        # Served from the in-process catalogue; unchanged copies get a 304
+        body, etag = package_catalogue.response()
+        requested = [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]
+        if etag in requested or f'W/{etag}' in requested or '*' in requested:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        return response
     
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -423,8 +419,9 @@ class PackageListCreateView(generics.ListCreateAPIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class PaymentListView(generics.ListAPIView):
+class PaymentListView(SparseFieldsViewMixin, generics.ListAPIView):
     serializer_class = PaymentSerializer
+    query_budget = 2
 
     def get_queryset(self):
         queryset = Payment.objects.all().select_related('user', 'package')
@@ -436,13 +433,18 @@ class PaymentListView(generics.ListAPIView):
             
         return queryset.order_by('-created_at')
     
-class UserListAPIView(generics.ListCreateAPIView):  # Changed from ListAPIView to ListCreateAPIView
+class UserListAPIView(SparseFieldsViewMixin, generics.ListCreateAPIView):  # Changed from ListAPIView to ListCreateAPIView
     serializer_class = UserSerializer
     filter_backends = [filters.SearchFilter]
     search_fields = ['username', 'phone']
+    query_budget = {'GET': 3}
 
     def get_queryset(self):
-        queryset = HostspotUser.objects.all()
+        # SparseFieldsViewMixin drops the join when `package` is not requested
+        queryset = HostspotUser.objects.select_related('package')
+        requested = self.requested_fields()
+        if requested is None or 'data_used' in requested:
+            queryset = queryset.annotate(data_used=Coalesce(Sum('session__data_used'), 0))
         user_filter = self.request.query_params.get('filter', None)
         
         if user_filter == 'hotspot':
@@ -454,15 +456,26 @@ class UserListAPIView(generics.ListCreateAPIView):  # Changed from ListAPIView t
             
         return queryset.order_by('-created_at')
 
-class ActiveUserList(generics.ListAPIView):
+class ActiveUserList(SparseFieldsViewMixin, generics.ListAPIView):
     queryset = Session.objects.filter(is_active=True, status='active')
     serializer_class = SessionSerializer
+    query_budget = 2
 
 class ActiveUserDetail(generics.RetrieveAPIView):
     queryset = Session.objects.filter(is_active=True)
     serializer_class = SessionSerializer
     lookup_field = 'session_id'
 
+class ActiveUserUsage(generics.ListAPIView):
+    """Usage time series of one session, oldest first"""
+    serializer_class = SessionUsageSampleSerializer
+    pagination_class = None
+
+    def get_queryset(self):
+        return SessionUsageSample.objects.filter(
+            session__session_id=self.kwargs['session_id']
+        ).order_by('sampled_at')
+
 class DisconnectActiveUser(generics.UpdateAPIView):
     queryset = Session.objects.filter(is_active=True)
     serializer_class = SessionSerializer
@@ -470,40 +483,52 @@ class DisconnectActiveUser(generics.UpdateAPIView):
     
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
+        was_active = instance.status == 'active'
         instance.disconnected = True
         instance.is_active = False
         instance.status = 'disconnected'
         instance.disconnected_at = timezone.now()
-        instance.save()
+        with transaction.atomic():
+            instance.save()
+            if was_active:
+                record_sessions_ended([instance.pk])
+        if was_active:
+            active_sessions.dec()
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
 class ActiveUserStats(generics.GenericAPIView):
+    query_budget = 2
+
     def get(self, request):
-        active_count = Session.objects.filter(is_active=True).count()
-        total_data = sum(s.data_used for s in Session.objects.filter(is_active=True))
-        return Response({
-            'active_users': active_count,
-            'total_data_used': total_data,
-            'average_session_length': Session.objects.filter(is_active=True).aggregate(Avg('duration_minutes'))['duration_minutes__avg']
-        })
+        stats = Session.objects.filter(is_active=True).aggregate(
+            active_users=Count('id'),
+            total_data_used=Coalesce(Sum('data_used'), 0),
+            total_bytes_in=Coalesce(Sum('bytes_in'), 0),
+            total_bytes_out=Coalesce(Sum('bytes_out'), 0),
+            average_session_length=Avg('duration_minutes')
+        )
+        return Response(stats)
     
 class MpesaAuthTestView(APIView):
     """Endpoint to test M-Pesa authentication"""
     def get(self, request):
         try:
+            from mpesa.client import get_client
+            from mpesa.services import MpesaService
             auth_url = f"{settings.MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
-            response = requests.get(
+            response = get_client().get(
                 auth_url,
-                auth=(settings.MPESA_CONSUMER_KEY, settings.MPESA_CONSUMER_SECRET),
-                timeout=30
+                auth=(settings.MPESA_CONSUMER_KEY, settings.MPESA_CONSUMER_SECRET)
             )
             
             if response.status_code == 200:
                 return Response({
                     'success': True,
                     'access_token': response.json().get('access_token'),
-                    'expires_in': response.json().get('expires_in')
+                    'expires_in': response.json().get('expires_in'),
+                    'token_cache': MpesaService.token_stats(),
+                    'http_pool': MpesaService.http_stats()
                 })
             return Response({
                 'success': False,
@@ -556,7 +581,9 @@ class InitiatePaymentView(APIView):
         
         try:
             logger.info(f"Received payment request: phone={phone}, package_id={package_id}")
-            package = Package.objects.get(package_id=package_id)  # Use custom package_id field
+            package = package_catalogue.by_package_id(package_id)  # Use custom package_id field
+            if package is None:
+                raise Package.DoesNotExist
             logger.info(f"Selected package: id={package.id}, package_id={package.package_id}, price={package.price}")
             
             user, created = HostspotUser.objects.get_or_create(
@@ -628,7 +655,9 @@ class UserSessionView(APIView):
                 'created_at': session.created_at,
                 'end_time': session.end_time,  # Fixed typo: 'endItime' to 'end_time'
                 'time_remaining': session.time_remaining,
-                'data_used': session.data_used
+                'data_used': session.data_used,
+                'bytes_in': session.bytes_in,
+                'bytes_out': session.bytes_out
             })
         except Session.DoesNotExist:
             return Response({'active': False})
@@ -639,120 +668,84 @@ class UserSessionView(APIView):
                 'message': 'Error checking session'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class AllActiveSessionsView(APIView):
-    def get(self, request, *args, **kwargs):
-        sessions = Session.objects.filter(status='active')
-        session_data = []
-        for session in sessions:
-            session_data.append({
-                "id": str(session.session_id),
-                "phone": session.phone,
-                "device_mac": session.device_mac,
-                "ip_address": session.ip_address,
-                "package_name": session.package.package_id if session.package else "N/A",
-                "start_time": session.created_at,
-                "time_remaining": session.time_remaining,
-                "status": session.status,
-            })
-        return Response(session_data, status=status.HTTP_200_OK)
+class AllActiveSessionsView(SparseFieldsViewMixin, generics.ListAPIView):
+    queryset = Session.objects.filter(status='active').select_related('package')
+    serializer_class = ActiveSessionSerializer
+    query_budget = 2
 
 def home(request):
     return HttpResponse("Welcome to the Afrinet WiFi platform!")
 
-def generate_voucher_code(length=8):
-    chars = string.ascii_uppercase + string.digits
-    return ''.join(random.choice(chars) for _ in range(length))
+def metrics(request):
+    """
+    Prometheus scrape endpoint. Requires `Authorization: Bearer <METRICS_TOKEN>`
+    when that is set; otherwise only direct requests from
+    METRICS_ALLOWED_NETWORKS are served, since anything relayed by a proxy
+    (X-Forwarded-For) may come from the internet.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        allowed = hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        allowed = 'X-Forwarded-For' not in request.headers and _internal_address(request.META.get('REMOTE_ADDR'))
+    if not allowed:
+        return HttpResponse(status=403)
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-class VoucherListCreate(generics.ListCreateAPIView):
+def _internal_address(address):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    networks = getattr(settings, 'METRICS_ALLOWED_NETWORKS', ['127.0.0.0/8', '::1/128'])
+    return any(address in ipaddress.ip_network(network.strip()) for network in networks if network.strip())
+
+def _voucher_batch_request(data):
+    """Validate package_id/quantity of a voucher batch request; returns (package, quantity, error response)"""
+    try:
+        quantity = int(data.get('quantity', 1))
+    except (TypeError, ValueError):
+        quantity = 0
+    max_quantity = getattr(settings, 'VOUCHER_BATCH_MAX_SIZE', 10000)
+    if not data.get('package_id') or not 1 <= quantity <= max_quantity:
+        return None, None, Response(
+            {'error': f'Package ID and quantity (1 to {max_quantity}) are required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        package = Package.objects.get(pk=data.get('package_id'))
+    except (Package.DoesNotExist, ValueError):
+        return None, None, Response({'error': 'Package not found'}, status=status.HTTP_404_NOT_FOUND)
+    return package, quantity, None
+
+class VoucherListCreate(SparseFieldsViewMixin, generics.ListCreateAPIView):
     queryset = Voucher.objects.all()
     serializer_class = VoucherSerializer
     permission_classes = [IsAuthenticated]
+    query_budget = {'GET': 2}
 
     def create(self, request, *args, **kwargs):
-        package_id = request.data.get('package_id')
-        phone = request.data.get('phone', '')
-        quantity = int(request.data.get('quantity', 1))
-        
-        try:
-            package = Package.objects.get(pk=package_id)
-        except Package.DoesNotExist:
-            return Response({'error': 'Package not found'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Create a dummy payment for voucher generation
-        payment = Payment.objects.create(
-            phone=phone,
-            amount=package.price * quantity,
-            transaction_id=f"VOUCHER-{timezone.now().timestamp()}",
-            package=package,
-            status='completed',
-            is_successful=True,
-            is_finished=True
-        )
-        
-        vouchers = []
-        for _ in range(quantity):
-            code = generate_voucher_code()
-            end_time = timezone.now() + timedelta(minutes=package.duration_minutes)
-            voucher = Voucher.objects.create(
-                code=code,
-                phone=phone,
-                payment=payment,
-                end_time=end_time
-            )
-            vouchers.append(voucher)
+        package, quantity, error = _voucher_batch_request(request.data)
+        if error:
+            return error
         
+        batch_id, vouchers = create_voucher_batch(package, quantity, phone=request.data.get('phone', ''))
         serializer = self.get_serializer(vouchers, many=True)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response({'batch_id': batch_id, 'vouchers': serializer.data}, status=status.HTTP_201_CREATED)
 
 class GenerateVouchersView(APIView):
     def post(self, request, *args, **kwargs):
         try:
-            package_id = request.data.get('package_id')
-            quantity = int(request.data.get('quantity', 1))
-            
-            if not package_id or quantity < 1:
-                return Response(
-                    {'error': 'Package ID and quantity (minimum 1) are required'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            try:
-                package = Package.objects.get(pk=package_id)
-            except Package.DoesNotExist:
-                return Response(
-                    {'error': 'Package not found'},
-                    status=status.HTTP_404_NOT_FOUND
-                )
-            
-            payment = Payment.objects.create(
-                amount=package.price * quantity,
-                package=package,
-                status='completed',
-                is_successful=True
-            )
-            
-            generated_vouchers = []
-            for _ in range(quantity):
-                code = ''.join(random.choices(
-                    string.ascii_uppercase + string.digits, k=8
-                ))
-                
-                expiry_time = timezone.now() + timedelta(
-                    minutes=package.duration_minutes
-                )
-                
-                voucher = Voucher.objects.create(
-                    code=code,
-                    payment=payment,
-                    end_time=expiry_time,
-                    is_used=False
-                )
-                generated_vouchers.append(voucher)
+            package, quantity, error = _voucher_batch_request(request.data)
+            if error:
+                return error
             
-            serializer = VoucherSerializer(generated_vouchers, many=True)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            batch_id, vouchers = create_voucher_batch(package, quantity)
+            serializer = VoucherSerializer(vouchers, many=True)
+            return Response({'batch_id': batch_id, 'vouchers': serializer.data}, status=status.HTTP_201_CREATED)
         
         except Exception as e:
+            logger.error(f"Voucher batch error: {str(e)}")
             return Response(
                 {'error': str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -764,27 +757,33 @@ class VoucherDetail(generics.RetrieveAPIView):
     lookup_field = 'code'
 
 class ValidateVoucher(generics.GenericAPIView):
+    query_budget = 4  # a cold Bloom filter load; usually 0
+
+    def post(self, request, *args, **kwargs):
+        return Response(voucher_validator.validate(request.data.get('code')))
+        
+class RedeemVoucher(generics.GenericAPIView):
     def post(self, request, *args, **kwargs):
-        code = request.data.get('code')
         try:
-            voucher = Voucher.objects.get(code=code)
-            if voucher.is_used:
-                return Response({'valid': False, 'message': 'Voucher already used'})
-            if voucher.end_time and voucher.end_time < timezone.now():
-                return Response({'valid': False, 'message': 'Voucher expired'})
-            return Response({
-                'valid': True,
-                'package': voucher.payment.package.package_id if voucher.payment and voucher.payment.package else None,
-                'duration_minutes': voucher.payment.package.duration_minutes if voucher.payment and voucher.payment.package else None
-            })
-        except Voucher.DoesNotExist:
-            return Response({'valid': False, 'message': 'Invalid voucher code'})
+            session = redeem_voucher(
+                request.data.get('code'),
+                phone=request.data.get('phone', ''),
+                mac_address=request.data.get('mac_address'),
+                ip_address=request.data.get('ip_address')
+            )
+        except RedemptionError as e:
+            return Response({'success': False, 'message': e.message}, status=e.status_code)
+        return Response({
+            'success': True,
+            'session_id': session.session_id,
+            'package': session.package.package_id,
+            'duration_minutes': session.duration_minutes,
+            'end_time': session.end_time
+        }, status=status.HTTP_201_CREATED)
         
 @api_view(['POST'])
 def sync_mikrotik(request):
-    mikrotik = MikroTik()
-    count = mikrotik.sync_active_users()
-    return Response({'synced_users': count})
+    return Response(sync_all_devices())
 
 @api_view(['POST'])
 def create_hotspot_user(request):
@@ -801,13 +800,9 @@ def create_hotspot_user(request):
 
 @api_view(['POST'])
 def generate_mikrotik_voucher(request):
-    package_id = request.data.get('package_id')
-    quantity = int(request.data.get('quantity', 1))
-    
-    try:
-        package = Package.objects.get(pk=package_id)
-    except Package.DoesNotExist:
-        return Response({'error': 'Package not found'}, status=400)
+    package, quantity, error = _voucher_batch_request(request.data)
+    if error:
+        return error
     
     # Generate uptime limit string for MikroTik
     if package.duration_unit == 'min':
@@ -817,22 +812,25 @@ def generate_mikrotik_voucher(request):
     else:  # day
         uptime = f"{package.duration_value}d"
     
-    mikrotik = MikroTik()
-    vouchers = []
-    
-    for _ in range(quantity):
-        code = generate_voucher_code()
-        mikrotik.generate_voucher(code, uptime=uptime)
-        
-        # Create voucher in database
-        voucher = Voucher.objects.create(
-            code=code,
-            end_time=timezone.now() + timedelta(minutes=package.duration_minutes),
-            payment=None  # Can associate with payment later
-        )
-        vouchers.append({'code': code})
+    batch_id, vouchers = create_voucher_batch(package, quantity)
+    results = MikroTik().generate_vouchers([voucher.code for voucher in vouchers], uptime=uptime)
+    failed = [code for code, error in results.items() if error]
+    if failed:
+        rollback_vouchers(batch_id, failed)
     
-    return Response({'vouchers': vouchers})
+    return Response({
+        'batch_id': batch_id if len(failed) < len(vouchers) else None,
+        'created': len(vouchers) - len(failed),
+        'failed': len(failed),
+        'vouchers': [
+            {'code': code, 'status': 'failed' if error else 'created', 'error': error}
+            for code, error in results.items()
+        ]
+    }, status=(
+        status.HTTP_200_OK if not failed
+        else status.HTTP_502_BAD_GATEWAY if len(failed) == len(vouchers)
+        else status.HTTP_207_MULTI_STATUS
+    ))
 
 @api_view(['GET'])
 def mikrotik_device_list(request):
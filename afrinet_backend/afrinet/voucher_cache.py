@@ -0,0 +1,219 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .metrics import voucher_validation_seconds
+from .models import Voucher
+
+MESSAGES = {
+    'invalid': 'Invalid voucher code',
+    'used': 'Voucher already used',
+    'expired': 'Voucher expired',
+}
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings.
+
+    Sized for `capacity` items at `error_rate` false positives; the k bit
+    positions come from one blake2b digest with double hashing.
+    """
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(capacity, 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 64)
+        self.hashes = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class VoucherValidator:
+    """
+    Answers portal voucher checks mostly from process memory.
+
+    A Bloom filter of every code rejects unknown codes without touching the
+    database, so guessing floods stay in memory. New codes are added when a
+    batch is committed in this process and, for batches created elsewhere,
+    at most once every `refresh_interval` seconds from the ids created in the
+    last `overlap` seconds (an index-only scan) that were not seen yet. An id
+    watermark would miss rows of a batch that commits after a later one, so
+    the window must outlast the longest voucher transaction. The filter is
+    rebuilt from scratch every `rebuild_interval` seconds or when it outgrows
+    its capacity.
+
+    Codes that pass the filter are looked up with one select_related query
+    and kept in an LRU cache for `ttl` seconds together with their package
+    duration, so repeated checks of a real code are served from memory too.
+    """
+    def __init__(self, cache_size=10000, ttl=30, refresh_interval=1, rebuild_interval=3600, error_rate=0.001,
+                 overlap=600):
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.overlap = overlap
+        self.rebuild_interval = rebuild_interval
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._filter = None
+        self._seen = {}  # id -> created_at of codes in the filter created within `overlap`
+        self._refreshed_at = 0
+        self._built_at = 0
+        self._pid = None
+        self._cache = OrderedDict()
+        self.filter_rejects = 0
+        self.cache_hits = 0
+        self.db_lookups = 0
+
+    def validate(self, code):
+        """Return the portal response for a voucher code"""
+        start = time.perf_counter()
+        result, entry = self._check(code)
+        voucher_validation_seconds.observe(time.perf_counter() - start, result=result)
+        if result != 'valid':
+            return {'valid': False, 'message': MESSAGES[result]}
+        return {
+            'valid': True,
+            'package': entry['package'],
+            'duration_minutes': entry['duration_minutes']
+        }
+
+    def known(self, code):
+        """False when the code certainly does not exist"""
+        if not code or not isinstance(code, str):
+            return False
+        self._sync_filter()
+        if code in self._filter:
+            return True
+        self.filter_rejects += 1
+        return False
+
+    def add(self, codes):
+        """Make freshly created codes known to this process"""
+        with self._lock:
+            if self._filter is None:
+                return
+            for code in codes:
+                self._filter.add(code)
+                self._cache.pop(code, None)
+
+    def invalidate(self, code):
+        """Drop a code from the hot cache after it was used or changed"""
+        with self._lock:
+            self._cache.pop(code, None)
+
+    def stats(self):
+        return {
+            'codes': self._filter.count if self._filter else 0,
+            'capacity': self._filter.capacity if self._filter else 0,
+            'cached': len(self._cache),
+            'filter_rejects': self.filter_rejects,
+            'cache_hits': self.cache_hits,
+            'db_lookups': self.db_lookups,
+        }
+
+    def _check(self, code):
+        if not self.known(code):
+            return 'invalid', None
+        hit, entry = self._cached(code)
+        if not hit:
+            entry = self._load(code)
+        if entry is None:
+            return 'invalid', None
+        if entry['is_used']:
+            return 'used', entry
+        if entry['end_time'] and entry['end_time'] < timezone.now():
+            return 'expired', entry
+        return 'valid', entry
+
+    def _sync_filter(self):
+        now = time.monotonic()
+        if self._filter is not None and self._pid == os.getpid() and now - self._refreshed_at < self.refresh_interval:
+            return
+        with self._lock:
+            if self._filter is None or self._pid != os.getpid() or now - self._built_at >= self.rebuild_interval \
+                    or self._filter.count > self._filter.capacity:
+                self._rebuild(now)
+            elif now - self._refreshed_at >= self.refresh_interval:
+                self._refresh()
+                self._refreshed_at = now
+
+    def _refresh(self):
+        since = timezone.now() - timedelta(seconds=self.overlap)
+        recent = Voucher.objects.filter(created_at__gte=since).values_list('id', flat=True)
+        missing = [voucher_id for voucher_id in recent if voucher_id not in self._seen]
+        for start in range(0, len(missing), 1000):
+            rows = Voucher.objects.filter(id__in=missing[start:start + 1000]).values_list('id', 'code', 'created_at')
+            for voucher_id, code, created_at in rows:
+                self._filter.add(code)
+                self._seen[voucher_id] = created_at
+        self._seen = {voucher_id: created_at for voucher_id, created_at in self._seen.items() if created_at >= since}
+
+    def _rebuild(self, now):
+        since = timezone.now() - timedelta(seconds=self.overlap)
+        bloom = BloomFilter(max(Voucher.objects.count() * 2, 10000), self.error_rate)
+        seen = {}
+        for voucher_id, code, created_at in Voucher.objects.values_list('id', 'code', 'created_at').iterator(chunk_size=10000):
+            bloom.add(code)
+            if created_at >= since:
+                seen[voucher_id] = created_at
+        self._filter = bloom
+        self._seen = seen
+        self._cache.clear()
+        self._pid = os.getpid()
+        self._built_at = self._refreshed_at = now
+
+    def _cached(self, code):
+        with self._lock:
+            entry = self._cache.get(code)
+            if entry is None:
+                return False, None
+            if entry['expires'] < time.monotonic():
+                del self._cache[code]
+                return False, None
+            self._cache.move_to_end(code)
+            self.cache_hits += 1
+            return True, entry['voucher']
+
+    def _load(self, code):
+        self.db_lookups += 1
+        voucher = Voucher.objects.select_related('payment__package').filter(code=code).first()
+        package = voucher.payment.package if voucher and voucher.payment else None
+        entry = voucher and {
+            'is_used': voucher.is_used,
+            'end_time': voucher.end_time,
+            'package': package.package_id if package else None,
+            'duration_minutes': package.duration_minutes if package else None,
+        }
+        with self._lock:
+            # Misses are cached too so a filter false positive is only read once per ttl
+            self._cache[code] = {'voucher': entry, 'expires': time.monotonic() + self.ttl}
+            self._cache.move_to_end(code)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return entry
+
+
+voucher_validator = VoucherValidator(
+    cache_size=getattr(settings, 'VOUCHER_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'VOUCHER_CACHE_TTL', 30),
+    overlap=getattr(settings, 'VOUCHER_FILTER_OVERLAP', 600)
+)
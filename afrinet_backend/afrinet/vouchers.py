@@ -0,0 +1,109 @@
+import logging
+import secrets
+import string
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import Payment, Voucher
+from .rollups import record_payment_adjusted, record_payment_completed
+from .voucher_cache import voucher_validator
+
+logger = logging.getLogger(__name__)
+
+CODE_ALPHABET = string.ascii_uppercase + string.digits
+
+
+def generate_voucher_code(length=8):
+    return ''.join(secrets.choice(CODE_ALPHABET) for _ in range(length))
+
+
+def allocate_voucher_codes(quantity, length=8):
+    """
+    Return `quantity` distinct codes that are not in the Voucher table yet.
+
+    Codes come from the OS CSPRNG; duplicates within the batch are dropped in
+    memory and the remainder is checked against the database with one IN
+    query per round. With 36^8 possible codes a second round is rare.
+    """
+    codes = set()
+    while len(codes) < quantity:
+        candidates = set()
+        while len(candidates) < quantity - len(codes):
+            code = generate_voucher_code(length)
+            if code not in codes:
+                candidates.add(code)
+        taken = set(Voucher.objects.filter(code__in=candidates).values_list('code', flat=True))
+        codes |= candidates - taken
+    return list(codes)
+
+
+def create_voucher_batch(package, quantity, phone='', length=8, attempts=3):
+    """
+    Generate `quantity` vouchers for `package` as one batch.
+
+    The batch's Payment and all its vouchers are written in one transaction
+    with chunked bulk_create, so a failure never leaves half a batch behind.
+    If a concurrent batch claims one of the codes between the check and the
+    insert, the whole batch is retried with fresh codes. Returns the batch
+    id and the created vouchers.
+    """
+    chunk_size = getattr(settings, 'VOUCHER_BULK_CHUNK_SIZE', 1000)
+    for attempt in range(1, attempts + 1):
+        batch_id = uuid.uuid4()
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                payment = Payment.objects.create(
+                    phone=phone,
+                    amount=package.price * quantity,
+                    transaction_id=f"VOUCHER-{batch_id}",
+                    package=package,
+                    status='completed',
+                    is_successful=True,
+                    is_finished=True,
+                    completed_at=now
+                )
+                end_time = now + timedelta(minutes=package.duration_minutes)
+                vouchers = [
+                    Voucher(code=code, phone=phone, payment=payment, end_time=end_time, batch_id=batch_id)
+                    for code in allocate_voucher_codes(quantity, length)
+                ]
+                for start in range(0, len(vouchers), chunk_size):
+                    Voucher.objects.bulk_create(vouchers[start:start + chunk_size])
+                record_payment_completed(payment)
+                codes = [voucher.code for voucher in vouchers]
+                transaction.on_commit(lambda: voucher_validator.add(codes))
+        except IntegrityError:
+            if attempt == attempts:
+                raise
+            logger.warning(f"Voucher code collision in batch {batch_id}, retrying ({attempt}/{attempts})")
+            continue
+        logger.info(f"Created voucher batch {batch_id}: {quantity} x {package.package_name}")
+        return batch_id, vouchers
+
+
+def rollback_vouchers(batch_id, codes):
+    """
+    Remove vouchers of a batch that could not be provisioned on the router
+    and shrink the batch payment (and revenue rollup) to match. A batch left
+    without vouchers is deleted. Returns how many vouchers were removed.
+    """
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update(of=('self',)).select_related('package').get(transaction_id=f"VOUCHER-{batch_id}")
+        removed, _ = Voucher.objects.filter(batch_id=batch_id, code__in=list(codes)).delete()
+        for code in codes:
+            voucher_validator.invalidate(code)
+        if not removed:
+            return 0
+        if not Voucher.objects.filter(batch_id=batch_id).exists():
+            record_payment_adjusted(payment, -payment.amount, count=-1)
+            payment.delete()
+        else:
+            refund = payment.package.price * removed if payment.package else 0
+            payment.amount -= refund
+            payment.save(update_fields=['amount'])
+            record_payment_adjusted(payment, -refund)
+    logger.warning(f"Rolled back {removed} vouchers of batch {batch_id} that failed on the router")
+    return removed
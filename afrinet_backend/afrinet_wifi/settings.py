@@ -53,6 +53,13 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-request SQL/latency profile with Server-Timing headers and query budgets
+REQUEST_PROFILING = os.getenv('REQUEST_PROFILING', 'False') == 'True'
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', 'False') == 'True'  # raise instead of logging over-budget requests (CI)
+QUERY_BUDGETS = {}  # URL name -> max queries, overrides a view's query_budget
+if REQUEST_PROFILING:
+    MIDDLEWARE.insert(0, 'afrinet.profiling.ProfilingMiddleware')
+
 # Root URL config
 ROOT_URLCONF = 'afrinet_wifi.urls'
 
@@ -85,6 +92,19 @@ DATABASES = {
     'default': dj_database_url.parse(DATABASE_URL, conn_max_age=600)
 }
 
+# Cache (shared between workers when REDIS_URL is set, per-process otherwise)
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+
+# Seconds the admin dashboard snapshot is cached; completed payments invalidate it early
+DASHBOARD_CACHE_TTL = int(os.getenv('DASHBOARD_CACHE_TTL', 30))
+
 # Password validators
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -132,6 +152,19 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    # Keyset pagination on (created_at, id); ?page_size= up to 1000
+    'DEFAULT_PAGINATION_CLASS': 'afrinet.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.getenv('API_PAGE_SIZE', 100)),
+    # orjson-backed JSON codec with a stdlib fallback
+    'DEFAULT_RENDERER_CLASSES': (
+        'afrinet.jsoncodec.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'afrinet.jsoncodec.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
 SIMPLE_JWT = {
@@ -184,6 +217,33 @@ MIKROTIK_HOST = os.getenv('MIKROTIK_HOST', '192.168.88.1')
 MIKROTIK_USERNAME = os.getenv('MIKROTIK_USERNAME', 'admin')
 MIKROTIK_PASSWORD = os.getenv('MIKROTIK_PASSWORD', '')
 MIKROTIK_PORT = int(os.getenv('MIKROTIK_PORT', 8728))
+MIKROTIK_POOL_SIZE = int(os.getenv('MIKROTIK_POOL_SIZE', 4))  # API connections kept per router
+MIKROTIK_POOL_IDLE_TIMEOUT = int(os.getenv('MIKROTIK_POOL_IDLE_TIMEOUT', 300))  # seconds before an unused connection is closed
+MIKROTIK_SOCKET_TIMEOUT = float(os.getenv('MIKROTIK_SOCKET_TIMEOUT', 10))
+MIKROTIK_SYNC_WORKERS = int(os.getenv('MIKROTIK_SYNC_WORKERS', 16))  # routers polled in parallel
+MIKROTIK_SYNC_TIMEOUT = float(os.getenv('MIKROTIK_SYNC_TIMEOUT', 15))  # seconds a router gets to answer a sync
+USAGE_SAMPLE_RETENTION_DAYS = int(os.getenv('USAGE_SAMPLE_RETENTION_DAYS', 90))  # per-session usage history kept
+
+# Hotspot usernames reserved per worker in one database round trip
+HOTSPOT_USERNAME_BLOCK_SIZE = int(os.getenv('HOTSPOT_USERNAME_BLOCK_SIZE', 50))
+
+# Voucher batches
+VOUCHER_BATCH_MAX_SIZE = int(os.getenv('VOUCHER_BATCH_MAX_SIZE', 10000))
+VOUCHER_BULK_CHUNK_SIZE = int(os.getenv('VOUCHER_BULK_CHUNK_SIZE', 1000))  # rows per INSERT
+VOUCHER_CACHE_SIZE = int(os.getenv('VOUCHER_CACHE_SIZE', 10000))  # validated codes kept in memory per process
+VOUCHER_CACHE_TTL = int(os.getenv('VOUCHER_CACHE_TTL', 30))  # seconds
+VOUCHER_FILTER_OVERLAP = int(os.getenv('VOUCHER_FILTER_OVERLAP', 600))  # seconds of new vouchers re-checked by each filter refresh; must exceed the longest batch transaction
+HOTSPOT_LOGIN_WORKERS = int(os.getenv('HOTSPOT_LOGIN_WORKERS', 4))  # threads logging redeemed devices into the router
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 2000))  # rows fetched per server-side cursor round trip
+PACKAGE_CACHE_CHECK_INTERVAL = float(os.getenv('PACKAGE_CACHE_CHECK_INTERVAL', 1))  # seconds between package catalogue version checks
+PACKAGE_CACHE_MAX_AGE = int(os.getenv('PACKAGE_CACHE_MAX_AGE', 300))  # reload after this many seconds even without a version change
+FAST_JSON = os.getenv('FAST_JSON', 'True') == 'True'  # encode/decode with orjson when it is installed
+METRICS_DIR = os.getenv('METRICS_DIR')  # per-process metric files; defaults to <tmp>/afrinet-metrics, must be shared by all workers
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))  # seconds between writes of a worker's metrics
+METRICS_GAUGE_RESYNC = int(os.getenv('METRICS_GAUGE_RESYNC', 300))  # re-count active sessions/pending payments at most this often
+METRICS_SYNC_TIMEOUT = float(os.getenv('METRICS_SYNC_TIMEOUT', 2))  # seconds a re-count waits for every worker to flush its deltas
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')  # bearer token required by /api/metrics/; without it only METRICS_ALLOWED_NETWORKS may scrape
+METRICS_ALLOWED_NETWORKS = os.getenv('METRICS_ALLOWED_NETWORKS', '127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16').split(',')  # unproxied scrapers allowed without METRICS_TOKEN
 
 # M-PESA Configuration
 MPESA_CONSUMER_KEY = os.getenv("MPESA_CONSUMER_KEY")
@@ -192,6 +252,17 @@ MPESA_SHORTCODE = os.getenv("MPESA_SHORTCODE")
 MPESA_PASSKEY = os.getenv("MPESA_PASSKEY")
 MPESA_BASE_URL = os.getenv("MPESA_BASE_URL")
 MPESA_CALLBACK_URL = os.getenv("MPESA_CALLBACK_URL")
+MPESA_TOKEN_EXPIRY_MARGIN = int(os.getenv("MPESA_TOKEN_EXPIRY_MARGIN", 60))  # seconds before expiry a token is dropped
+MPESA_TOKEN_EARLY_REFRESH = int(os.getenv("MPESA_TOKEN_EARLY_REFRESH", 300))  # seconds before expiry a background refresh starts
+MPESA_HTTP_POOL_SIZE = int(os.getenv("MPESA_HTTP_POOL_SIZE", 10))  # keep-alive connections per host
+MPESA_HTTP_CONNECT_TIMEOUT = float(os.getenv("MPESA_HTTP_CONNECT_TIMEOUT", 3.05))
+MPESA_HTTP_READ_TIMEOUT = float(os.getenv("MPESA_HTTP_READ_TIMEOUT", 15))
+MPESA_HTTP_MAX_RETRIES = int(os.getenv("MPESA_HTTP_MAX_RETRIES", 2))  # idempotent calls only
+MPESA_ASYNC_STK_PUSH = os.getenv("MPESA_ASYNC_STK_PUSH", "False") == "True"  # queue pushes instead of waiting on Daraja
+MPESA_STK_DISPATCH = os.getenv("MPESA_STK_DISPATCH", "thread")  # 'thread': web process sends, 'worker': process_stk_queue sends
+MPESA_STK_WORKERS = int(os.getenv("MPESA_STK_WORKERS", 8))
+MPESA_STK_MAX_ATTEMPTS = int(os.getenv("MPESA_STK_MAX_ATTEMPTS", 3))
+MPESA_CALLBACK_PROCESSING = os.getenv("MPESA_CALLBACK_PROCESSING", "thread")  # 'thread': drain inbox in-process, 'worker': process_callbacks drains it
 
 # Logging
 LOGGING = {
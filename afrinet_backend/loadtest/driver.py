@@ -0,0 +1,192 @@
+import math
+import random
+import threading
+import time
+import uuid
+import requests
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def portal_phone(index):
+    # Distinct last four digits: stk_push names new customers user<last 4 digits of the phone>
+    return f'2547{index % 10000 + 90000000}'
+
+
+class LoadDriver:
+    """
+    Replays captive-portal traffic against a running backend.
+
+    `concurrency` virtual customers loop until `duration` seconds have
+    passed (or `visits` visits were made). A visit lists the packages and
+    then either pays with M-Pesa (stk_push, then verify_session every
+    `poll_interval` seconds until the session exists, the payment fails or
+    `poll_timeout` runs out) or, at `voucher_share`, validates a voucher and
+    redeems it from `vouchers` while codes last. Each customer keeps its own
+    keep-alive connection. Latencies are recorded per step.
+    """
+    def __init__(self, base_url, concurrency=20, duration=30, visits=None, voucher_share=0.3,
+                 invalid_voucher_share=0.2, poll_interval=1.0, poll_timeout=60, vouchers=(), timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.duration = duration
+        self.visits = visits
+        self.voucher_share = voucher_share
+        self.invalid_voucher_share = invalid_voucher_share
+        self.poll_interval = poll_interval
+        self.poll_timeout = poll_timeout
+        self.timeout = timeout
+        self.samples = {}  # step -> [(seconds, ok)]
+        self.outcomes = {}
+        self._vouchers = list(vouchers)
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def run(self):
+        """Run the load and return the report"""
+        threads = [
+            threading.Thread(target=self._customer, args=(index,), name=f'loadtest-{index}', daemon=True)
+            for index in range(self.concurrency)
+        ]
+        self.started_at = time.perf_counter()
+        self._deadline = self.started_at + self.duration
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - self.started_at
+        return self.report()
+
+    def report(self):
+        steps = {}
+        requests_total = 0
+        with self._lock:
+            samples = {step: list(values) for step, values in self.samples.items()}
+            outcomes = dict(self.outcomes)
+        for step, values in sorted(samples.items()):
+            timings = sorted(seconds for seconds, _ in values)
+            steps[step] = {
+                'count': len(values),
+                'errors': sum(1 for _, ok in values if not ok),
+                'rps': round(len(values) / self.elapsed, 2),
+                'p50_ms': round(percentile(timings, 0.50) * 1000, 1),
+                'p95_ms': round(percentile(timings, 0.95) * 1000, 1),
+                'p99_ms': round(percentile(timings, 0.99) * 1000, 1),
+                'max_ms': round(timings[-1] * 1000, 1),
+            }
+            if step != 'payment_to_session':
+                requests_total += len(values)
+        return {
+            'elapsed_s': round(self.elapsed, 2),
+            'concurrency': self.concurrency,
+            'visits': sum(outcomes.values()),
+            'requests': requests_total,
+            'rps': round(requests_total / self.elapsed, 2),
+            'outcomes': outcomes,
+            'steps': steps,
+        }
+
+    def _record(self, step, seconds, ok):
+        with self._lock:
+            self.samples.setdefault(step, []).append((seconds, ok))
+
+    def _outcome(self, name):
+        with self._lock:
+            self.outcomes[name] = self.outcomes.get(name, 0) + 1
+
+    def _claim_visit(self):
+        with self._lock:
+            if time.perf_counter() >= self._deadline or (self.visits is not None and self._started >= self.visits):
+                return False
+            self._started += 1
+            return True
+
+    def _claim_voucher(self):
+        with self._lock:
+            return self._vouchers.pop() if self._vouchers else None
+
+    def _call(self, session, step, method, path, ok=lambda response: response.status_code < 400, **kwargs):
+        """Send one request and record its latency; returns the response or None on a network error"""
+        start = time.perf_counter()
+        try:
+            response = session.request(method, f'{self.base_url}{path}', timeout=self.timeout, **kwargs)
+        except requests.RequestException:
+            self._record(step, time.perf_counter() - start, False)
+            return None
+        self._record(step, time.perf_counter() - start, ok(response))
+        return response
+
+    def _customer(self, index):
+        session = requests.Session()
+        rng = random.Random(index)
+        visit = 0
+        while self._claim_visit():
+            phone = portal_phone(index + visit * self.concurrency)
+            visit += 1
+            response = self._call(session, 'packages', 'GET', '/api/packages/')
+            packages = []
+            if response is not None and response.status_code == 200:
+                data = response.json()
+                packages = data.get('results', []) if isinstance(data, dict) else data
+            if rng.random() < self.voucher_share:
+                self._voucher_visit(session, rng, phone)
+            elif packages:
+                self._payment_visit(session, rng.choice(packages), phone)
+            else:
+                self._outcome('no_packages')
+
+    def _payment_visit(self, session, package, phone):
+        started = time.perf_counter()
+        response = self._call(session, 'stk_push', 'POST', '/mpesa/stk-push/', json={
+            'phone': phone, 'amount': package['price'], 'package_id': package['package_id']
+        })
+        if response is None or response.status_code != 200:
+            self._outcome('push_failed')
+            return
+        checkout_request_id = response.json().get('checkout_request_id')
+
+        deadline = time.perf_counter() + self.poll_timeout
+        while time.perf_counter() < deadline:
+            time.sleep(self.poll_interval)
+            response = self._call(
+                session, 'verify_session', 'POST', '/mpesa/verify-session/',
+                json={'transaction_id': checkout_request_id, 'phone': phone},
+                ok=lambda response: response.status_code == 200
+            )
+            if response is None or response.status_code != 200:
+                continue
+            data = response.json()
+            if data.get('success'):
+                self._record('payment_to_session', time.perf_counter() - started, True)
+                self._outcome('paid')
+                return
+            if data.get('status') == 'failed':
+                self._outcome('cancelled')
+                return
+        self._record('payment_to_session', time.perf_counter() - started, False)
+        self._outcome('verify_timeout')
+
+    def _voucher_visit(self, session, rng, phone):
+        code = None if rng.random() < self.invalid_voucher_share else self._claim_voucher()
+        if code is None:
+            self._call(session, 'voucher_validate', 'POST', '/api/vouchers/validate/',
+                       json={'code': f'LT{uuid.uuid4().hex[:6].upper()}'})
+            self._outcome('voucher_invalid')
+            return
+        response = self._call(session, 'voucher_validate', 'POST', '/api/vouchers/validate/', json={'code': code})
+        if response is None or not response.json().get('valid'):
+            self._outcome('voucher_rejected')
+            return
+        suffix = f'{rng.randrange(1 << 24):06X}'
+        response = self._call(session, 'voucher_redeem', 'POST', '/api/vouchers/redeem/', json={
+            'code': code,
+            'phone': phone,
+            'mac_address': ':'.join(['02', 'AF', suffix[0:2], suffix[2:4], suffix[4:6], f'{rng.randrange(256):02X}']),
+            'ip_address': f'10.5.{rng.randrange(256)}.{rng.randrange(1, 255)}',
+        })
+        self._outcome('voucher_redeemed' if response is not None and response.status_code == 201 else 'voucher_failed')
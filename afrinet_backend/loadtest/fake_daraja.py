@@ -0,0 +1,216 @@
+import heapq
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+logger = logging.getLogger(__name__)
+
+PROCESSED = 'The service request is processed successfully.'
+CANCELLED = 'Request cancelled by user'
+
+
+class FakeDaraja:
+    """
+    Local stand-in for the Safaricom Daraja API.
+
+    Serves OAuth, STK push and STK query over HTTP. Each accepted push gets
+    its asynchronous callback after `callback_delay` seconds (plus up to
+    `jitter`): a success, a cancellation at `cancel_rate`, or nothing at
+    `drop_rate` so verify_session has to fall back to the query. Pushes are
+    rejected at `failure_rate`. Every request waits `latency` seconds (plus
+    up to `jitter`) before it is answered. Callbacks go to the push's
+    CallBackURL unless `callback_url` is given.
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0.2, jitter=0.1, callback_delay=2.0,
+                 failure_rate=0.0, cancel_rate=0.0, drop_rate=0.0, callback_url=None, callback_workers=8):
+        self.latency = latency
+        self.jitter = jitter
+        self.callback_delay = callback_delay
+        self.failure_rate = failure_rate
+        self.cancel_rate = cancel_rate
+        self.drop_rate = drop_rate
+        self.callback_url = callback_url
+        self.transactions = {}  # CheckoutRequestID -> state
+        self.counts = {}
+        self._due = []  # heap of (time, CheckoutRequestID)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stopped = False
+        self._callbacks = ThreadPoolExecutor(max_workers=callback_workers, thread_name_prefix='fake-daraja-callback')
+        self._session = requests.Session()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fake-daraja', daemon=True).start()
+        threading.Thread(target=self._callback_loop, name='fake-daraja-scheduler', daemon=True).start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._wakeup.notify()
+        self.server.shutdown()
+        self.server.server_close()
+        self._callbacks.shutdown(wait=False)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def _delay(self, base):
+        return base + random.uniform(0, self.jitter)
+
+    def oauth(self):
+        self._count('oauth')
+        return 200, {'access_token': uuid.uuid4().hex, 'expires_in': '3599'}
+
+    def stk_push(self, payload):
+        self._count('stk_push')
+        if self.failure_rate and random.random() < self.failure_rate:
+            self._count('stk_push_rejected')
+            return 500, {
+                'requestId': uuid.uuid4().hex,
+                'errorCode': '500.001.1001',
+                'errorMessage': 'Unable to lock subscriber, a transaction is already in process for the current subscriber',
+            }
+        merchant_request_id = f'{random.randint(10000, 99999)}-{random.randint(10**7, 10**8 - 1)}-1'
+        checkout_request_id = f'ws_CO_{datetime.now():%d%m%Y%H%M%S}{uuid.uuid4().hex[:12]}'
+        result_code = 1032 if random.random() < self.cancel_rate else 0
+        due = time.monotonic() + self._delay(self.callback_delay)
+        with self._lock:
+            self.transactions[checkout_request_id] = {
+                'merchant_request_id': merchant_request_id,
+                'amount': payload.get('Amount'),
+                'phone': payload.get('PhoneNumber'),
+                'callback_url': self.callback_url or payload.get('CallBackURL'),
+                'result_code': result_code,
+                'due': due,
+                'deliver': random.random() >= self.drop_rate,
+            }
+            heapq.heappush(self._due, (due, checkout_request_id))
+            self._wakeup.notify()
+        return 200, {
+            'MerchantRequestID': merchant_request_id,
+            'CheckoutRequestID': checkout_request_id,
+            'ResponseCode': '0',
+            'ResponseDescription': 'Success. Request accepted for processing',
+            'CustomerMessage': 'Success. Request accepted for processing',
+        }
+
+    def stk_query(self, payload):
+        self._count('stk_query')
+        checkout_request_id = payload.get('CheckoutRequestID')
+        with self._lock:
+            state = self.transactions.get(checkout_request_id)
+        if state is None:
+            return 500, {'requestId': uuid.uuid4().hex, 'errorCode': '400.002.02',
+                         'errorMessage': 'Bad Request - Invalid CheckoutRequestID'}
+        if time.monotonic() < state['due']:
+            return 500, {'requestId': uuid.uuid4().hex, 'errorCode': '500.001.1001',
+                         'errorMessage': 'The transaction is being processed'}
+        return 200, {
+            'ResponseCode': '0',
+            'ResponseDescription': 'The service request has been accepted successsfully',
+            'MerchantRequestID': state['merchant_request_id'],
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': str(state['result_code']),
+            'ResultDesc': PROCESSED if state['result_code'] == 0 else CANCELLED,
+        }
+
+    def callback_body(self, checkout_request_id, state):
+        callback = {
+            'MerchantRequestID': state['merchant_request_id'],
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': state['result_code'],
+            'ResultDesc': PROCESSED if state['result_code'] == 0 else CANCELLED,
+        }
+        if state['result_code'] == 0:
+            callback['CallbackMetadata'] = {'Item': [
+                {'Name': 'Amount', 'Value': float(state['amount'] or 0)},
+                {'Name': 'MpesaReceiptNumber', 'Value': uuid.uuid4().hex[:10].upper()},
+                {'Name': 'TransactionDate', 'Value': int(f'{datetime.now():%Y%m%d%H%M%S}')},
+                {'Name': 'PhoneNumber', 'Value': int(state['phone'])},
+            ]}
+        return {'Body': {'stkCallback': callback}}
+
+    def _callback_loop(self):
+        while True:
+            with self._lock:
+                while not self._stopped and (not self._due or self._due[0][0] > time.monotonic()):
+                    self._wakeup.wait(self._due[0][0] - time.monotonic() if self._due else None)
+                if self._stopped:
+                    return
+                _, checkout_request_id = heapq.heappop(self._due)
+                state = self.transactions[checkout_request_id]
+            if not state['deliver']:
+                self._count('callbacks_dropped')
+                continue
+            self._callbacks.submit(self._send_callback, checkout_request_id, state)
+
+    def _send_callback(self, checkout_request_id, state):
+        try:
+            response = self._session.post(state['callback_url'], json=self.callback_body(checkout_request_id, state), timeout=10)
+            self._count('callbacks_sent' if response.status_code == 200 else 'callbacks_failed')
+        except requests.RequestException as e:
+            self._count('callbacks_failed')
+            logger.warning(f"Callback for {checkout_request_id} failed: {str(e)}")
+
+    def _handler_class(self):
+        daraja = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                if self.path.startswith('/oauth/v1/generate'):
+                    self.respond(*daraja.oauth())
+                else:
+                    self.respond(404, {'errorMessage': 'Not found'})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    self.respond(400, {'errorCode': '400.002.02', 'errorMessage': 'Bad Request - Invalid JSON'})
+                    return
+                if not (self.headers.get('Authorization') or '').startswith('Bearer '):
+                    self.respond(401, {'errorCode': '404.001.03', 'errorMessage': 'Invalid Access Token'})
+                elif self.path == '/mpesa/stkpush/v1/processrequest':
+                    self.respond(*daraja.stk_push(payload))
+                elif self.path == '/mpesa/stkpushquery/v1/query':
+                    self.respond(*daraja.stk_query(payload))
+                else:
+                    self.respond(404, {'errorMessage': 'Not found'})
+
+            def respond(self, status, body):
+                time.sleep(daraja._delay(daraja.latency))
+                content = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
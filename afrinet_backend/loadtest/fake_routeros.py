@@ -0,0 +1,218 @@
+import itertools
+import logging
+import random
+import socket
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def encode_length(length):
+    if length < 0x80:
+        return bytes([length])
+    if length < 0x4000:
+        return struct.pack('>H', length | 0x8000)
+    if length < 0x200000:
+        return struct.pack('>I', length | 0xC00000)[1:]
+    if length < 0x10000000:
+        return struct.pack('>I', length | 0xE0000000)
+    return b'\xf0' + struct.pack('>I', length)
+
+
+def encode_sentence(words):
+    encoded = [word.encode() for word in words]
+    return b''.join(encode_length(len(word)) + word for word in encoded) + b'\x00'
+
+
+def read_length(stream):
+    first = stream.read(1)
+    if not first:
+        raise EOFError
+    byte = first[0]
+    if byte < 0x80:
+        return byte
+    if byte < 0xC0:
+        return ((byte & 0x3F) << 8) | stream.read(1)[0]
+    if byte < 0xE0:
+        rest = stream.read(2)
+        return ((byte & 0x1F) << 16) | (rest[0] << 8) | rest[1]
+    if byte < 0xF0:
+        rest = stream.read(3)
+        return ((byte & 0x0F) << 24) | (rest[0] << 16) | (rest[1] << 8) | rest[2]
+    return struct.unpack('>I', stream.read(4))[0]
+
+
+def read_sentence(stream):
+    words = []
+    while True:
+        length = read_length(stream)
+        if length == 0:
+            return words
+        words.append(stream.read(length).decode())
+
+
+class FakeRouterOS:
+    """
+    RouterOS API server (the binary protocol on port 8728) that keeps a
+    hotspot in memory.
+
+    Supports login, /system/identity, /ip/hotspot/user add/print,
+    /ip/hotspot/active print/login/remove and `listen` on the active list,
+    which covers what afrinet.mikrotik and the hotspot stream send. Every
+    command waits `latency` seconds (plus up to `jitter`) and fails with a
+    !trap at `failure_rate`. Runs on daemon threads, one per connection.
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0.005, jitter=0.0, failure_rate=0.0, identity='LoadTest'):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.identity = identity
+        self.users = {}
+        self.active = {}  # .id -> entry
+        self.commands = {}
+        self.connections = 0
+        self._ids = itertools.count(1)
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._socket = socket.socket()
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((host, port))
+        self.host, self.port = self._socket.getsockname()
+
+    def start(self):
+        self._socket.listen(128)
+        threading.Thread(target=self._accept_loop, name='fake-routeros', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._socket.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'connections': self.connections,
+                'commands': dict(self.commands),
+                'hotspot_users': len(self.users),
+                'active': len(self.active),
+            }
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self._socket.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._lock:
+                self.connections += 1
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        stream = conn.makefile('rb')
+        send_lock = threading.Lock()
+
+        def send(*words):
+            with send_lock:
+                conn.sendall(encode_sentence(words))
+
+        try:
+            while True:
+                words = read_sentence(stream)
+                if not words:
+                    continue
+                command, attributes, tag = words[0], {}, None
+                for word in words[1:]:
+                    if word.startswith('.tag='):
+                        tag = word[5:]
+                    elif word.startswith('='):
+                        name, _, value = word[1:].partition('=')
+                        attributes[name] = value
+                self._handle(command, attributes, [f'.tag={tag}'] if tag else [], send)
+        except (EOFError, OSError, IndexError):
+            pass
+        finally:
+            with self._lock:
+                self._listeners = [listener for listener in self._listeners if listener[0] is not send]
+            conn.close()
+
+    def _handle(self, command, attributes, tag, send):
+        with self._lock:
+            self.commands[command] = self.commands.get(command, 0) + 1
+        if command == '/login':
+            send('!done', *tag)
+            return
+        if command == '/cancel':
+            with self._lock:
+                self._listeners = [listener for listener in self._listeners if listener[0] is not send]
+            send('!trap', '=category=2', '=message=interrupted', *tag)
+            send('!done', *tag)
+            return
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        if self.failure_rate and random.random() < self.failure_rate:
+            send('!trap', '=message=failure: simulated router error', *tag)
+            send('!done', *tag)
+            return
+
+        if command == '/system/identity/print':
+            send('!re', f'=name={self.identity}', *tag)
+        elif command == '/ip/hotspot/user/print':
+            with self._lock:
+                users = list(self.users.values())
+            for user in users:
+                send('!re', *self._words(user), *tag)
+        elif command == '/ip/hotspot/user/add':
+            with self._lock:
+                if attributes.get('name') in self.users:
+                    send('!trap', '=message=failure: already have user with this name', *tag)
+                    send('!done', *tag)
+                    return
+                user_id = f'*{next(self._ids):X}'
+                self.users[attributes.get('name')] = {'.id': user_id, **attributes}
+            send('!done', f'=ret={user_id}', *tag)
+            return
+        elif command == '/ip/hotspot/active/print':
+            with self._lock:
+                entries = list(self.active.values())
+            for entry in entries:
+                send('!re', *self._words(entry), *tag)
+        elif command == '/ip/hotspot/active/login':
+            with self._lock:
+                entry = {
+                    '.id': f'*{next(self._ids):X}',
+                    'user': attributes.get('user', ''),
+                    'address': attributes.get('ip', ''),
+                    'mac-address': attributes.get('mac-address', ''),
+                    'uptime': '0s',
+                    'bytes-in': '0',
+                    'bytes-out': '0',
+                }
+                self.active[entry['.id']] = entry
+            self._notify(entry)
+        elif command == '/ip/hotspot/active/remove':
+            with self._lock:
+                entry = self.active.pop(attributes.get('.id'), None)
+            if entry is not None:
+                self._notify({'.id': entry['.id'], '.dead': 'true'})
+        elif command == '/ip/hotspot/active/listen':
+            with self._lock:
+                self._listeners.append((send, tag))
+            return  # answered with !re until /cancel
+        send('!done', *tag)
+
+    def _notify(self, entry):
+        with self._lock:
+            listeners = list(self._listeners)
+        for send, tag in listeners:
+            try:
+                send('!re', *self._words(entry), *tag)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _words(entry):
+        return [f'={name}={value}' for name, value in entry.items()]
@@ -1,3 +1,8 @@
 from django.contrib import admin
+from .models import CallbackInbox
 
-# Register your models here.
+@admin.register(CallbackInbox)
+class CallbackInboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'checkout_request_id', 'status', 'received_at', 'processed_at')
+    list_filter = ('status',)
+    search_fields = ('checkout_request_id',)
@@ -0,0 +1,148 @@
+import logging
+import os
+import random
+import threading
+import time
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+from afrinet.profiling import external
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of recent traffic so an outage at Safaricom
+    does not turn into a retry storm. Every request deposits `ratio` tokens,
+    every retry spends one.
+    """
+    def __init__(self, ratio=0.2, min_tokens=10, max_tokens=100):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = float(min_tokens)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self._tokens + self.ratio, self.max_tokens)
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class DarajaClient:
+    """
+    Shared HTTP client for all Daraja calls.
+
+    Wraps one requests.Session so TCP/TLS connections stay alive between
+    calls, applies separate connect and read timeouts, and retries with
+    jittered exponential backoff, but only for calls marked idempotent.
+    """
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=15,
+                 max_retries=2, backoff_factor=0.3, retry_budget=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.retry_budget = retry_budget or RetryBudget()
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('https://', self._adapter)
+        self.session.mount('http://', self._adapter)
+        self.session.headers.update({'Connection': 'keep-alive'})
+        self.requests = 0
+        self.retries = 0
+        self.retries_denied = 0
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        """Send a request, retrying transient failures only when `idempotent`"""
+        with external('daraja'):
+            return self._request(method, url, idempotent, **kwargs)
+
+    def _request(self, method, url, idempotent, **kwargs):
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        kwargs.setdefault('timeout', self.timeout)
+        attempts = 1 + (self.max_retries if idempotent else 0)
+
+        self.requests += 1
+        self.retry_budget.deposit()
+        for attempt in range(attempts):
+            last_attempt = attempt + 1 >= attempts
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                if last_attempt or not self._allow_retry():
+                    raise
+                logger.warning(f"Daraja {method} {url} failed ({str(e)}), retrying")
+            else:
+                if response.status_code not in RETRY_STATUSES or last_attempt or not self._allow_retry():
+                    return response
+                logger.warning(f"Daraja {method} {url} returned {response.status_code}, retrying")
+                response.close()
+            time.sleep(self._backoff(attempt))
+
+    def stats(self):
+        """Request, retry and connection reuse counters for this process"""
+        new_connections = 0
+        pooled_requests = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            new_connections += pool.num_connections
+            pooled_requests += pool.num_requests
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'retries_denied': self.retries_denied,
+            'new_connections': new_connections,
+            'reused_connections': max(pooled_requests - new_connections, 0),
+        }
+
+    def _allow_retry(self):
+        if self.retry_budget.withdraw():
+            self.retries += 1
+            return True
+        self.retries_denied += 1
+        return False
+
+    def _backoff(self, attempt):
+        delay = self.backoff_factor * (2 ** attempt)
+        return delay + random.uniform(0, delay)
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return this process's DarajaClient, creating it after a fork if needed"""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = DarajaClient(
+                    pool_size=getattr(settings, 'MPESA_HTTP_POOL_SIZE', 10),
+                    connect_timeout=getattr(settings, 'MPESA_HTTP_CONNECT_TIMEOUT', 3.05),
+                    read_timeout=getattr(settings, 'MPESA_HTTP_READ_TIMEOUT', 15),
+                    max_retries=getattr(settings, 'MPESA_HTTP_MAX_RETRIES', 2),
+                )
+                _client_pid = os.getpid()
+    return _client
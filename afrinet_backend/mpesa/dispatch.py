@@ -0,0 +1,168 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from afrinet.metrics import pending_payments
+from afrinet.models import Payment
+from .services import MpesaService
+
+logger = logging.getLogger(__name__)
+
+
+def send_stk_push(payment_id):
+    """
+    Send the STK push for a queued payment and record the CheckoutRequestID.
+
+    The row is claimed with a conditional UPDATE first, so a payment picked up
+    by both the web process and the queue worker is only pushed once. Only
+    failures that happened before Daraja accepted the push (network errors,
+    throttling, errors while loading the payment) put it back in the queue;
+    once accepted it is never sent again.
+    """
+    close_old_connections()
+    try:
+        try:
+            claimed = Payment.objects.filter(pk=payment_id, push_status='queued').update(
+                push_status='sending',
+                push_started_at=timezone.now(),
+                push_attempts=F('push_attempts') + 1
+            )
+            if not claimed:
+                return False
+
+            payment = Payment.objects.select_related('package').get(pk=payment_id)
+            package = payment.package
+            response = MpesaService.initiate_stk_push(
+                phone_number=payment.phone,
+                amount=payment.amount,
+                account_reference=f"AFRNET{package.package_id}" if package else "AFRNET",
+                transaction_desc=f"AfriNet {package.package_id} Package" if package else "AfriNet Package"
+            )
+        except Exception as e:
+            logger.exception(f"STK push dispatch error: payment_id={payment_id}: {str(e)}")
+            _retry_or_fail(payment_id, str(e))
+            return False
+
+        if response.get("success"):
+            _record_sent(payment_id, response.get("checkout_request_id"))
+            return True
+
+        if response.get("retryable"):
+            logger.warning(f"STK push not sent, will retry: payment_id={payment_id}, error={response.get('error')}")
+            _retry_or_fail(payment_id, response.get("error", "STK push failed"))
+            return False
+
+        _fail(payment_id, response.get("error", "STK push failed"))
+        logger.error(f"STK push failed: payment_id={payment_id}, error={response.get('error')}")
+        return False
+    finally:
+        close_old_connections()
+
+
+def _record_sent(payment_id, checkout_request_id):
+    """
+    Store the CheckoutRequestID of an accepted push. verify_session then
+    settles the payment with query_transaction if no callback arrives. If the
+    row cannot be written the push is still never re-queued: the id goes into
+    push_error (or, failing that, the log) for reconciliation instead.
+    """
+    try:
+        with transaction.atomic():
+            Payment.objects.filter(pk=payment_id).update(
+                transaction_id=checkout_request_id,
+                push_status='sent',
+                push_error=''
+            )
+        logger.info(f"STK push sent: payment_id={payment_id}, checkout_request_id={checkout_request_id}")
+        return
+    except Exception as e:
+        logger.exception(f"Could not record STK push: payment_id={payment_id}, checkout_request_id={checkout_request_id}: {str(e)}")
+    try:
+        Payment.objects.filter(pk=payment_id).update(
+            push_status='sent',
+            push_error=f"Unrecorded CheckoutRequestID {checkout_request_id}"[:255]
+        )
+    except Exception:
+        logger.exception(f"STK push needs manual reconciliation: payment_id={payment_id}, checkout_request_id={checkout_request_id}")
+
+
+def _retry_or_fail(payment_id, error):
+    """Put a payment whose push was not sent back in the queue, unless it ran out of attempts"""
+    try:
+        requeued = Payment.objects.filter(
+            pk=payment_id,
+            push_status='sending',
+            push_attempts__lt=getattr(settings, 'MPESA_STK_MAX_ATTEMPTS', 3)
+        ).update(push_status='queued', push_error=str(error)[:255])
+        if not requeued:
+            _fail(payment_id, error)
+    except Exception as e:
+        # pending_push_ids re-queues it once it has been 'sending' for too long
+        logger.exception(f"Could not re-queue STK push: payment_id={payment_id}: {str(e)}")
+
+
+def _fail(payment_id, error):
+    try:
+        failed = Payment.objects.filter(pk=payment_id, push_status='sending').update(
+            push_status='failed',
+            push_error=str(error)[:255],
+            status='failed',
+            is_finished=True,
+            completed_at=timezone.now()
+        )
+    except Exception as e:
+        logger.exception(f"Could not mark STK push failed: payment_id={payment_id}: {str(e)}")
+        return
+    pending_payments.dec(failed)
+
+
+def pending_push_ids(limit=100, stale_after=120):
+    """
+    Return ids of payments waiting for an STK push. Payments stuck in
+    'sending' for longer than any push can take (the process died mid-push)
+    are put back in the queue first.
+    """
+    Payment.objects.filter(
+        push_status='sending',
+        push_started_at__lt=timezone.now() - timedelta(seconds=stale_after)
+    ).update(push_status='queued')
+
+    return list(
+        Payment.objects.filter(
+            push_status='queued',
+            push_attempts__lt=getattr(settings, 'MPESA_STK_MAX_ATTEMPTS', 3)
+        ).order_by('created_at').values_list('pk', flat=True)[:limit]
+    )
+
+
+class StkPushDispatcher:
+    """Thread pool that sends queued STK pushes off the request path"""
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix='stk-push'
+                    )
+        return self._executor
+
+    def enqueue(self, payment_id):
+        """Send the push once the Payment row is committed"""
+        transaction.on_commit(lambda: self.executor.submit(send_stk_push, payment_id))
+
+    def submit(self, payment_id):
+        return self.executor.submit(send_stk_push, payment_id)
+
+
+dispatcher = StkPushDispatcher(max_workers=getattr(settings, 'MPESA_STK_WORKERS', 8))
@@ -0,0 +1,189 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from afrinet.jsoncodec import loads
+from afrinet.metrics import callback_batch_seconds, callbacks_total, pending_payments
+from afrinet.models import HostspotUser, Payment, Session
+from afrinet.rollups import record_payment_completed
+from afrinet.usernames import username_allocator
+from .models import CallbackInbox
+from .utils import normalize_phone
+
+logger = logging.getLogger(__name__)
+
+
+def parse_stk_callback(body):
+    """Return the stkCallback object of a raw callback body, or None if malformed"""
+    try:
+        callback_data = loads(body)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(callback_data, dict):
+        return None
+    body = callback_data.get("Body") or {}
+    return body.get("stkCallback") or body.get("stk_callback")
+
+
+def apply_stk_callback(callback, payment):
+    """Complete or fail a payment from its STK callback and start the session."""
+    result_code = callback.get("ResultCode")
+
+    # Update payment status
+    payment.is_finished = True
+    payment.is_successful = result_code == 0
+    payment.status = "completed" if result_code == 0 else "failed"
+    payment.completed_at = timezone.now()
+
+    if result_code != 0 or "CallbackMetadata" not in callback:
+        payment.save()
+        return
+
+    # Handle successful payment
+    metadata = {item["Name"]: item.get("Value")
+                for item in callback["CallbackMetadata"]["Item"]}
+
+    payment.mpesa_receipt = metadata.get("MpesaReceiptNumber")
+    if metadata.get("PhoneNumber"):
+        payment.phone = normalize_phone(metadata["PhoneNumber"])
+    payment.save()
+    record_payment_completed(payment)
+
+    # Give the customer a D-prefixed username, keeping the one they already have
+    user = HostspotUser.objects.filter(phone=payment.phone).first() or HostspotUser(phone=payment.phone)
+    if not (user.username or '').startswith('D') or not user.username[1:].isdigit():
+        user.username = username_allocator.allocate()
+    user.package = payment.package
+    user.status = 'active'
+    user.save()
+
+    # Create session if doesn't exist
+    if not Session.objects.filter(payment=payment).exists():
+        Session.objects.create(
+            user=user,
+            phone=payment.phone,
+            package=payment.package,
+            payment=payment,
+            duration_minutes=payment.package.duration_minutes,
+            end_time=timezone.now() + timedelta(minutes=payment.package.duration_minutes),
+            voucher_code=payment.mpesa_receipt
+        )
+
+
+def process_inbox_batch(batch_size=100, statuses=('pending',)):
+    """
+    Process up to `batch_size` inbox rows in one transaction.
+
+    Rows are locked with SKIP LOCKED so several consumers can run side by
+    side. Payments for the whole batch are fetched in one query, and repeated
+    deliveries of the same CheckoutRequestID (in the batch or for an already
+    finished payment) are marked as duplicates. Returns the number of rows
+    handled.
+    """
+    start = time.perf_counter()
+    with transaction.atomic():
+        entries = list(
+            CallbackInbox.objects.select_for_update(skip_locked=True)
+            .filter(status__in=statuses)
+            .order_by('id')[:batch_size]
+        )
+        if not entries:
+            return 0
+
+        callbacks = {}
+        for entry in entries:
+            callback = parse_stk_callback(entry.body)
+            callbacks[entry.pk] = callback
+            if callback and callback.get("CheckoutRequestID"):
+                entry.checkout_request_id = callback["CheckoutRequestID"]
+
+        # Locked so a payment finished elsewhere meanwhile is seen as finished here
+        payments = Payment.objects.select_for_update(of=('self',)).select_related('package').in_bulk(
+            {entry.checkout_request_id for entry in entries if entry.checkout_request_id},
+            field_name='transaction_id'
+        )
+
+        seen = set()
+        settled = 0
+        now = timezone.now()
+        for entry in entries:
+            entry.processed_at = now
+            entry.error = ''
+            callback = callbacks[entry.pk]
+            payment = payments.get(entry.checkout_request_id)
+
+            if not callback or not entry.checkout_request_id:
+                entry.status, entry.error = 'ignored', 'Malformed callback'
+            elif payment is None:
+                entry.status, entry.error = 'ignored', 'Payment not found'
+            elif entry.checkout_request_id in seen or payment.is_finished:
+                entry.status = 'duplicate'
+            else:
+                seen.add(entry.checkout_request_id)
+                was_pending = payment.status == 'pending'
+                try:
+                    with transaction.atomic():
+                        apply_stk_callback(callback, payment)
+                    entry.status = 'processed'
+                    settled += was_pending
+                except Exception as e:
+                    logger.exception(f"Callback processing error: checkout_request_id={entry.checkout_request_id}")
+                    entry.status, entry.error = 'failed', str(e)[:255]
+
+        CallbackInbox.objects.bulk_update(
+            entries, ['checkout_request_id', 'status', 'error', 'processed_at']
+        )
+
+    callback_batch_seconds.observe(time.perf_counter() - start)
+    outcomes = {}
+    for entry in entries:
+        outcomes[entry.status] = outcomes.get(entry.status, 0) + 1
+    for status, count in outcomes.items():
+        callbacks_total.inc(count, status=status)
+    pending_payments.dec(settled)
+    logger.info(f"Processed {len(entries)} M-Pesa callbacks")
+    return len(entries)
+
+
+def drain_inbox(batch_size=100):
+    """Process pending callbacks until the inbox is empty"""
+    total = 0
+    while True:
+        handled = process_inbox_batch(batch_size)
+        total += handled
+        if handled < batch_size:
+            return total
+
+
+class InboxConsumer:
+    """Single background thread per process that drains the inbox after each callback"""
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        self._scheduled = False
+
+    def schedule(self):
+        with self._lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mpesa-inbox')
+        transaction.on_commit(lambda: self._executor.submit(self._run))
+
+    def _run(self):
+        with self._lock:
+            self._scheduled = False
+        close_old_connections()
+        try:
+            drain_inbox()
+        except Exception as e:
+            logger.exception(f"Callback inbox drain failed: {str(e)}")
+        finally:
+            close_old_connections()
+
+
+consumer = InboxConsumer()
@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_datetime
+from mpesa.inbox import process_inbox_batch
+from mpesa.models import CallbackInbox
+
+class Command(BaseCommand):
+    help = 'Processes stored M-Pesa callbacks from the inbox in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when the inbox is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the inbox once and exit')
+        parser.add_argument('--replay', action='store_true', help='Re-queue failed and ignored callbacks before processing')
+        parser.add_argument('--since', help='Only replay callbacks received after this ISO datetime')
+
+    def handle(self, *args, **options):
+        if options['replay']:
+            replay = CallbackInbox.objects.filter(status__in=['failed', 'ignored'])
+            if options['since']:
+                replay = replay.filter(received_at__gte=parse_datetime(options['since']))
+            requeued = replay.update(status='pending', processed_at=None)
+            self.stdout.write(f'Re-queued {requeued} callbacks')
+
+        while True:
+            handled = process_inbox_batch(options['batch_size'])
+            if handled:
+                self.stdout.write(f'Processed {handled} callbacks')
+            if handled < options['batch_size']:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,26 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from mpesa.dispatch import pending_push_ids, send_stk_push
+
+class Command(BaseCommand):
+    help = 'Sends STK pushes for payments queued by the asynchronous stk_push view'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'MPESA_STK_WORKERS', 8))
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=0.5, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+
+    def handle(self, *args, **options):
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='stk-push') as pool:
+            while True:
+                payment_ids = pending_push_ids(limit=options['batch_size'])
+                if payment_ids:
+                    sent = sum(1 for ok in pool.map(send_stk_push, payment_ids) if ok)
+                    self.stdout.write(f'Sent {sent}/{len(payment_ids)} STK pushes')
+                if options['once']:
+                    break
+                if not payment_ids:
+                    time.sleep(options['interval'])
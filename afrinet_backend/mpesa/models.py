@@ -1,3 +1,28 @@
 from django.db import models
 
-# Create your models here.
+
+class CallbackInbox(models.Model):
+    """Raw STK callbacks as received from Safaricom, processed later in batches"""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('duplicate', 'Duplicate'),
+        ('ignored', 'Ignored'),
+        ('failed', 'Failed'),
+    )
+
+    body = models.TextField()
+    checkout_request_id = models.CharField(max_length=100, blank=True, default='', db_index=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    error = models.CharField(max_length=255, blank=True, default='')
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = "Callback inbox"
+        indexes = [
+            models.Index(fields=['status', 'id'], name='mpesa_inbox_status_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.checkout_request_id or self.pk} - {self.status}"
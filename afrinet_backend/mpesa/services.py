@@ -1,29 +1,181 @@
 import base64
-import requests
+import os
+import threading
+import time
 from datetime import datetime
 from django.conf import settings
+from django.core.cache import cache
 import logging
 from requests.exceptions import RequestException
-import base64
+from afrinet.metrics import stk_push_seconds
+from .client import RETRY_STATUSES, get_client
 
 logger = logging.getLogger(__name__)
 
+
+class AccessTokenManager:
+    """
+    Keeps the Daraja OAuth token cached until shortly before it expires.
+
+    The token lives in process memory and in the shared Django cache so all
+    workers reuse it. Refreshes are serialized by a thread lock inside the
+    process and by a cache lock across processes; once the token enters the
+    early-refresh window it is renewed in a background thread while callers
+    keep using the current one.
+    """
+    CACHE_KEY = 'mpesa:access_token'
+    LOCK_KEY = 'mpesa:access_token:lock'
+
+    def __init__(self, fetch_token, expiry_margin=60, early_refresh=300, lock_timeout=15):
+        self._fetch_token = fetch_token  # callable returning (token, expires_in)
+        self.expiry_margin = expiry_margin
+        self.early_refresh = early_refresh
+        self.lock_timeout = lock_timeout
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0
+        self._background_refresh = False
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.background_refreshes = 0
+        self.failures = 0
+
+    def get_token(self):
+        """Return a valid token, fetching one only when nothing usable is cached"""
+        now = time.time()
+        token, expires_at = self._token, self._expires_at
+        if not token or now >= expires_at - self.expiry_margin:
+            token, expires_at = self._load_shared()
+            if token and now < expires_at - self.expiry_margin:
+                self._token, self._expires_at = token, expires_at
+
+        if token and now < expires_at - self.expiry_margin:
+            self.hits += 1
+            if now >= expires_at - self.early_refresh:
+                self._schedule_background_refresh()
+            return token
+
+        self.misses += 1
+        return self.refresh()
+
+    def refresh(self, force=False):
+        """Fetch a new token; only one refresh runs at a time per process and cache"""
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            if not force:
+                if self._token and time.time() < self._expires_at - self.early_refresh:
+                    return self._token
+                token, expires_at = self._load_shared()
+                if token and time.time() < expires_at - self.early_refresh:
+                    self._token, self._expires_at = token, expires_at
+                    return token
+
+            lock_value = f"{os.getpid()}:{threading.get_ident()}"
+            if not cache.add(self.LOCK_KEY, lock_value, self.lock_timeout):
+                token = self._wait_for_shared()
+                if token:
+                    return token
+
+            try:
+                token, expires_in = self._fetch_token()
+                self.refreshes += 1
+            except Exception:
+                self.failures += 1
+                raise
+            finally:
+                if cache.get(self.LOCK_KEY) == lock_value:
+                    cache.delete(self.LOCK_KEY)
+
+            expires_at = time.time() + int(expires_in)
+            self._token, self._expires_at = token, expires_at
+            cache.set(
+                self.CACHE_KEY,
+                {'token': token, 'expires_at': expires_at},
+                max(int(expires_in) - self.expiry_margin, 1)
+            )
+            return token
+
+    def invalidate(self):
+        """Drop the cached token, e.g. after Daraja rejects it"""
+        with self._lock:
+            self._token, self._expires_at = None, 0
+        cache.delete(self.CACHE_KEY)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'background_refreshes': self.background_refreshes,
+            'failures': self.failures,
+            'expires_in': max(int(self._expires_at - time.time()), 0) if self._token else 0,
+        }
+
+    def _load_shared(self):
+        cached = cache.get(self.CACHE_KEY)
+        if not cached:
+            return None, 0
+        return cached['token'], cached['expires_at']
+
+    def _wait_for_shared(self):
+        """Wait for the worker holding the cache lock to publish its token"""
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            token, expires_at = self._load_shared()
+            if token and time.time() < expires_at - self.expiry_margin:
+                self._token, self._expires_at = token, expires_at
+                return token
+            if not cache.get(self.LOCK_KEY):
+                break
+            time.sleep(0.05)
+        return None
+
+    def _schedule_background_refresh(self):
+        if self._background_refresh:
+            return
+        self._background_refresh = True
+
+        def run():
+            try:
+                self.refresh()
+                self.background_refreshes += 1
+            except Exception as e:
+                logger.error(f"Background token refresh failed: {str(e)}")
+            finally:
+                self._background_refresh = False
+
+        threading.Thread(target=run, name='mpesa-token-refresh', daemon=True).start()
+
+
+def _request_access_token():
+    """Call the Daraja OAuth endpoint and return (token, expires_in)"""
+    auth_url = f"{settings.MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
+    response = get_client().get(
+        auth_url,
+        auth=(settings.MPESA_CONSUMER_KEY, settings.MPESA_CONSUMER_SECRET)
+    )
+    response.raise_for_status()
+    data = response.json()
+    token = data.get('access_token')
+    if not token:
+        raise ValueError("Empty access token received")
+    return token, int(data.get('expires_in') or 3599)
+
+
+token_manager = AccessTokenManager(
+    _request_access_token,
+    expiry_margin=getattr(settings, 'MPESA_TOKEN_EXPIRY_MARGIN', 60),
+    early_refresh=getattr(settings, 'MPESA_TOKEN_EARLY_REFRESH', 300),
+)
+
+
 class MpesaService:
     @staticmethod
     def get_access_token():
-        """Retrieve M-Pesa API access token with enhanced error handling"""
+        """Retrieve M-Pesa API access token, reusing the cached one when still valid"""
         try:
-            auth_url = f"{settings.MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
-            response = requests.get(
-                auth_url,
-                auth=(settings.MPESA_CONSUMER_KEY, settings.MPESA_CONSUMER_SECRET),
-                timeout=10
-            )
-            response.raise_for_status()
-            token = response.json().get('access_token')
-            if not token:
-                raise ValueError("Empty access token received")
-            return token
+            return token_manager.get_token()
         except RequestException as e:
             logger.error(f"Auth request failed: {str(e)}")
             return None
@@ -31,6 +183,11 @@ class MpesaService:
             logger.error(f"Auth processing error: {str(e)}")
             return None
 
+    @staticmethod
+    def token_stats():
+        """Hit/miss/refresh counters of the access token cache"""
+        return token_manager.stats()
+
     @staticmethod
     def generate_timestamp():
         """Generate current timestamp in M-Pesa format"""
@@ -53,9 +210,18 @@ class MpesaService:
             'checkout_request_id': str,
             'merchant_request_id': str,
             'message': str,
-            'error': str (if failed)
+            'error': str (if failed),
+            'retryable': bool (if failed; True when Daraja was unreachable or
+                               briefly unavailable, so no prompt was sent)
         }
         """
+        with stk_push_seconds.time() as outcome:
+            response = MpesaService._send_stk_push(phone_number, amount, account_reference, transaction_desc)
+            outcome['result'] = 'success' if response.get('success') else 'failed'
+            return response
+
+    @staticmethod
+    def _send_stk_push(phone_number, amount, account_reference, transaction_desc):
         try:
             # Validate inputs
             if not all([phone_number, amount, account_reference]):
@@ -66,7 +232,8 @@ class MpesaService:
             if not access_token:
                 return {
                     'success': False,
-                    'error': 'Failed to authenticate with M-Pesa'
+                    'error': 'Failed to authenticate with M-Pesa',
+                    'retryable': True
                 }
 
             # Prepare payload
@@ -90,12 +257,20 @@ class MpesaService:
             }
 
             # Make the request
-            response = requests.post(
+            response = get_client().post(
                 f"{settings.MPESA_BASE_URL}/mpesa/stkpush/v1/processrequest",
                 json=payload,
-                headers=headers,
-                timeout=15
+                headers=headers
             )
+            if response.status_code == 401:
+                # Token was revoked early; make the next call fetch a new one
+                token_manager.invalidate()
+            if response.status_code == 401 or response.status_code in RETRY_STATUSES:
+                return {
+                    'success': False,
+                    'error': f"M-Pesa returned HTTP {response.status_code}",
+                    'retryable': True
+                }
             response_data = response.json()
 
             # Parse response
@@ -110,15 +285,78 @@ class MpesaService:
                 return {
                     'success': False,
                     'error': response_data.get('CustomerMessage', 'STK push failed'),
-                    'response': response_data
+                    'response': response_data,
+                    'retryable': False
                 }
 
         except ValueError as e:
+            # Also an unreadable response body, after which the push may have gone out
             logger.error(f"Validation error: {str(e)}")
-            return {'success': False, 'error': str(e)}
+            return {'success': False, 'error': str(e), 'retryable': False}
+        except RequestException as e:
+            logger.error(f"Network error: {str(e)}")
+            return {'success': False, 'error': f"Network error: {str(e)}", 'retryable': True}
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            return {'success': False, 'error': 'Internal server error', 'retryable': False}
+
+    @staticmethod
+    def query_transaction(checkout_request_id):
+        """
+        Query the status of an STK push. The query has no side effects, so it
+        is sent as idempotent and retried on transient failures.
+        Returns: {
+            'success': bool,
+            'ResultCode': int (None while M-Pesa is still processing),
+            'ResultDesc': str,
+            'response': dict
+        }
+        """
+        try:
+            access_token = MpesaService.get_access_token()
+            if not access_token:
+                return {'success': False, 'ResultCode': None, 'error': 'Failed to authenticate with M-Pesa'}
+
+            timestamp = MpesaService.generate_timestamp()
+            payload = {
+                "BusinessShortCode": settings.MPESA_SHORTCODE,
+                "Password": base64.b64encode(
+                    f"{settings.MPESA_SHORTCODE}{settings.MPESA_PASSKEY}{timestamp}".encode()
+                ).decode(),
+                "Timestamp": timestamp,
+                "CheckoutRequestID": checkout_request_id
+            }
+            headers = {
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": "application/json"
+            }
+            response = get_client().post(
+                f"{settings.MPESA_BASE_URL}/mpesa/stkpushquery/v1/query",
+                json=payload,
+                headers=headers,
+                idempotent=True
+            )
+            if response.status_code == 401:
+                token_manager.invalidate()
+            response_data = response.json()
+
+            # While the customer has not answered, Daraja replies with an errorCode and no ResultCode
+            result_code = response_data.get('ResultCode')
+            return {
+                'success': response_data.get('ResponseCode') == '0',
+                'ResultCode': int(result_code) if result_code is not None else None,
+                'ResultDesc': response_data.get('ResultDesc') or response_data.get('errorMessage'),
+                'response': response_data
+            }
+
         except RequestException as e:
             logger.error(f"Network error: {str(e)}")
-            return {'success': False, 'error': f"Network error: {str(e)}"}
+            return {'success': False, 'ResultCode': None, 'error': f"Network error: {str(e)}"}
         except Exception as e:
             logger.error(f"Unexpected error: {str(e)}")
-            return {'success': False, 'error': 'Internal server error'}
\ No newline at end of file
+            return {'success': False, 'ResultCode': None, 'error': 'Internal server error'}
+
+    @staticmethod
+    def http_stats():
+        """Request, retry and connection reuse counters of the shared Daraja client"""
+        return get_client().stats()
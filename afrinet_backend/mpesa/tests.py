@@ -1,3 +1,361 @@
-from django.test import TestCase
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from requests.exceptions import ConnectionError
+from afrinet.models import Package, Payment, Session
+from afrinet.package_cache import package_catalogue
+from .client import DarajaClient, RetryBudget
+from .dispatch import send_stk_push
+from .inbox import process_inbox_batch
+from .models import CallbackInbox
+from .services import AccessTokenManager, MpesaService
 
-# Create your tests here.
+
+def make_package(package_id='p1', price=50):
+    return Package.objects.create(
+        package_id=package_id, package_name=f'Package {package_id}', price=price,
+        duration_value=1, duration_unit='hour', speed='5M'
+    )
+
+
+def make_queued_payment(key='1', **kwargs):
+    return Payment.objects.create(
+        phone='254700000001', amount=50, package=make_package(f'p{key}'), transaction_id=f'PENDING-{key}',
+        status='pending', push_status='queued', **kwargs
+    )
+
+
+@mock.patch('mpesa.dispatch.close_old_connections')
+@override_settings(MPESA_STK_MAX_ATTEMPTS=3)
+class SendStkPushTests(TestCase):
+    def send(self, payment, response=None, side_effect=None):
+        with mock.patch('mpesa.dispatch.MpesaService.initiate_stk_push', return_value=response, side_effect=side_effect) as push:
+            result = send_stk_push(payment.pk)
+        payment.refresh_from_db()
+        return result, push
+
+    def test_accepted_push_records_the_checkout_request_id(self, _):
+        payment = make_queued_payment()
+        result, _ = self.send(payment, {'success': True, 'checkout_request_id': 'ws_CO_1'})
+        self.assertTrue(result)
+        self.assertEqual((payment.push_status, payment.transaction_id, payment.push_attempts), ('sent', 'ws_CO_1', 1))
+
+    def test_network_error_is_retried(self, _):
+        payment = make_queued_payment()
+        result, _ = self.send(payment, {'success': False, 'retryable': True, 'error': 'Network error: reset'})
+        self.assertFalse(result)
+        self.assertEqual((payment.push_status, payment.status, payment.is_finished), ('queued', 'pending', False))
+        self.assertEqual(payment.push_error, 'Network error: reset')
+
+    def test_retries_stop_after_the_last_attempt(self, _):
+        payment = make_queued_payment(push_attempts=2)
+        self.send(payment, {'success': False, 'retryable': True, 'error': 'Network error: reset'})
+        self.assertEqual((payment.push_status, payment.status, payment.is_finished), ('failed', 'failed', True))
+
+    def test_rejected_push_fails_without_retry(self, _):
+        payment = make_queued_payment()
+        self.send(payment, {'success': False, 'retryable': False, 'error': 'Invalid PhoneNumber'})
+        self.assertEqual((payment.push_status, payment.status, payment.push_attempts), ('failed', 'failed', 1))
+
+    def test_error_before_sending_is_retried(self, _):
+        payment = make_queued_payment()
+        with mock.patch('mpesa.dispatch.Payment.objects.select_related', side_effect=RuntimeError('db hiccup')):
+            self.assertFalse(send_stk_push(payment.pk))
+        payment.refresh_from_db()
+        self.assertEqual(payment.push_status, 'queued')
+
+    def test_accepted_push_is_never_requeued(self, _):
+        payment = make_queued_payment()
+        # The CheckoutRequestID cannot be stored (here: it clashes with another payment)
+        Payment.objects.create(phone='254700000002', amount=50, transaction_id='ws_CO_1', status='pending')
+        result, _ = self.send(payment, {'success': True, 'checkout_request_id': 'ws_CO_1'})
+        self.assertTrue(result)
+        self.assertEqual(payment.push_status, 'sent')
+        self.assertIn('ws_CO_1', payment.push_error)
+
+
+@override_settings(MPESA_BASE_URL='https://daraja.test', MPESA_SHORTCODE='174379', MPESA_PASSKEY='key', MPESA_CALLBACK_URL='https://cb.test/')
+class StkPushRetryableTests(TestCase):
+    def push(self, **post):
+        client = mock.Mock(**{'post.' + key: value for key, value in post.items()})
+        with mock.patch('mpesa.services.token_manager.get_token', return_value='token'), \
+                mock.patch('mpesa.services.get_client', return_value=client):
+            return MpesaService.initiate_stk_push('254700000001', 50, 'AFRNETp1', 'AfriNet p1 Package')
+
+    def test_network_error_is_retryable(self):
+        response = self.push(side_effect=ConnectionError('connection reset'))
+        self.assertEqual((response['success'], response['retryable']), (False, True))
+
+    def test_unavailable_is_retryable(self):
+        response = self.push(return_value=mock.Mock(status_code=503))
+        self.assertEqual((response['success'], response['retryable']), (False, True))
+
+    def test_rejection_is_final(self):
+        answer = mock.Mock(status_code=400, **{'json.return_value': {'ResponseCode': '1', 'CustomerMessage': 'Invalid PhoneNumber'}})
+        response = self.push(return_value=answer)
+        self.assertEqual((response['success'], response['retryable']), (False, False))
+
+
+class AccessTokenManagerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.fetches = []
+
+    def manager(self, expires_in=3600, delay=0, **kwargs):
+        def fetch():
+            time.sleep(delay)
+            self.fetches.append(time.time())
+            return f'token-{len(self.fetches)}', expires_in
+        return AccessTokenManager(fetch, **kwargs)
+
+    def wait_for(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_cached_token_is_reused_across_workers(self):
+        first = self.manager()
+        self.assertEqual(first.get_token(), 'token-1')
+        self.assertEqual(first.get_token(), 'token-1')
+        # Another worker finds the token in the shared cache
+        self.assertEqual(self.manager().get_token(), 'token-1')
+        self.assertEqual(len(self.fetches), 1)
+        self.assertEqual((first.stats()['hits'], first.stats()['misses']), (1, 1))
+
+    def test_concurrent_callers_share_one_refresh(self):
+        manager = self.manager(delay=0.2)
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(manager.get_token())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(tokens, ['token-1'] * 8)
+        self.assertEqual(len(self.fetches), 1)
+
+    def test_waits_for_the_worker_holding_the_cache_lock(self):
+        manager = self.manager()
+        cache.add(AccessTokenManager.LOCK_KEY, 'other-worker')
+
+        def publish():
+            time.sleep(0.1)
+            cache.set(AccessTokenManager.CACHE_KEY, {'token': 'shared', 'expires_at': time.time() + 3600})
+            cache.delete(AccessTokenManager.LOCK_KEY)
+
+        threading.Thread(target=publish).start()
+        self.assertEqual(manager.get_token(), 'shared')
+        self.assertEqual(self.fetches, [])
+
+    def test_token_near_expiry_is_renewed_in_the_background(self):
+        manager = self.manager(expires_in=200, expiry_margin=60, early_refresh=300)
+        self.assertEqual(manager.get_token(), 'token-1')
+        # Still usable, so the caller gets it while a new one is fetched
+        self.assertEqual(manager.get_token(), 'token-1')
+        self.wait_for(lambda: manager.background_refreshes)
+        self.assertEqual(manager.background_refreshes, 1)
+        # Read the cache directly; another get_token would start a refresh of token-2
+        self.assertEqual(cache.get(AccessTokenManager.CACHE_KEY)['token'], 'token-2')
+
+    def test_rejected_token_is_dropped(self):
+        manager = self.manager()
+        client = mock.Mock(**{'post.return_value': mock.Mock(status_code=401)})
+        with mock.patch('mpesa.services.token_manager', manager), mock.patch('mpesa.services.get_client', return_value=client):
+            response = MpesaService.initiate_stk_push('254700000001', 50, 'AFRNETp1', 'AfriNet p1 Package')
+            self.assertEqual((response['success'], response['retryable']), (False, True))
+            self.assertIsNone(cache.get(AccessTokenManager.CACHE_KEY))
+            self.assertEqual(manager.get_token(), 'token-2')
+
+
+class DarajaClientTests(SimpleTestCase):
+    def client_with(self, responses, **kwargs):
+        client = DarajaClient(backoff_factor=0, **kwargs)
+        client.session.request = mock.Mock(side_effect=responses)
+        return client
+
+    def test_post_is_never_retried(self):
+        client = self.client_with([ConnectionError('reset')])
+        with self.assertRaises(ConnectionError):
+            client.post('https://daraja.invalid/stkpush', json={})
+        self.assertEqual(client.session.request.call_count, 1)
+        client = self.client_with([mock.Mock(status_code=503)])
+        self.assertEqual(client.post('https://daraja.invalid/stkpush', json={}).status_code, 503)
+        self.assertEqual(client.session.request.call_count, 1)
+
+    def test_get_is_retried(self):
+        client = self.client_with([ConnectionError('reset'), mock.Mock(status_code=503), mock.Mock(status_code=200)])
+        self.assertEqual(client.get('https://daraja.invalid/oauth').status_code, 200)
+        self.assertEqual(client.session.request.call_count, 3)
+        self.assertEqual(client.stats()['retries'], 2)
+
+    def test_retries_stop_when_the_budget_is_spent(self):
+        client = self.client_with(
+            [ConnectionError('reset')] * 3,
+            retry_budget=RetryBudget(ratio=0, min_tokens=1)
+        )
+        with self.assertRaises(ConnectionError):
+            client.get('https://daraja.invalid/oauth')
+        self.assertEqual(client.session.request.call_count, 2)
+        self.assertEqual((client.stats()['retries'], client.stats()['retries_denied']), (1, 1))
+
+    def test_connections_are_reused(self):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        client = DarajaClient()
+        client.session.trust_env = False
+        for _ in range(3):
+            self.assertEqual(client.get(f'http://127.0.0.1:{server.server_port}/').status_code, 200)
+        stats = client.stats()
+        self.assertEqual((stats['requests'], stats['new_connections'], stats['reused_connections']), (3, 1, 2))
+
+
+def callback_body(checkout_id, result_code=0):
+    callback = {'CheckoutRequestID': checkout_id, 'ResultCode': result_code}
+    if result_code == 0:
+        callback['CallbackMetadata'] = {'Item': [
+            {'Name': 'MpesaReceiptNumber', 'Value': f'R{checkout_id}'},
+            {'Name': 'PhoneNumber', 'Value': 254700000001},
+        ]}
+    return json.dumps({'Body': {'stkCallback': callback}})
+
+
+class InboxBatchTests(TestCase):
+    def setUp(self):
+        self.payment = Payment.objects.create(
+            phone='254700000001', amount=50, package=make_package(), transaction_id='ws_CO_1', status='pending'
+        )
+
+    def receive(self, *bodies):
+        return [CallbackInbox.objects.create(body=body) for body in bodies]
+
+    def statuses(self, entries):
+        return [CallbackInbox.objects.get(pk=entry.pk).status for entry in entries]
+
+    def test_repeated_callbacks_are_applied_once(self):
+        entries = self.receive(callback_body('ws_CO_1'), callback_body('ws_CO_1'))
+        process_inbox_batch()
+        later = self.receive(callback_body('ws_CO_1'))
+        process_inbox_batch()
+
+        self.assertEqual(self.statuses(entries + later), ['processed', 'duplicate', 'duplicate'])
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.mpesa_receipt), ('completed', 'Rws_CO_1'))
+        self.assertEqual(Session.objects.filter(payment=self.payment).count(), 1)
+
+    def test_unknown_and_malformed_callbacks_are_ignored(self):
+        entries = self.receive(callback_body('ws_CO_unknown'), 'not json')
+        process_inbox_batch()
+        self.assertEqual(self.statuses(entries), ['ignored', 'ignored'])
+        self.assertEqual(
+            [CallbackInbox.objects.get(pk=entry.pk).error for entry in entries],
+            ['Payment not found', 'Malformed callback']
+        )
+
+    def test_replay_processes_ignored_callbacks(self):
+        entry, = self.receive(callback_body('ws_CO_2', result_code=1032))
+        process_inbox_batch()
+        self.assertEqual(self.statuses([entry]), ['ignored'])
+
+        # The payment shows up after its callback, e.g. restored from a backup
+        payment = Payment.objects.create(
+            phone='254700000001', amount=50, package=self.payment.package, transaction_id='ws_CO_2', status='pending'
+        )
+        call_command('process_callbacks', '--replay', '--once', stdout=mock.Mock())
+        self.assertEqual(self.statuses([entry]), ['processed'])
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'failed')
+
+    def test_pending_gauge_drops_only_for_settled_pending_payments(self):
+        Payment.objects.create(
+            phone='254700000001', amount=50, package=self.payment.package, transaction_id='ws_CO_3', status='failed'
+        )
+        self.receive(
+            callback_body('ws_CO_1'), callback_body('ws_CO_1'), callback_body('ws_CO_3', result_code=1), callback_body('ws_CO_unknown')
+        )
+        with mock.patch('mpesa.inbox.pending_payments') as pending:
+            process_inbox_batch()
+        pending.dec.assert_called_once_with(1)
+
+
+@override_settings(MPESA_STK_DISPATCH='thread')
+class AsyncStkPushTests(TestCase):
+    def setUp(self):
+        self.package = make_package()
+        package_catalogue.invalidate()
+
+    def request_push(self, key):
+        return self.client.post(
+            reverse('stk_push'),
+            data=json.dumps({'phone': '0700000001', 'amount': 50, 'package_id': 'p1', 'async': True, 'idempotency_key': str(key)}),
+            content_type='application/json'
+        )
+
+    def status(self, key):
+        return self.client.get(reverse('stk_status', args=[key])).json()
+
+    def test_repeated_key_returns_the_same_payment_without_a_second_push(self):
+        key = uuid.uuid4()
+        with mock.patch('mpesa.views.dispatcher.enqueue') as enqueue:
+            first = self.request_push(key)
+            second = self.request_push(key)
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        self.assertEqual(first.json()['idempotency_key'], second.json()['idempotency_key'])
+        payment = Payment.objects.get(idempotency_key=key)
+        enqueue.assert_called_once_with(payment.pk)
+
+    @mock.patch('mpesa.dispatch.close_old_connections')
+    def test_claimed_payment_is_not_sent_twice(self, _):
+        payment = make_queued_payment('2', idempotency_key=uuid.uuid4())
+        nested = []
+
+        def push(**kwargs):
+            # Another sender picks up the same payment while this push is in flight
+            nested.append(send_stk_push(payment.pk))
+            return {'success': True, 'checkout_request_id': 'ws_CO_1'}
+
+        with mock.patch('mpesa.dispatch.MpesaService.initiate_stk_push', side_effect=push) as initiate:
+            self.assertTrue(send_stk_push(payment.pk))
+            self.assertFalse(send_stk_push(payment.pk))
+        self.assertEqual(nested, [False])
+        self.assertEqual(initiate.call_count, 1)
+
+    def test_status_reports_each_push_state(self):
+        key = uuid.uuid4()
+        payment = make_queued_payment('2', idempotency_key=key)
+        self.assertEqual(
+            (self.status(key)['push_status'], self.status(key)['checkout_request_id']), ('queued', None)
+        )
+
+        Payment.objects.filter(pk=payment.pk).update(push_status='sending')
+        self.assertEqual(self.status(key)['push_status'], 'sending')
+
+        Payment.objects.filter(pk=payment.pk).update(push_status='sent', transaction_id='ws_CO_1')
+        status = self.status(key)
+        self.assertEqual((status['push_status'], status['payment_status'], status['checkout_request_id']), ('sent', 'pending', 'ws_CO_1'))
+
+        Payment.objects.filter(pk=payment.pk).update(push_status='failed', status='failed', push_error='Invalid PhoneNumber')
+        status = self.status(key)
+        self.assertEqual((status['push_status'], status['payment_status'], status['error']), ('failed', 'failed', 'Invalid PhoneNumber'))
+
+        self.assertEqual(self.client.get(reverse('stk_status', args=[uuid.uuid4()])).status_code, 404)
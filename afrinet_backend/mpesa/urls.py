@@ -3,6 +3,7 @@ from . import views
 
 urlpatterns = [
     path('stk-push/', views.stk_push, name='stk_push'),
+    path('stk-status/<uuid:idempotency_key>/', views.stk_status, name='stk_status'),
     path('callback/', views.callback, name='callback'),
     path('verify-session/', views.verify_session, name='verification'),
     path('register-url/', views.register_url, name='register_url'),
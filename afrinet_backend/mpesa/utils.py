@@ -0,0 +1,15 @@
+def normalize_phone(phone):
+    """Safely normalize phone number to 254xxxxxxxxx format."""
+    if not phone:
+        raise ValueError("Phone number cannot be empty")
+    
+    phone = str(phone).strip()
+    if phone.startswith("07"):
+        return "254" + phone[1:]
+    elif phone.startswith("+"):
+        return phone[1:]
+    elif phone.startswith("254"):
+        return phone
+    elif phone.startswith("0"):
+        return "254" + phone[1:]
+    return "254" + phone
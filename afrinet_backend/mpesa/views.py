@@ -2,15 +2,24 @@ import json
 import uuid
 import os
 import logging
-from django.http import JsonResponse, HttpResponse
+from django.conf import settings
+from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 from django.db import DatabaseError
 from datetime import timedelta
-import requests
 from dotenv import load_dotenv
-from afrinet.models import Payment, HostspotUser, Session, Package
+from afrinet.jsoncodec import JsonResponse, loads
+from afrinet.metrics import pending_payments, verify_fallback_seconds
+from afrinet.models import Payment, HostspotUser, Session
+from afrinet.package_cache import package_catalogue
+from afrinet.rollups import record_payment_completed
+from .client import get_client
+from .dispatch import dispatcher
+from .inbox import consumer
+from .models import CallbackInbox
 from .services import MpesaService
+from .utils import normalize_phone
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -18,22 +27,6 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-def normalize_phone(phone):
-    """Safely normalize phone number to 254xxxxxxxxx format."""
-    if not phone:
-        raise ValueError("Phone number cannot be empty")
-    
-    phone = str(phone).strip()
-    if phone.startswith("07"):
-        return "254" + phone[1:]
-    elif phone.startswith("+"):
-        return phone[1:]
-    elif phone.startswith("254"):
-        return phone
-    elif phone.startswith("0"):
-        return "254" + phone[1:]
-    return "254" + phone
-
 @csrf_exempt
 def stk_push(request):
     """Initiate M-Pesa STK Push payment."""
@@ -42,7 +35,7 @@ def stk_push(request):
         return JsonResponse({"success": False, "message": "Method not allowed"}, status=405)
 
     try:
-        data = json.loads(request.body)
+        data = loads(request.body)
         logger.info(f"STK push request received: {data}")
         
         # Standardized phone handling - accepts both but prefers 'phone'
@@ -74,9 +67,9 @@ def stk_push(request):
         # Find package
         package = None
         if package_id:
-            package = Package.objects.filter(package_id=package_id).first()
+            package = package_catalogue.by_package_id(package_id)
         if not package:
-            package = Package.objects.filter(price=amount).first()
+            package = package_catalogue.by_price(amount)
 
         if not package:
             return JsonResponse({"success": False, "message": "No matching package found"}, status=400)
@@ -86,6 +79,37 @@ def stk_push(request):
             user.package = package
             user.save()
 
+        # Async mode: record the payment now and let the dispatcher send the push
+        if data.get("async", settings.MPESA_ASYNC_STK_PUSH):
+            try:
+                idempotency_key = uuid.UUID(str(data.get("idempotency_key") or uuid.uuid4()))
+            except ValueError:
+                return JsonResponse({"success": False, "message": "Invalid idempotency key"}, status=400)
+
+            payment, created = Payment.objects.get_or_create(
+                idempotency_key=idempotency_key,
+                defaults={
+                    'user': user,
+                    'phone': phone,
+                    'amount': amount,
+                    'package': package,
+                    'transaction_id': f"PENDING-{idempotency_key}",
+                    'status': "pending",
+                    'push_status': "queued"
+                }
+            )
+            if created and settings.MPESA_STK_DISPATCH == "thread":
+                dispatcher.enqueue(payment.pk)
+
+            return JsonResponse({
+                "success": True,
+                "queued": True,
+                "idempotency_key": str(idempotency_key),
+                "push_status": payment.push_status,
+                "checkout_request_id": payment.transaction_id if payment.push_status == "sent" else None,
+                "message": "Payment queued"
+            }, status=202)
+
         # Initiate STK Push - using service's expected parameter name
         response = MpesaService.initiate_stk_push(
             phone_number=phone,  # Service expects phone_number
@@ -117,85 +141,41 @@ def stk_push(request):
         logger.exception(f"STK push error: {str(e)}")
         return JsonResponse({"success": False, "message": "Internal server error"}, status=500)
 
+def stk_status(request, idempotency_key):
+    """Report the state of an asynchronously queued STK push."""
+    if request.method != "GET":
+        return JsonResponse({"success": False, "message": "Method not allowed"}, status=405)
+
+    payment = Payment.objects.filter(idempotency_key=idempotency_key).values(
+        "push_status", "push_error", "status", "transaction_id"
+    ).first()
+    if not payment:
+        return JsonResponse({"success": False, "message": "Payment not found"}, status=404)
+
+    return JsonResponse({
+        "success": True,
+        "push_status": payment["push_status"],
+        "payment_status": payment["status"],
+        "checkout_request_id": payment["transaction_id"] if payment["push_status"] == "sent" else None,
+        "error": payment["push_error"] or None
+    })
+
 @csrf_exempt
 def callback(request):
-    """Handle M-Pesa STK Push callback."""
+    """Store the raw M-Pesa STK callback; it is processed from the inbox in batches."""
     if request.method != "POST":
         return HttpResponse(status=405)
 
     try:
-        callback_data = json.loads(request.body)
-        logger.info(f"Callback received: {callback_data}")
-
-        # Extract callback data
-        callback = (callback_data.get("Body", {}).get("stkCallback") or 
-                   callback_data.get("Body", {}).get("stk_callback"))
-        
-        if not callback:
-            return HttpResponse(status=400)
-
-        result_code = callback.get("ResultCode")
-        transaction_id = callback.get("CheckoutRequestID")
-
-        if not transaction_id:
-            return HttpResponse(status=400)
-
-        # Process payment
-        try:
-            payment = Payment.objects.get(transaction_id=transaction_id)
-        except Payment.DoesNotExist:
-            return HttpResponse(status=404)
-
-        if payment.is_finished:
-            return HttpResponse(status=200)
-
-        # Update payment status
-        payment.is_finished = True
-        payment.is_successful = result_code == 0
-        payment.status = "completed" if result_code == 0 else "failed"
-        payment.completed_at = timezone.now()
-
-        # Handle successful payment
-        if result_code == 0 and "CallbackMetadata" in callback:
-            metadata = {item["Name"]: item["Value"] 
-                       for item in callback["CallbackMetadata"]["Item"]}
-            
-            payment.mpesa_receipt = metadata.get("MpesaReceiptNumber")
-            if metadata.get("PhoneNumber"):
-                payment.phone = normalize_phone(metadata["PhoneNumber"])
-            payment.save()
-
-            # Create user with D-prefixed username
-            last_d_user = HostspotUser.objects.filter(username__startswith='D').order_by('-username').first()
-            new_number = int(last_d_user.username[1:]) + 1 if last_d_user else 1
-            
-            user, _ = HostspotUser.objects.update_or_create(
-                phone=payment.phone,
-                defaults={
-                    'username': f"D{new_number}",
-                    'package': payment.package,
-                    'status': 'active'
-                }
-            )
-
-            # Create session if doesn't exist
-            if not Session.objects.filter(payment=payment).exists():
-                Session.objects.create(
-                    user=user,
-                    phone=payment.phone,
-                    package=payment.package,
-                    payment=payment,
-                    duration_minutes=payment.package.duration_minutes,
-                    end_time=timezone.now() + timedelta(minutes=payment.package.duration_minutes),
-                    voucher_code=payment.mpesa_receipt
-                )
-
-        return HttpResponse(status=200)
-
-    except Exception as e:
-        logger.exception(f"Callback error: {str(e)}")
+        CallbackInbox.objects.create(body=request.body.decode("utf-8", errors="replace"))
+    except DatabaseError as e:
+        logger.exception(f"Callback inbox write failed: {str(e)}")
         return HttpResponse(status=500)
 
+    if settings.MPESA_CALLBACK_PROCESSING == "thread":
+        consumer.schedule()
+    return HttpResponse(status=200)
+
 @csrf_exempt
 def verify_session(request):
     """Verify payment and return or create session, with fallback query."""
@@ -204,7 +184,7 @@ def verify_session(request):
         return JsonResponse({"success": False, "message": "POST method required"}, status=405)
 
     try:
-        data = json.loads(request.body)
+        data = loads(request.body)
         logger.info(f"verify_session request: {json.dumps(data, indent=2)}")
         checkout_id = data.get("transaction_id")
         phone = normalize_phone(data.get("phone"))
@@ -227,7 +207,12 @@ def verify_session(request):
         if payment.status == "pending" and not payment.is_finished and (timezone.now() - payment.created_at).total_seconds() > 30:
             logger.info(f"Payment pending for >30s, querying M-Pesa: transaction_id={checkout_id}")
             try:
-                query_response = MpesaService.query_transaction(checkout_id)
+                with verify_fallback_seconds.time() as outcome:
+                    query_response = MpesaService.query_transaction(checkout_id)
+                    if query_response.get("success") and query_response.get("ResultCode") == 0:
+                        outcome['result'] = 'completed'
+                    else:
+                        outcome['result'] = 'pending' if query_response.get("ResultCode") is None else 'failed'
                 logger.info(f"M-Pesa query response: {json.dumps(query_response, indent=2)}")
                 if query_response.get("success") and query_response.get("ResultCode") == 0:
                     payment.status = "completed"
@@ -237,13 +222,16 @@ def verify_session(request):
                     payment.mpesa_receipt = query_response.get("MpesaReceiptNumber")
                     payment.phone = normalize_phone(query_response.get("PhoneNumber", payment.phone))
                     payment.save()
+                    record_payment_completed(payment)
+                    pending_payments.dec()
                     logger.info(f"Payment updated via query: transaction_id={checkout_id}, status=completed")
-                elif query_response.get("ResultCode") != 0:
+                elif query_response.get("ResultCode") is not None:
                     payment.status = "failed"
                     payment.is_finished = True
                     payment.is_successful = False
                     payment.completed_at = timezone.now()
                     payment.save()
+                    pending_payments.dec()
                     logger.info(f"Payment marked failed via query: transaction_id={checkout_id}")
             except Exception as e:
                 logger.exception(f"Failed to query M-Pesa for transaction_id={checkout_id}: {str(e)}")
@@ -321,7 +309,7 @@ def register_url(request):
             "ValidationURL": os.getenv("MPESA_CALLBACK_URL") + "/mpesa/callback/"
         }
         url = "https://sandbox.safaricom.co.ke/mpesa/c2b/v1/registerurl"
-        response = requests.post(url, json=payload, headers=headers)
+        response = get_client().post(url, json=payload, headers=headers)
         logger.info(f"Register URL response: {json.dumps(response.json(), indent=2)}")
         return JsonResponse(response.json())
     except Exception as e:
@@ -1,9 +1,24 @@
 import axiosInstance from "./axios";
 
-export const fetchActiveUsers = async () => {
+// List endpoints return {next, previous, results} pages, newest first. Fetch
+// one page at a time and pass its next/previous cursor back in to move
+// through the list, so a screen never loads a whole table
+const cursorOf = (link) => (link ? new URL(link, window.location.origin).searchParams.get('cursor') : null);
+
+export const fetchPage = async (url, params = {}, cursor = null) => {
+  const response = await axiosInstance.get(url, {
+    params: { ...params, ...(cursor ? { cursor } : {}) }
+  });
+  const data = response.data;
+  if (!Array.isArray(data?.results)) {
+    return { results: Array.isArray(data) ? data : [], next: null, previous: null };
+  }
+  return { results: data.results, next: cursorOf(data.next), previous: cursorOf(data.previous) };
+};
+
+export const fetchActiveUsers = async (cursor = null) => {
   try {
-    const response = await axiosInstance.get('/api/active-users/');
-    return response.data;
+    return await fetchPage('/api/active-users/', {}, cursor);
   } catch (error) {
     console.error('Error fetching active users:', error);
     throw error; // Re-throw to handle in components
@@ -18,10 +18,13 @@ import {
 } from '@mui/material';
 import { PersonAdd, Delete, Refresh } from '@mui/icons-material';
 import PageLayout from './PageLayout';
+import CursorPager from './CursorPager';
 import { fetchActiveUsers, disconnectUser, fetchActiveUserStats } from '../api/api_service';
 
 const ActiveUsers = () => {
   const [activeUsers, setActiveUsers] = useState([]);
+  const [cursor, setCursor] = useState(null);
+  const [page, setPage] = useState({ next: null, previous: null });
   const [loading, setLoading] = useState(true);
   const [stats, setStats] = useState(null);
   const [selectedUser, setSelectedUser] = useState(null);
@@ -34,11 +37,12 @@ const ActiveUsers = () => {
   const fetchData = async () => {
     setLoading(true);
     try {
-      const [users, statsData] = await Promise.all([
-        fetchActiveUsers(),
+      const [{ results, next, previous }, statsData] = await Promise.all([
+        fetchActiveUsers(cursor),
         fetchActiveUserStats(),
       ]);
-      setActiveUsers(users);
+      setActiveUsers(results);
+      setPage({ next, previous });
       setStats(statsData);
     } catch (error) {
       setSnackbar({
@@ -53,7 +57,7 @@ const ActiveUsers = () => {
 
   useEffect(() => {
     fetchData();
-  }, []);
+  }, [cursor]);
 
   const handleDisconnect = async (sessionId) => {
     const success = await disconnectUser(sessionId);
@@ -184,6 +188,7 @@ const ActiveUsers = () => {
               </TableBody>
             </Table>
           </TableContainer>
+          <CursorPager page={page} onChange={setCursor} disabled={loading} />
         </Paper>
       )}
 
@@ -0,0 +1,31 @@
+import React from 'react';
+import { Box, Button } from '@mui/material';
+import { ChevronLeft, ChevronRight } from '@mui/icons-material';
+
+// Previous/Next buttons for a list page loaded with fetchPage; onChange gets
+// the cursor to load, null meaning the first page
+const CursorPager = ({ page, onChange, disabled = false }) => {
+  if (!page?.next && !page?.previous) return null;
+  return (
+    <Box sx={{ display: 'flex', justifyContent: 'flex-end', gap: 1, mt: 2 }}>
+      <Button
+        size="small"
+        startIcon={<ChevronLeft />}
+        disabled={disabled || !page.previous}
+        onClick={() => onChange(page.previous)}
+      >
+        Previous
+      </Button>
+      <Button
+        size="small"
+        endIcon={<ChevronRight />}
+        disabled={disabled || !page.next}
+        onClick={() => onChange(page.next)}
+      >
+        Next
+      </Button>
+    </Box>
+  );
+};
+
+export default CursorPager;
@@ -27,11 +27,15 @@ import {
 } from '@mui/material';
 import { Add, CheckCircle, Cancel, HourglassEmpty } from '@mui/icons-material';
 import axiosInstance from '../api/axios';
+import { fetchPage } from '../api/api_service';
 import PageLayout from './PageLayout';
+import CursorPager from './CursorPager';
 
 const Payments = () => {
   const [tabValue, setTabValue] = useState(0);
   const [payments, setPayments] = useState([]);
+  const [cursor, setCursor] = useState(null);
+  const [page, setPage] = useState({ next: null, previous: null });
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [openModal, setOpenModal] = useState(false);
@@ -43,24 +47,24 @@ const Payments = () => {
     package_id: '',
   });
 
-  // Fetch payments based on tab selection
-  useEffect(() => {
-    const fetchPayments = async () => {
-      try {
-        setLoading(true);
-        const endpoint = tabValue === 0 ? '/api/payments/?checked=true' : '/api/payments/?checked=false';
-        const response = await axiosInstance.get(endpoint);
-        setPayments(response.data);
-      } catch (err) {
-        setError(err.response?.data?.message || 'Failed to fetch payments');
-        console.error('Payment fetch error:', err);
-      } finally {
-        setLoading(false);
-      }
-    };
+  // Fetch one page of payments based on tab selection
+  const fetchPayments = async () => {
+    try {
+      setLoading(true);
+      const { results, next, previous } = await fetchPage('/api/payments/', { checked: tabValue === 0 }, cursor);
+      setPayments(results);
+      setPage({ next, previous });
+    } catch (err) {
+      setError(err.response?.data?.message || 'Failed to fetch payments');
+      console.error('Payment fetch error:', err);
+    } finally {
+      setLoading(false);
+    }
+  };
 
+  useEffect(() => {
     fetchPayments();
-  }, [tabValue]);
+  }, [tabValue, cursor]);
 
   useEffect(() => {
     const fetchPackages = async () => {
@@ -88,6 +92,7 @@ const Payments = () => {
   
   const handleTabChange = (event, newValue) => {
     setTabValue(newValue);
+    setCursor(null);
   };
 
   const handleInputChange = (e) => {
@@ -104,10 +109,12 @@ const Payments = () => {
       const response = await axiosInstance.post('/mpesa/stk-push/', formData);
       
       if (response.data.success) {
-        // Refresh payments list
-        const endpoint = `/api/payments/?checked=${tabValue === 0}`;
-        const updatedPayments = await axiosInstance.get(endpoint);
-        setPayments(updatedPayments.data);
+        // Back to the first page, where the new payment shows up
+        if (cursor) {
+          setCursor(null);
+        } else {
+          await fetchPayments();
+        }
         
         // Close modal and reset form
         setOpenModal(false);
@@ -192,6 +199,7 @@ const Payments = () => {
               </TableBody>
             </Table>
           </TableContainer>
+          <CursorPager page={page} onChange={setCursor} disabled={loading} />
         </Paper>
       )}
 
@@ -25,13 +25,17 @@ import {
 } from '@mui/material';
 import { CloudUpload, PersonAdd } from '@mui/icons-material';
 import axiosInstance from '../api/axios';
+import { fetchPage } from '../api/api_service';
 import PageLayout from './PageLayout';
+import CursorPager from './CursorPager';
 
 const Users = () => {
   const [users, setUsers] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [filter, setFilter] = useState('all');
+  const [cursor, setCursor] = useState(null);
+  const [page, setPage] = useState({ next: null, previous: null });
   const [snackbar, setSnackbar] = useState({
     open: false,
     message: '',
@@ -48,18 +52,17 @@ const Users = () => {
     status: 'active',
   });
 
-  // Fetch users from API
+  // Fetch one page of users from API
   useEffect(() => {
     fetchUsers();
-  }, [filter]);
+  }, [filter, cursor]);
 
   const fetchUsers = async () => {
     try {
       setLoading(true);
-      const response = await axiosInstance.get('/api/users/', {
-        params: { filter }
-      });
-      setUsers(Array.isArray(response.data) ? response.data : []);
+      const { results, next, previous } = await fetchPage('/api/users/', { filter }, cursor);
+      setUsers(results);
+      setPage({ next, previous });
     } catch (err) {
       console.error('Error fetching users:', err);
       setError(err.response?.data?.message || 'Failed to fetch users');
@@ -70,6 +73,11 @@ const Users = () => {
     }
   };
 
+  const changeFilter = (value) => {
+    setFilter(value);
+    setCursor(null);
+  };
+
   const showSnackbar = (message, severity) => {
     setSnackbar({
       open: true,
@@ -129,16 +137,6 @@ const Users = () => {
     }
   };
 
-  const getFilteredCount = (type) => {
-    if (!Array.isArray(users)) return 0;
-    return users.filter(u => {
-      if (type === 'hotspot') return u.user_type === 'hotspot';
-      if (type === 'pppoe') return u.user_type === 'pppoe';
-      if (type === 'paused') return u.status === 'paused';
-      return true;
-    }).length;
-  };
-
   const handleImportUsers = async (file) => {
     try {
       const formData = new FormData();
@@ -174,34 +172,34 @@ const Users = () => {
           <Button 
             variant={filter === 'all' ? 'contained' : 'outlined'} 
             color="primary"
-            onClick={() => setFilter('all')}
+            onClick={() => changeFilter('all')}
             size="small"
           >
-            All ({getFilteredCount('all')})
+            All
           </Button>
           <Button 
             variant={filter === 'hotspot' ? 'contained' : 'outlined'} 
             color="primary"
-            onClick={() => setFilter('hotspot')}
+            onClick={() => changeFilter('hotspot')}
             size="small"
           >
-            Hotspot ({getFilteredCount('hotspot')})
+            Hotspot
           </Button>
           <Button 
             variant={filter === 'pppoe' ? 'contained' : 'outlined'} 
             color="primary"
-            onClick={() => setFilter('pppoe')}
+            onClick={() => changeFilter('pppoe')}
             size="small"
           >
-            PPPoE ({getFilteredCount('pppoe')})
+            PPPoE
           </Button>
           <Button 
             variant={filter === 'paused' ? 'contained' : 'outlined'} 
             color="primary"
-            onClick={() => setFilter('paused')}
+            onClick={() => changeFilter('paused')}
             size="small"
           >
-            Paused ({getFilteredCount('paused')})
+            Paused
           </Button>
         </Box>
         
@@ -303,6 +301,7 @@ const Users = () => {
             </Table>
           </TableContainer>
         )}
+        <CursorPager page={page} onChange={setCursor} disabled={loading} />
       </Paper>
 
       {/* Create User Modal */}
@@ -28,10 +28,14 @@ import {
 import { Add, Refresh, MoreVert } from '@mui/icons-material';
 import PageLayout from './PageLayout';
 import axiosInstance from '../api/axios';
+import { fetchPage } from '../api/api_service';
+import CursorPager from './CursorPager';
 import { format } from 'date-fns';
 
 const Vouchers = () => {
   const [vouchers, setVouchers] = useState([]);
+  const [cursor, setCursor] = useState(null);
+  const [page, setPage] = useState({ next: null, previous: null });
   const [loading, setLoading] = useState(true);
   const [packages, setPackages] = useState([]);
   const [snackbar, setSnackbar] = useState({
@@ -49,14 +53,14 @@ const Vouchers = () => {
   const fetchData = async () => {
     setLoading(true);
     try {
-      const [vouchersRes, packagesRes] = await Promise.all([
-        axiosInstance.get('/api/vouchers/'),
+      const [{ results: voucherRows, next, previous }, packagesRes] = await Promise.all([
+        fetchPage('/api/vouchers/', {}, cursor),
         axiosInstance.get('/api/packages/')
       ]);
 
       // Validate and transform vouchers data
-      const validatedVouchers = Array.isArray(vouchersRes?.data) 
-        ? vouchersRes.data
+      const validatedVouchers = Array.isArray(voucherRows) 
+        ? voucherRows
             .filter(v => v && v.id) // Remove invalid entries
             .map(v => ({
               ...v,
@@ -81,6 +85,7 @@ const Vouchers = () => {
         : [];
 
       setVouchers(validatedVouchers);
+      setPage({ next, previous });
       setPackages(validatedPackages);
     } catch (error) {
       console.error('Fetch error:', error);
@@ -98,7 +103,7 @@ const Vouchers = () => {
 
   useEffect(() => {
     fetchData();
-  }, []);
+  }, [cursor]);
 
     // Handle voucher creation
   const handleCreateVouchers = async () => {
@@ -300,6 +305,7 @@ const Vouchers = () => {
             </TableBody>
           </Table>
         </TableContainer>
+        <CursorPager page={page} onChange={setCursor} disabled={loading} />
       </Paper>
 
       {/* Create Voucher Dialog */}
@@ -1,5 +1,6 @@
 import React, { useEffect, useState } from "react";
-import axios from "axios";
+import { fetchPage, disconnectUser as disconnectSession } from "../api/api_service";
+import CursorPager from "./CursorPager";
 import {
   Button,
   Card,
@@ -34,6 +35,8 @@ import {
 
 const AdminDashboard = () => {
   const [sessions, setSessions] = useState([]);
+  const [cursor, setCursor] = useState(null);
+  const [page, setPage] = useState({ next: null, previous: null });
   const [loading, setLoading] = useState(true);
   const [snackbar, setSnackbar] = useState({
     open: false,
@@ -44,15 +47,9 @@ const AdminDashboard = () => {
 
   const fetchSessions = async () => {
     try {
-      const res = await axios.get("https://afrinet-project.onrender.com/api/sessions/");
-      const data = res.data;
-  
-      if (Array.isArray(data)) {
-        setSessions(data);
-      } else {
-        console.warn("Expected array but got:", data);
-        setSessions([]); // Fallback to empty array to avoid .map() crash
-      }
+      const { results, next, previous } = await fetchPage("/api/sessions/", {}, cursor);
+      setSessions(results);
+      setPage({ next, previous });
     } catch (err) {
       console.error("Error fetching sessions:", err);
       setSnackbar({
@@ -68,7 +65,7 @@ const AdminDashboard = () => {
 
   const disconnectUser = async (id) => {
     try {
-      await axios.post(`https://afrinet-project.onrender.com/api/sessions/disconnect/${id}/`);
+      await disconnectSession(id);
       setSnackbar({
         open: true,
         message: 'User disconnected successfully',
@@ -89,7 +86,7 @@ const AdminDashboard = () => {
     fetchSessions();
     const interval = setInterval(fetchSessions, 30000);
     return () => clearInterval(interval);
-  }, []);
+  }, [cursor]);
 
   const handleCloseSnackbar = () => {
     setSnackbar(prev => ({ ...prev, open: false }));
@@ -216,6 +213,9 @@ const AdminDashboard = () => {
                 </TableBody>
               </Table>
             </TableContainer>
+            <Box sx={{ px: 2, pb: 2 }}>
+              <CursorPager page={page} onChange={setCursor} />
+            </Box>
           </Card>
         )}
       </Box>